@@ -0,0 +1,95 @@
+"""
+Callback routing benchmark.
+
+Compares the routing table used by `bot.callback_response` with the previous approach, which registered one telebot
+callback query handler per action, each with its own `startswith` predicate. Both bots process the same callback
+queries, spread evenly over all the registered actions.
+
+    python benchmarks/callback_routing.py --actions 80 --queries 20000
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import mock
+import telebot
+from telebot import types
+
+from botstarter import bot, util
+
+
+def callback_update(update_id, data):
+    return types.Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "menu"}
+        }
+    })
+
+
+def linear_scan_bot(actions, handler):
+    linear_bot = telebot.TeleBot("123:BENCH", threaded=False)
+    for action in actions:
+        def register(action_name):
+            @linear_bot.callback_query_handler(func=lambda call: call.data.startswith(f"{action_name}:"))
+            def read_callback_response(call):
+                _, values = util.unpack_callback_data(call.data, separator=bot.CALLBACK_ACTION_SPLIT_SEPARATOR)
+                user = bot.users.get_user_by_id(call.from_user.id)
+                bot.answer_callback_query(call)
+                handler(call, user, values)
+
+        register(action)
+    return linear_bot
+
+
+def routing_table_bot(actions, handler):
+    table_bot = telebot.TeleBot("123:BENCH", threaded=False)
+    with mock.patch("botstarter.bot.__bot", table_bot):
+        for action in actions:
+            bot.callback_response(action)(handler)
+    return table_bot
+
+
+def measure(test_bot, updates):
+    started = time.perf_counter()
+    for update in updates:
+        test_bot.process_new_updates([update])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--actions", type=int, default=80, help="number of registered callback actions")
+    parser.add_argument("--queries", type=int, default=20000, help="number of callback queries to process")
+    args = parser.parse_args()
+
+    actions = [f"ACTION_{i}" for i in range(args.actions)]
+    updates = [
+        callback_update(i, util.pack_callback_data(actions[i % args.actions], ["42", "page"], separator="::"))
+        for i in range(args.queries)
+    ]
+
+    handled = []
+    handler = lambda call, user, values: handled.append(values)
+
+    # lightweight stand-ins for the Telegram API and the database, so that only routing is measured
+    fake_users = SimpleNamespace(get_user_by_id=lambda user_id: None, is_admin=lambda user_id: False)
+    with mock.patch("botstarter.bot.answer_callback_query", new=lambda call: None), \
+            mock.patch("botstarter.bot.users", new=fake_users):
+        results = {
+            "linear scan": measure(linear_scan_bot(actions, handler), updates),
+            "routing table": measure(routing_table_bot(actions, handler), updates),
+        }
+
+    assert len(handled) == 2 * args.queries, "Not all callback queries were handled"
+    print(f"{args.queries} callback queries, {args.actions} actions")
+    for name, elapsed in results.items():
+        print(f"{name:>14}: {args.queries / elapsed:>10,.0f} queries/s  ({elapsed * 1e6 / args.queries:.1f} us/query)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Cluster scaling benchmark.
+
+Submits updates from many chats to a local cluster with a CPU-bound handler, and reports the processed updates per
+second for an increasing number of worker processes. With one process, the handlers of all chats share one CPU core
+whatever the number of dispatcher threads; in cluster mode, throughput should grow with the number of processes up to
+the number of CPU cores.
+
+    python benchmarks/cluster_scaling.py --processes 1 2 4 --updates 2000
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from botstarter.cluster import Cluster
+
+_ctx = multiprocessing.get_context("fork")
+_done = None
+_work = 0
+
+
+def _setup():
+    from botstarter import bot
+    bot.init_bot(token="123:BENCH", db_opts={"create_indexes": False})
+
+    @bot.get_bot().message_handler(func=lambda m: True)
+    def handle(message):
+        # CPU-bound work, like rendering or parsing a large payload
+        total = 0
+        for i in range(_work):
+            total += i * i
+        _done.put(total)
+
+
+def _message_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+            "text": "bench"
+        }
+    }
+
+
+def run(processes, updates, chats):
+    global _done
+    _done = _ctx.Queue()
+    cluster = Cluster(_setup, workers=processes, mp_context="fork")
+    cluster.start()
+    # let the workers initialize before measuring
+    time.sleep(1)
+
+    started = time.perf_counter()
+    for update_id in range(1, updates + 1):
+        cluster.submit(_message_update(update_id, 1000 + update_id % chats))
+    for _ in range(updates):
+        _done.get()
+    elapsed = time.perf_counter() - started
+
+    cluster.shutdown(timeout=30)
+    return updates / elapsed
+
+
+def main():
+    global _work
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1],
+                        help="the numbers of worker processes to compare. Default is 1, 2 and the number of CPUs")
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates to process. Default is 2000")
+    parser.add_argument("--chats", type=int, default=100, help="number of distinct chats. Default is 100")
+    parser.add_argument("--work", type=int, default=20000,
+                        help="loop iterations of the CPU-bound handler. Default is 20000")
+    args = parser.parse_args()
+    _work = args.work
+
+    print(f"{'processes':>10} {'updates/s':>12} {'speedup':>8}")
+    baseline = None
+    for processes in sorted(set(args.processes)):
+        throughput = run(processes, args.updates, args.chats)
+        baseline = baseline or throughput
+        print(f"{processes:>10} {throughput:>12,.0f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+A local stand-in for the Telegram Bot API, used by benchmarks to measure the cost of outbound API calls without a
+network round trip to Telegram.
+
+Every request is answered with a successful response: message methods return a message in the requested chat, and
+other methods return True.
+
+    with FakeBotApi() as api:
+        ... telebot calls are sent to api.url ...
+    print(api.calls)
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from telebot import apihelper
+
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendDocument", "sendVenue"}
+
+
+class _FakeBotApiHandler(BaseHTTPRequestHandler):
+    server: "FakeBotApi"
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't let Nagle's algorithm delay the body
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+
+        if method in MESSAGE_METHODS:
+            result = {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": int(params.get("chat_id", 1)), "type": "private"},
+                "text": params.get("text", "")
+            }
+        else:
+            result = True
+
+        with self.server.lock:
+            self.server.calls[method] = self.server.calls.get(method, 0) + 1
+
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _FakeBotApiHandler)
+        self.calls = {}
+        self.lock = threading.Lock()
+        self._previous_api_url = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/bot{{0}}/{{1}}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, name="fake-bot-api", daemon=True).start()
+        self._previous_api_url = apihelper.API_URL
+        apihelper.API_URL = self.url
+        return self
+
+    def __exit__(self, *exc_info):
+        apihelper.API_URL = self._previous_api_url
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,95 @@
+"""
+Import time and startup benchmark.
+
+Imports botstarter modules in fresh interpreters with `python -X importtime`, and reports the median cumulative import
+time of each module and the time to initialize the database layer. Cold start is on the critical path of autoscaled
+workers, so the benchmark can be used as a regression gate: it exits with code 1 if a module exceeds the import time
+budget, or if it imports a module it should only import on first use.
+
+    python benchmarks/importtime.py --budget-ms 300 --forbid telebot requests
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["botstarter.bot", "botstarter.db.base"]
+
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+from botstarter.db.base import init_db
+init_db(create_indexes=False, model_packages=[])
+print(time.perf_counter() - started)
+"""
+
+FORBIDDEN_SCRIPT = """
+import sys
+import {module}
+print(",".join(sorted(m for m in {forbidden!r} if m in sys.modules)))
+"""
+
+
+def _run(args):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, ["src", os.getenv("PYTHONPATH")]))}
+    return subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True, check=True)
+
+
+def import_time(module: str) -> float:
+    """
+    :return: the cumulative import time of the module in milliseconds
+    """
+    stderr = _run(["-X", "importtime", "-c", f"import {module}"]).stderr
+    for line in reversed(stderr.splitlines()):
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"Import time of {module} not found in the output: {stderr}")
+
+
+def startup_time() -> float:
+    """
+    :return: the time to import and initialize the database layer in milliseconds
+    """
+    return float(_run(["-c", STARTUP_SCRIPT]).stdout) * 1000
+
+
+def imported_forbidden(module: str, forbidden) -> list:
+    stdout = _run(["-c", FORBIDDEN_SCRIPT.format(module=module, forbidden=list(forbidden))]).stdout.strip()
+    return stdout.split(",") if stdout else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES,
+                        help="the modules to import. Default is botstarter.bot and botstarter.db.base")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters per module. Default is 5")
+    parser.add_argument("--budget-ms", type=float, help="maximum median import time of each module")
+    parser.add_argument("--forbid", nargs="*", default=[],
+                        help="modules that must not be imported by the measured modules, e.g. telebot requests")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<30} {'median (ms)':>12} {'min (ms)':>10}")
+    for module in args.modules:
+        times = [import_time(module) for _ in range(args.runs)]
+        median = statistics.median(times)
+        over_budget = args.budget_ms is not None and median > args.budget_ms
+        failed |= over_budget
+        print(f"{module:<30} {median:>12.1f} {min(times):>10.1f}{'  OVER BUDGET' if over_budget else ''}")
+
+        imported = imported_forbidden(module, args.forbid) if args.forbid else []
+        if imported:
+            failed = True
+            print(f"  {module} imports {', '.join(imported)}")
+
+    times = [startup_time() for _ in range(args.runs)]
+    print(f"{'init_db startup':<30} {statistics.median(times):>12.1f} {min(times):>10.1f}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+MarkdownV2 escaping microbenchmark.
+
+Compares `util.str2mdown` on 4 KB messages with the previous implementation, which chained five `str.replace` calls
+and only escaped five of the eighteen reserved characters.
+
+    python benchmarks/str2mdown.py --size 4096 --number 20000
+"""
+import argparse
+import timeit
+
+from botstarter import util
+
+SAMPLE = ("Order #1234 confirmed! Total: 12.50 EUR (+2.00 shipping). See *details* at [your orders](https://x.io/o) "
+          "or reply with `help` - we'll get back to you > soon. Use code {WELCOME_10} = 10% off | T&C apply.\n")
+
+
+def legacy_str2mdown(text):
+    return text.replace("-", "\\-") \
+        .replace("!", "\\!") \
+        .replace(".", "\\.") \
+        .replace(">", "\\>") \
+        .replace("_", "\\_")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=4096, help="message size in characters. Default is 4096")
+    parser.add_argument("--number", type=int, default=20000, help="number of messages to escape. Default is 20000")
+    args = parser.parse_args()
+
+    text = (SAMPLE * (args.size // len(SAMPLE) + 1))[:args.size]
+    cases = {
+        "five str.replace (legacy)": lambda: legacy_str2mdown(text),
+        "str2mdown": lambda: util.str2mdown(text),
+        "str2mdown keep_entities": lambda: util.str2mdown(text, keep_entities=True),
+    }
+
+    print(f"{args.number} messages of {len(text)} characters")
+    for name, func in cases.items():
+        elapsed = min(timeit.repeat(func, number=args.number, repeat=3))
+        print(f"{name:>26}: {args.number / elapsed:>10,.0f} msgs/s  ({elapsed * 1e6 / args.number:.1f} us/msg)")
+
+
+if __name__ == "__main__":
+    main()
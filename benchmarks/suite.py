@@ -0,0 +1,370 @@
+"""
+Benchmark suite for the dispatch and data hot paths.
+
+Every benchmark runs a single operation many times and reports throughput and latency percentiles. Telegram API
+calls are answered by a local fake Bot API server, and the database is mongomock unless a local MongoDB server is
+given with --mongo-uri.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --only callback --actions 200
+    python benchmarks/suite.py --save baseline.json
+    python benchmarks/suite.py --compare baseline.json --tolerance 0.2
+
+With --compare, the exit code is 1 if the throughput of any benchmark dropped by more than the tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from contextlib import ExitStack
+from types import SimpleNamespace
+
+import mock
+import mongomock
+import pymongo
+import telebot
+from bson import ObjectId
+from telebot import types
+
+from botstarter import bot, templates, util
+from botstarter.callbacks import CallbackCodec
+from botstarter.db.base import Base
+from botstarter.db.document import Document
+from botstarter.db.writebehind import WriteBehindBuffer
+from botstarter.db.users import User
+from botstarter.ratelimit import SendScheduler
+from botstarter.transport import HttpTransport
+from fake_bot_api import FakeBotApi
+
+BENCHMARKS = {}
+
+MARKDOWN_TEXT = ("Hello *world*! Check https://example.com/a_b-c?x=1 (v1.2.3) #tag > quote ~ `code` | [link] "
+                 "{braces} = + ! ") * 4
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function receives the suite context and returns the function to measure.
+    """
+
+    def wrapper(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return wrapper
+
+
+def message_update(update_id, user_id, text):
+    return types.Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": text
+        }
+    })
+
+
+def callback_update(update_id, user_id, data):
+    return types.Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "message": {
+                "message_id": 1,
+                # messages with date 0 are inaccessible messages
+                "date": 1,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 123, "is_bot": True, "first_name": "bot"},
+                "text": "menu"
+            }
+        }
+    })
+
+
+def new_bot(ctx):
+    """
+    Creates a bot sending API calls to the fake Bot API, without rate limits, and installs it as the botstarter bot.
+    API calls are sent with the botstarter HTTP transport, unless --telebot-transport is given.
+    """
+    test_bot = telebot.TeleBot("123:BENCH", threaded=False, parse_mode="MarkdownV2")
+    ctx.stack.enter_context(mock.patch("botstarter.bot.__bot", test_bot))
+    ctx.stack.enter_context(mock.patch("botstarter.bot.__scheduler", SendScheduler(
+        global_rate=1e9, chat_rate=1e9, chat_burst=1e9, group_rate=1e9, group_burst=1e9
+    )))
+    if not ctx.telebot_transport:
+        transport = HttpTransport()
+        transport.install()
+        ctx.stack.callback(transport.close)
+    return test_bot
+
+
+@benchmark("util.pack_unpack_callback_data")
+def bench_pack_unpack(ctx):
+    params = ["42", "page::2", "sort"]
+    return lambda i: util.unpack_callback_data(util.pack_callback_data("ACTION", params, "::"), "::")
+
+
+@benchmark("callbacks.compact_pack_unpack")
+def bench_compact_pack_unpack(ctx):
+    codec = CallbackCodec(actions={"ACTION": 1})
+    params = [42, ObjectId(), "sort"]
+    return lambda i: codec.unpack(codec.pack("ACTION", params))
+
+
+@benchmark("util.str2mdown")
+def bench_str2mdown(ctx):
+    return lambda i: util.str2mdown(MARKDOWN_TEXT)
+
+
+MENU_TEMPLATE = (
+    "Welcome back, {name}!\n\n"
+    "Your plan: {plan} (renews on {renewal}).\n\n"
+    + "- Orders: track deliveries, download invoices (PDF) and request refunds.\n"
+      "- Settings: language, notifications & privacy - changes apply immediately.\n"
+      "- Support: type /help or reply to this message; we answer within 24h.\n" * 6
+)
+
+
+@benchmark("templates.format_then_escape")
+def bench_format_then_escape(ctx):
+    values = {"name": "Ada_L", "plan": "Pro+", "renewal": "2030-01-01"}
+    return lambda i: util.str2mdown(MENU_TEMPLATE.format(**values))
+
+
+@benchmark("templates.render")
+def bench_template_render(ctx):
+    template = templates.Template(MENU_TEMPLATE)
+    values = {"name": "Ada_L", "plan": "Pro+", "renewal": "2030-01-01"}
+    return lambda i: template.render(**values)
+
+
+@benchmark("bot.user_reply_to_waiting_on")
+def bench_user_reply(ctx):
+    """
+    A text message from a user the bot is waiting on: user_handler -> catch_all -> ALL_WAITING_ON_CALLBACKS handler,
+    which replies with send_message.
+    """
+    test_bot = new_bot(ctx)
+    bot._init_decorators()
+    bot.user_msg_callback("BENCH_REPLY")(lambda msg, user, params: bot.send_message(msg.chat.id, "Thanks!"))
+
+    users = [User({"id": 1000 + i}) for i in range(ctx.users)]
+
+    def run(i):
+        user = users[i % len(users)]
+        bot.wait_on_user_reply(user, "BENCH_REPLY", str(i))
+        test_bot.process_new_updates([message_update(i, user.id, "reply")])
+
+    return run
+
+
+@benchmark("bot.callback_routing")
+def bench_callback_routing(ctx):
+    """
+    Callback queries spread over --actions registered callback_response handlers.
+    """
+    test_bot = new_bot(ctx)
+    handled = []
+    for a in range(ctx.actions):
+        bot.callback_response(f"ACTION_{a}")(lambda call, user, values: handled.append(values))
+
+    updates = [
+        callback_update(i, 1000 + i % ctx.users, util.pack_callback_data(f"ACTION_{i % ctx.actions}", ["42"], "::"))
+        for i in range(ctx.iterations + ctx.warmup)
+    ]
+    return lambda i: test_bot.process_new_updates([updates[i]])
+
+
+class BenchDocument(Base):
+    pass
+
+
+class BenchTypedDocument(Document):
+    id: int
+    name: str
+    counter: int = 0
+
+
+def _bench_collection(ctx, model=BenchDocument):
+    collection = ctx.db.bench_documents
+    if isinstance(collection, mongomock.Collection):
+        # mongomock doesn't support the UpdateOne operations of recent pymongo versions
+        def bulk_write(requests, ordered=True):
+            for request in requests:
+                collection.update_one(request._filter, request._doc)
+
+        collection.bulk_write = bulk_write
+    ctx.stack.enter_context(mock.patch.object(model, "__collection__", collection))
+    return collection
+
+
+@benchmark("db.insert")
+def bench_db_insert(ctx):
+    _bench_collection(ctx)
+    return lambda i: BenchDocument({"id": i, "name": "bench", "counter": 0}).save()
+
+
+@benchmark("db.find_one")
+def bench_db_find_one(ctx):
+    collection = _bench_collection(ctx)
+    collection.create_index("id")
+    collection.insert_many([{"id": i, "name": "bench", "counter": 0} for i in range(ctx.users)])
+    return lambda i: BenchDocument.find_one({"id": i % ctx.users})
+
+
+@benchmark("db.find_one_document")
+def bench_db_find_one_document(ctx):
+    """
+    The same reads as db.find_one, of a typed document model that only fetches its declared fields.
+    """
+    collection = _bench_collection(ctx, BenchTypedDocument)
+    collection.create_index("id")
+    collection.insert_many([{"id": i, "name": "bench", "counter": 0, "history": ["event"] * 20}
+                            for i in range(ctx.users)])
+    return lambda i: BenchTypedDocument.find_one({"id": i % ctx.users})
+
+
+@benchmark("db.update_one")
+def bench_db_update_one(ctx):
+    collection = _bench_collection(ctx)
+    collection.create_index("id")
+    collection.insert_many([{"id": i, "name": "bench", "counter": 0} for i in range(ctx.users)])
+    return lambda i: BenchDocument.update_one({"id": i % ctx.users}, {"$inc": {"counter": 1}})
+
+
+@benchmark("db.update_one_write_behind")
+def bench_db_update_one_write_behind(ctx):
+    """
+    The same updates as db.update_one, buffered and coalesced by a write-behind buffer.
+    """
+    collection = _bench_collection(ctx)
+    collection.create_index("id")
+    collection.insert_many([{"id": i, "name": "bench", "counter": 0} for i in range(ctx.users)])
+    buffer = WriteBehindBuffer(flush_interval=0.1)
+    ctx.stack.enter_context(mock.patch.object(BenchDocument, "__write_behind__", buffer))
+    ctx.stack.callback(buffer.close)
+    return lambda i: BenchDocument.update_one({"id": i % ctx.users}, {"$inc": {"counter": 1}})
+
+
+@benchmark("db.remove")
+def bench_db_remove(ctx):
+    collection = _bench_collection(ctx)
+    n = ctx.iterations + ctx.warmup
+    ids = collection.insert_many([{"id": i, "name": "bench"} for i in range(n)]).inserted_ids
+    docs = [BenchDocument({"_id": ObjectId(oid)}) for oid in ids]
+    return lambda i: docs[i].remove()
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_benchmark(name, setup, args):
+    if args.mongo_uri:
+        client = pymongo.MongoClient(args.mongo_uri)
+        client.drop_database("botstarter_benchmarks")
+        db = client["botstarter_benchmarks"]
+    else:
+        db = mongomock.MongoClient().db
+
+    with ExitStack() as stack, FakeBotApi() as api:
+        ctx = SimpleNamespace(stack=stack, db=db, iterations=args.iterations, warmup=args.warmup,
+                              actions=args.actions, users=args.users, api=api,
+                              telebot_transport=args.telebot_transport)
+        stack.enter_context(mock.patch.object(User, "__collection__", db.users))
+        stack.enter_context(mock.patch.dict("botstarter.bot.ALL_CALLBACK_ACTIONS", clear=True))
+        stack.enter_context(mock.patch.dict("botstarter.bot.ALL_WAITING_ON_CALLBACKS", clear=True))
+        User.__cache__.clear()
+        run = setup(ctx)
+
+        for i in range(args.warmup):
+            run(i)
+
+        latencies = []
+        started = time.perf_counter()
+        for i in range(args.warmup, args.warmup + args.iterations):
+            t = time.perf_counter()
+            run(i)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+
+    if args.mongo_uri:
+        client.drop_database("botstarter_benchmarks")
+        client.close()
+
+    latencies.sort()
+    return {
+        "iterations": args.iterations,
+        "ops_per_sec": args.iterations / elapsed,
+        "p50_us": percentile(latencies, 0.50) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'benchmark':<34} {'baseline ops/s':>15} {'ops/s':>12} {'change':>8}")
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        change = result["ops_per_sec"] / previous["ops_per_sec"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<34} {previous['ops_per_sec']:>15,.0f} {result['ops_per_sec']:>12,.0f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="number of measured operations per benchmark")
+    parser.add_argument("--warmup", type=int, default=200, help="number of operations run before measuring")
+    parser.add_argument("--actions", type=int, default=50, help="number of registered callback actions")
+    parser.add_argument("--users", type=int, default=100, help="number of distinct users sending updates")
+    parser.add_argument("--only", help="run only the benchmarks whose name contains this string")
+    parser.add_argument("--telebot-transport", action="store_true",
+                        help="send API calls with telebot's default HTTP transport instead of botstarter's")
+    parser.add_argument("--mongo-uri", help="run database benchmarks on a MongoDB server instead of mongomock")
+    parser.add_argument("--save", metavar="PATH", help="save the results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="the throughput drop reported as a regression when comparing. Default is 0.2")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'benchmark':<34} {'ops/s':>12} {'p50 (us)':>10} {'p99 (us)':>10}")
+    for name, setup in BENCHMARKS.items():
+        if args.only and args.only not in name:
+            continue
+        result = results[name] = run_benchmark(name, setup, args)
+        print(f"{name:<34} {result['ops_per_sec']:>12,.0f} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "database": "mongodb" if args.mongo_uri else "mongomock",
+                "results": results
+            }, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
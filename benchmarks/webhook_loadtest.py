@@ -0,0 +1,110 @@
+"""
+Webhook load-test harness.
+
+Starts the botstarter webhook server on localhost, backed by the update dispatcher and a bot with a no-op message
+handler, then POSTs synthetic updates from concurrent clients. No request leaves the machine: handlers never call
+the Telegram API and the database is not used.
+
+    python benchmarks/webhook_loadtest.py --requests 20000 --clients 16 --workers 4
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from statistics import quantiles
+
+import telebot
+
+from botstarter.dispatch import UpdateDispatcher
+from botstarter.webhook import WebhookServer, SECRET_TOKEN_HEADER
+
+SECRET = "loadtest"
+PATH = "/webhook"
+
+
+def synthetic_update(update_id, chat_id):
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "load", "username": f"user{chat_id}"},
+            "text": f"message {update_id}"
+        }
+    }).encode()
+
+
+def run_client(address, update_ids, chats, latencies, errors):
+    conn = http.client.HTTPConnection(*address)
+    headers = {"Content-Type": "application/json", SECRET_TOKEN_HEADER: SECRET}
+    for update_id in update_ids:
+        body = synthetic_update(update_id, chat_id=update_id % chats)
+        started = time.perf_counter()
+        conn.request("POST", PATH, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        if response.status != 200:
+            errors.append(response.status)
+            conn.close()
+            conn = http.client.HTTPConnection(*address)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000, help="number of updates to post")
+    parser.add_argument("--clients", type=int, default=8, help="number of concurrent HTTP clients")
+    parser.add_argument("--chats", type=int, default=1000, help="number of distinct chats")
+    parser.add_argument("--workers", type=int, default=4, help="number of dispatcher workers")
+    parser.add_argument("--handler-ms", type=float, default=0, help="simulated handler latency in milliseconds")
+    args = parser.parse_args()
+
+    bot = telebot.TeleBot("123456:LOADTEST", threaded=False)
+    processed = []
+    all_processed = threading.Event()
+
+    @bot.message_handler(func=lambda msg: True)
+    def handler(msg):
+        if args.handler_ms:
+            time.sleep(args.handler_ms / 1000)
+        processed.append(msg.message_id)
+        if len(processed) >= args.requests:
+            all_processed.set()
+
+    dispatcher = UpdateDispatcher(bot.process_new_updates, workers=args.workers, max_queue_size=1000)
+    dispatcher.start()
+    server = WebhookServer(lambda update: dispatcher.submit(update, timeout=5), host="127.0.0.1", port=0,
+                           path=PATH, secret_token=SECRET)
+    server.start()
+
+    latencies, errors, threads = [], [], []
+    started = time.perf_counter()
+    for c in range(args.clients):
+        ids = range(c + 1, args.requests + 1, args.clients)
+        t = threading.Thread(target=run_client, args=(server.server_address, ids, args.chats, latencies, errors))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    acked = time.perf_counter() - started
+
+    all_processed.wait(timeout=60)
+    done = time.perf_counter() - started
+
+    server.shutdown()
+    server.server_close()
+    dispatcher.shutdown()
+
+    cuts = quantiles(latencies, n=100)
+    print(f"requests:      {args.requests} from {args.clients} clients, {args.workers} dispatcher workers")
+    print(f"acknowledged:  {args.requests / acked:,.0f} req/s "
+          f"(p50 {cuts[49] * 1000:.2f} ms, p99 {cuts[98] * 1000:.2f} ms)")
+    print(f"processed:     {len(processed) / done:,.0f} updates/s ({len(processed)} updates)")
+    print(f"errors:        {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,16 @@ setup(
         "charset-normalizer==2.0.7; python_version >= '3'",
         "idna==3.3; python_version >= '3'",
         "pymongo==3.12.1",
-        "pytelegrambotapi==4.2.0",
+        "pytelegrambotapi==4.6.0",
         "requests==2.26.0; python_version >= '2.7' and python_version not in '3.0, 3.1, 3.2, 3.3, 3.4, 3.5'",
         "urllib3==1.26.7; python_version >= '2.7' and python_version not in '3.0, 3.1, 3.2, 3.3, 3.4' and python_version < '4'",
     ],
+    extras_require={
+        "aio": [
+            "aiohttp>=3.8,<3.10",
+            "motor<3",
+        ],
+    },
     name="py-bot-starter",
     version="0.0.0",
     author="Manuel Castellin",
@@ -29,6 +35,11 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
+    entry_points={
+        "console_scripts": [
+            "botstarter=botstarter.cli:main",
+        ],
+    },
     package_dir={"": "src"},
     packages=find_packages(where="src"),
     python_requires=">=3.8",
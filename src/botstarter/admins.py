@@ -0,0 +1,183 @@
+"""
+In-memory registry of the bot admins.
+
+Admin authorization checks of `admin_handler` and `callback_response(admin_only=True)` look up the user id in a frozen
+set of admin ids, instead of querying the database for every admin command or button press. The set is loaded in the
+background when the registry is started by `bot.init_bot`, so that the first admin command is answered from memory,
+and reloaded:
+  - when it's older than the refresh interval
+  - when an admin is added or removed with `users.set_admin`, in the same process
+  - on every change of the `is_admin` field, if the registry watches a MongoDB change stream. Change streams require
+    a replica set, and admin changes are visible to other processes without waiting for the refresh interval
+
+The registry is configured with the `admin_opts` parameter of `bot.init_bot`:
+
+    bot.init_bot(admin_opts={"refresh_interval": 300, "watch": True})
+"""
+import logging
+import threading
+from time import monotonic
+from typing import FrozenSet, Optional
+
+from pymongo.errors import PyMongoError
+
+from botstarter.db.users import User
+
+"""
+Default number of seconds after which the admin set is reloaded from the database
+"""
+DEFAULT_REFRESH_INTERVAL = 60
+
+"""
+Number of seconds the change stream watcher waits before watching again after an error
+"""
+WATCH_RETRY_DELAY = 30
+
+
+class AdminRegistry:
+    """
+    The set of admin user ids, kept in memory.
+    """
+
+    def __init__(self, refresh_interval: Optional[float] = DEFAULT_REFRESH_INTERVAL, watch: bool = False):
+        """
+        :param refresh_interval: optional: the number of seconds after which the admin set is reloaded. None means
+                                 the set is only reloaded when invalidated. Default is 60
+        :param watch: optional: invalidate the admin set on changes of the users `is_admin` field, watching a
+                      MongoDB change stream in a background thread. Default is False
+        """
+        self.refresh_interval = refresh_interval
+        self.watch = watch
+        self._admins: Optional[FrozenSet[int]] = None
+        self._expires_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._expiry_lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def load(self) -> FrozenSet[int]:
+        """
+        Reads the admin ids from the database.
+
+        :return: the frozen set of admin ids
+        """
+        generation = self._generation
+        docs = User.__collection__.find({"is_admin": True}, projection={"id": True, "_id": False})
+        admins = frozenset(doc["id"] for doc in docs if "id" in doc)
+        self._admins = admins
+        with self._expiry_lock:
+            # a set invalidated while it was read may miss the change, and it's read again on the next check
+            if self._generation == generation:
+                self._expires_at = monotonic() + self.refresh_interval if self.refresh_interval is not None else None
+        logging.debug("Loaded %d admins", len(admins))
+        return admins
+
+    def get_admins(self) -> FrozenSet[int]:
+        """
+        :return: the frozen set of admin ids, reloaded if it's missing or expired
+        """
+        admins = self._admins
+        if admins is not None and (self._expires_at is None or self._expires_at > monotonic()):
+            return admins
+
+        # only one thread reloads the set, the others keep using the previous one if there is one
+        if self._lock.acquire(blocking=admins is None):
+            try:
+                if self._admins is admins:
+                    admins = self.load()
+                else:
+                    admins = self._admins
+            finally:
+                self._lock.release()
+        return admins
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.get_admins()
+
+    def invalidate(self):
+        """
+        Reloads the admin set on the next check.
+        """
+        with self._expiry_lock:
+            self._generation += 1
+            self._expires_at = 0.0
+
+    def start(self):
+        """
+        Loads the admin set in a background thread, and then watches the users collection for admin changes, if the
+        registry is configured to watch them. The database is not read by the calling thread, so that starting the
+        bot does not wait for an unreachable database.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        # the checks made while the set is loaded wait for it, instead of reading it again
+        self._lock.acquire()
+        self._thread = threading.Thread(target=self._run, name="botstarter-admins", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def _run(self):
+        try:
+            self.load()
+        except (PyMongoError, RuntimeError) as e:
+            logging.warning("Could not load the admins, they are loaded on the first check: %s", e)
+        finally:
+            self._lock.release()
+        if self.watch:
+            self._watch()
+
+    def _watch(self):
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace", "delete"]}},
+            {"updateDescription.updatedFields.is_admin": {"$exists": True}},
+            {"updateDescription.removedFields": "is_admin"}
+        ]}}]
+        while not self._stopped.is_set():
+            try:
+                with User.__collection__.watch(pipeline, max_await_time_ms=1000) as stream:
+                    # changes made before the stream was opened are missed: the set is read again after it's opened,
+                    # and the changes received while it's read invalidate it again
+                    self.load()
+                    while not self._stopped.is_set():
+                        if stream.try_next() is not None:
+                            self.invalidate()
+            except PyMongoError as e:
+                logging.warning("Could not watch admin changes, retrying in %d seconds: %s", WATCH_RETRY_DELAY, e)
+                self._stopped.wait(WATCH_RETRY_DELAY)
+
+
+__registry = AdminRegistry()
+
+
+def init_registry(**kwargs) -> AdminRegistry:
+    """
+    Replaces the global admin registry with a new one and starts it.
+
+    :param kwargs: keyword arguments for the AdminRegistry object creation
+    :return: the AdminRegistry object
+    """
+    global __registry
+    __registry.stop()
+    __registry = AdminRegistry(**kwargs)
+    __registry.start()
+    return __registry
+
+
+def get_registry() -> AdminRegistry:
+    return __registry
+
+
+def is_admin(user_id: int) -> bool:
+    """
+    :return: True if the user is an admin, according to the global admin registry
+    """
+    return __registry.is_admin(user_id)
+
+
+def invalidate():
+    __registry.invalidate()
@@ -0,0 +1,463 @@
+"""
+Asyncio version of the `botstarter.bot` API.
+
+Handlers registered with the decorators in this module are coroutines, run by telebot's AsyncTeleBot on an asyncio
+event loop, and the database is accessed with the asyncio driver from `botstarter.db.aio`. A single process can
+serve many concurrent chats without using a thread for each request.
+
+    from botstarter import aio
+
+    aio.init_bot()
+
+    @aio.user_handler(commands=["echo"])
+    async def echo_handler(msg, user, **kwargs):
+        await aio.send_message(msg.chat.id, text=msg.text)
+
+    aio.start()
+"""
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+try:
+    import aiohttp
+    from telebot.async_telebot import AsyncTeleBot
+    from telebot.asyncio_helper import RequestTimeout
+except ImportError as e:
+    raise ImportError("The botstarter.aio module requires the 'aiohttp' package. "
+                      "Install it with: pip install py-bot-starter[aio]") from e
+from telebot import types
+
+from botstarter import util
+from botstarter.db import aio as db
+from botstarter.state import parse_waiting_on
+from botstarter.transport import IDEMPOTENT_METHOD_PREFIX
+
+RETRY_TIMEOUT_INCREASE = 20
+
+__bot = None
+__markdown_entities = False
+
+
+def init_bot(db_opts=None, token=None, parse_mode="MarkdownV2", markdown_entities=False, **kwargs) -> AsyncTeleBot:
+    """
+    Initializes a Telebot's AsyncTeleBot object and the asyncio db middleware.
+
+    :param db_opts: optional: database connection options
+    :param token: optional: the Telegram bot token, can be supplied via the 'BOT_TOKEN' env variable
+    :param parse_mode: optional: the default parse mode for the bot api. Default is 'MarkdownV2'
+    :param markdown_entities: optional: keep the MarkdownV2 formatting of message texts. See `botstarter.bot.init_bot`
+    :param kwargs: additional keyword arguments for the AsyncTeleBot object creation
+    :return: the created telebot.async_telebot.AsyncTeleBot object
+    """
+    if db_opts is None:
+        db_opts = {}
+    db.init_db(**db_opts)
+
+    global __markdown_entities
+    __markdown_entities = markdown_entities
+
+    p_bot_token = token or os.getenv("BOT_TOKEN")
+
+    if p_bot_token:
+
+        global __bot
+        __bot = AsyncTeleBot(
+            token=p_bot_token,
+            parse_mode=parse_mode,
+            **kwargs
+        )
+        return __bot
+    else:
+        raise ValueError(
+            "A bot token must be specified either via the 'token' parameter or the 'BOT_TOKEN' environment variable")
+
+
+def get_bot() -> AsyncTeleBot:
+    """
+    Returns the global object to interact with the Telegram API.
+
+    :return: the telebot.async_telebot.AsyncTeleBot global object.
+    """
+    global __bot
+    if __bot:
+        return __bot
+    else:
+        raise RuntimeError("Bot has not been initialized.")
+
+
+def __not_sent(error: Exception) -> bool:
+    # telebot raises RequestTimeout from the aiohttp error of the last attempt
+    cause = error.__cause__ or error.__context__
+    return isinstance(cause, aiohttp.ClientConnectorError)
+
+
+async def __wrap_call(func, **kwargs):
+    timeout = kwargs.pop("timeout")
+    if not timeout:
+        timeout = 20
+
+    try:
+        return await func(**kwargs, timeout=timeout)
+    except (RequestTimeout, asyncio.TimeoutError) as e:
+        # a request that timed out may have been processed, e.g. a message may have been sent: it is only retried for
+        # the methods that read data, or if the connection could not be established
+        if not getattr(func, "__name__", "").startswith(IDEMPOTENT_METHOD_PREFIX) and not __not_sent(e):
+            raise
+        logging.debug("Telegram function call timed out. Re-trying with %d seconds timeout...", timeout)
+        await asyncio.sleep(2)
+        return await func(**kwargs, timeout=timeout + RETRY_TIMEOUT_INCREASE)
+
+
+def __wrap_text(text, parse_mode=None):
+    if text:
+        if parse_mode == "MarkdownV2":
+            return util.str2mdown(text, keep_entities=__markdown_entities)
+        else:
+            return text
+    else:
+        return None
+
+
+async def send_typing(chat_id, timeout=10):
+    await get_bot().send_chat_action(chat_id, "typing", timeout)
+
+
+async def send_message(chat_id, text, reply_markup=None, timeout=20, **kwargs):
+    logging.debug("Sending message to user with id %d", chat_id)
+    return await __wrap_call(
+        get_bot().send_message,
+        chat_id=chat_id,
+        text=__wrap_text(text, get_bot().parse_mode),
+        reply_markup=reply_markup,
+        timeout=timeout,
+        **kwargs
+    )
+
+
+async def reply_to(reply_to_msg, text, reply_markup=None, timeout=20):
+    logging.debug("Sending reply to msg to user with id %d", reply_to_msg.from_user.id)
+    return await __wrap_call(
+        get_bot().reply_to,
+        message=reply_to_msg,
+        text=__wrap_text(text, get_bot().parse_mode),
+        reply_markup=reply_markup,
+        timeout=timeout
+    )
+
+
+async def edit_message_reply_markup(edit_msg, reply_markup=None):
+    logging.debug("Updating msg markup to user with id %d", edit_msg.from_user.id)
+    await get_bot().edit_message_reply_markup(
+        chat_id=edit_msg.chat.id,
+        message_id=edit_msg.message_id,
+        reply_markup=reply_markup
+    )
+
+
+async def edit_message_text(edit_msg, text, **kwargs):
+    logging.debug("Updating msg text to user with id %d", edit_msg.from_user.id)
+    return await get_bot().edit_message_text(
+        chat_id=edit_msg.chat.id,
+        text=__wrap_text(text, get_bot().parse_mode),
+        message_id=edit_msg.message_id,
+        **kwargs
+    )
+
+
+async def edit_message_id_text(chat_id, message_id, text, **kwargs):
+    logging.debug("Updating msg text to chat with id %d", chat_id)
+    return await get_bot().edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=__wrap_text(text, get_bot().parse_mode),
+        **kwargs
+    )
+
+
+async def answer_callback_query(call, text=None, show_alert=False):
+    logging.debug("Answering callback query to user %d", call.message.from_user.id)
+    await get_bot().answer_callback_query(
+        call.id,
+        text=__wrap_text(text, get_bot().parse_mode),
+        show_alert=show_alert
+    )
+
+
+async def send_venue(chat_id, latitude, longitude, title, address, timeout=20, **kwargs):
+    logging.debug("Sending venue to user with id %d", chat_id)
+    await __wrap_call(
+        get_bot().send_venue,
+        chat_id=chat_id,
+        latitude=latitude,
+        longitude=longitude,
+        title=title,
+        address=address,
+        timeout=timeout,
+        **kwargs
+    )
+
+
+async def send_photo(chat_id, photo, timeout=30):
+    logging.debug("Sending photo to user with id %d", chat_id)
+    return await __wrap_call(
+        get_bot().send_photo,
+        chat_id=chat_id,
+        photo=photo,
+        timeout=timeout
+    )
+
+
+async def delete_message(message=None, chat_id=None, message_id=None, timeout=20):
+    if message:
+        _chat_id = message.chat.id
+        _message_id = message.message_id
+    else:
+        _chat_id = chat_id
+        _message_id = message_id
+
+    if _chat_id and _message_id:
+        logging.debug("Deleting message for chat with id %d", _chat_id)
+        await __wrap_call(
+            get_bot().delete_message,
+            chat_id=_chat_id,
+            message_id=_message_id,
+            timeout=timeout
+        )
+    else:
+        raise Exception("Both message and (chat_id,message_id) are None. One must be defined to delete the message.")
+
+
+async def set_my_commands(commands: List[types.BotCommand],
+                          scope: Optional[types.BotCommandScope] = None,
+                          language_code: Optional[str] = None) -> bool:
+    return await get_bot().set_my_commands(commands, scope, language_code)
+
+
+"""
+Default callback_data parameters separator. It must match the separator used by `botstarter.bot` when both APIs
+share the same database.
+"""
+CALLBACK_ACTION_SPLIT_SEPARATOR = "::"
+
+ALL_WAITING_ON_CALLBACKS = {}
+
+ALL_CALLBACK_ACTIONS = {}
+
+__callback_router_bot = None
+
+
+def admin_handler(commands):
+    """
+    Creates a new message handler for bot admin requests.
+
+    :param commands: the message handler commands
+    :return:
+    """
+
+    def function_decorator(func):
+        bot = get_bot()
+
+        @bot.message_handler(commands=commands)
+        async def check_message_from_admin(*args, **kwargs):
+            msg = args[0]
+            user_id = msg.from_user.id
+            secure_chat_id = msg.from_user.id
+            user = await db.get_user_by_id(msg.from_user.id)
+
+            logging.info(f"admin request from user with id {user_id}")
+            if user is not None and bool(user.is_admin):
+                logging.info(f"admin request GRANTED to user {user_id}")
+                return await func(*args, user_id, secure_chat_id, **kwargs)
+            else:
+                logging.info(f"admin request was DENIED for user with id {user_id}")
+                return
+
+        return check_message_from_admin
+
+    return function_decorator
+
+
+def user_handler(*args, **kwargs):
+    """
+    Registers a message handler for user requests.
+
+    :return: the wrapper decorator function
+    """
+
+    def wrapper(wrapped_func):
+        bot = get_bot()
+
+        @bot.message_handler(*args, **kwargs)
+        async def load_user_information(msg):
+            logging.debug("Received user request: %s", msg)
+
+            if msg.from_user.is_bot:
+                # do nothing if you receive a message from a bot
+                logging.debug("Received message from bot. Discarding. %s", msg)
+                return
+
+            user = await db.get_or_create_user(msg)
+
+            additional_args = {}
+            if user.waiting_on:
+                logging.debug("Bot was waiting on user's text reply: %s", user.waiting_on)
+                # states set by botstarter.bot with data or a ttl are dicts
+                state = parse_waiting_on(user.waiting_on)
+                # remove waiting on option once read
+                await db.set_user_waiting_on(msg.from_user.id, waiting_on=None)
+                if state is not None:
+                    additional_args['action_name'] = state.action
+                    additional_args['action_params'] = state.params
+                    if state.data is not None:
+                        additional_args['action_data'] = state.data
+
+            return await wrapped_func(msg, user, **additional_args)
+
+        return load_user_information
+
+    return wrapper
+
+
+def gen_inline_keyboard_btn(callback_action, label, *values):
+    callback_data = util.pack_callback_data(
+        callback_action,
+        params=values,
+        separator=CALLBACK_ACTION_SPLIT_SEPARATOR
+    )
+    return types.InlineKeyboardButton(text=label, callback_data=callback_data)
+
+
+def _is_routed_callback(call) -> bool:
+    return bool(call.data) and call.data.split(CALLBACK_ACTION_SPLIT_SEPARATOR, 1)[0] in ALL_CALLBACK_ACTIONS
+
+
+def _init_callback_router(bot: AsyncTeleBot):
+    """
+    Registers a single callback query handler that routes callback queries to the handlers registered with
+    `callback_response`, looking up the action name in the ALL_CALLBACK_ACTIONS table.
+    """
+    global __callback_router_bot
+    if __callback_router_bot is bot:
+        return
+
+    @bot.callback_query_handler(func=_is_routed_callback)
+    async def route_callback_query(call):
+        logging.debug("Received callback action: %s", call)
+
+        callback_action, values = util.unpack_callback_data(call.data, separator=CALLBACK_ACTION_SPLIT_SEPARATOR)
+        logging.debug("Unpacked values for callback: action=%s, values=%s", callback_action, values)
+
+        return await ALL_CALLBACK_ACTIONS[callback_action](call, values)
+
+    __callback_router_bot = bot
+
+
+def callback_response(action, admin_only=False):
+    """
+    Registers a handler for the callback action specified in the parameters. It is also possible to secure the callback
+    handler for admin use only with the `admin_only` flag.
+
+    :param action: the callback action name
+    :param admin_only: callback function is restricted and can only be run in response to messages coming from admins. Default is `False`
+    :return: the decorator wrapper function
+    """
+    if CALLBACK_ACTION_SPLIT_SEPARATOR in action:
+        raise ValueError(
+            f"Action name [{action}] cannot contain the string separator [{CALLBACK_ACTION_SPLIT_SEPARATOR}].")
+
+    def wrapper(func):
+        _init_callback_router(get_bot())
+
+        async def read_callback_response(call, values):
+            user_id = call.from_user.id
+            if admin_only and not await db.is_admin(user_id):
+                logging.warning(f"Received admin request from non-admin user with id {user_id}")
+                await answer_callback_query(call)
+                await delete_message(message=call.message)
+                return
+
+            user = await db.get_user_by_id(user_id)
+
+            await answer_callback_query(call)
+            return await func(call, user, values)
+
+        if action in ALL_CALLBACK_ACTIONS:
+            logging.warning("Callback action %s was already registered. Replacing its handler.", action)
+        ALL_CALLBACK_ACTIONS[action] = read_callback_response
+        return read_callback_response
+
+    return wrapper
+
+
+def user_msg_callback(action: str):
+    """
+    This decorator registers the decorated coroutine as a message callback handler.
+
+    :param action: the name of the action the bot awaits from users
+    :return: the decorator wrapper function
+    """
+
+    def wrapper(func):
+        ALL_WAITING_ON_CALLBACKS[action] = func
+
+    return wrapper
+
+
+async def wait_on_user_reply(user, action: str, *action_params: str):
+    """
+    Wait for user's text reply on an action.
+
+    :param user: the user object
+    :param action: the name of the callback action
+    :param action_params: any number of parameters for the wait-on action
+    """
+    if not user or user.id is None:
+        raise ValueError("Could not wait on user text reply. User object is None or the user does not have an id.")
+    if not action or len(action.strip()) == 0:
+        raise ValueError("Could not wait on user text reply. Action name was not specified.")
+
+    callback_data = util.pack_callback_data(action, params=action_params, separator=CALLBACK_ACTION_SPLIT_SEPARATOR)
+    await db.set_user_waiting_on(
+        user_id=user.id,
+        waiting_on=callback_data
+    )
+
+
+def _init_decorators():
+    """
+    Decorators initialization function. The "catch-all" handler needs to be registered last in order be the very
+    last handler to intercept users' requests.
+    """
+
+    @user_handler(func=lambda msg: True, content_types=["text"])
+    async def catch_all(msg, user, action_name=None, action_params=None, **kwargs):
+        logging.debug("Running catch all. action_name=%s, action_params=%s, user=%d",
+                      action_name, action_params, user.get("id"))
+
+        if action_name is not None and action_name in ALL_WAITING_ON_CALLBACKS.keys():
+            func = ALL_WAITING_ON_CALLBACKS.get(action_name)
+            await func(msg, user, action_params, **kwargs)
+
+
+async def run():
+    """
+    Starts polling Telegram API for new messages on the running event loop.
+    """
+    _init_decorators()
+    # indexes are created concurrently, an unreachable database must not delay polling
+    indexes = asyncio.ensure_future(db.ensure_indexes())
+
+    logging.info("Starting asyncio Telegram bot!")
+    try:
+        await get_bot().infinity_polling()
+    finally:
+        indexes.cancel()
+
+
+def start():
+    """
+    Initialize the bot and start polling Telegram API for new messages on a new asyncio event loop.
+    """
+    asyncio.run(run())
@@ -1,35 +1,106 @@
 import logging
 import os
-from time import sleep
-from typing import List, Optional
-
-import telebot
-from requests.exceptions import ReadTimeout
-from telebot import types
-
-from botstarter import util
-from botstarter.db import users, medias
-
-RETRY_TIMEOUT_INCREASE = 20
+import threading
+from typing import TYPE_CHECKING, List, Optional
+
+from botstarter import admins, metrics, util
+from botstarter.callbacks import CallbackCodec
+from botstarter.db import users
+from botstarter.dispatch import UpdateDispatcher, DEFAULT_WORKERS, DEFAULT_MAX_QUEUE_SIZE
+from botstarter.lifecycle import Lifecycle
+from botstarter.media import MediaCache
+from botstarter.ratelimit import SendScheduler
+from botstarter.state import ConversationState, StateStore, UserFieldStateStore
+
+if TYPE_CHECKING:
+    # telebot and requests are imported when the bot is initialized, for a faster startup of processes like cluster
+    # workers and scripts that only use the database models
+    import telebot
+    from telebot import types
+
+    from botstarter.transport import HttpTransport
 
 __bot = None
-
-
-def init_bot(db_opts=None, token=None, parse_mode="MarkdownV2", **kwargs) -> telebot.TeleBot:
+__dispatcher = None
+__process_new_updates = None
+__dispatch_opts = {}
+__scheduler = None
+__media_cache = None
+__markdown_entities = False
+__transport = None
+__state_store = UserFieldStateStore()
+__callback_codec = None
+__lifecycle = Lifecycle()
+
+
+def init_bot(db_opts=None, token=None, parse_mode="MarkdownV2", workers=DEFAULT_WORKERS,
+             max_queue_size=DEFAULT_MAX_QUEUE_SIZE, rate_limit_opts=None, media_cache_opts=None,
+             markdown_entities=False, http_opts=None, state_store: Optional[StateStore] = None,
+             callback_codec: Optional[CallbackCodec] = None, admin_opts=None, lifecycle_opts=None,
+             **kwargs) -> "telebot.TeleBot":
     """
     Initializes a Telebot's bot object and db middleware.
 
     :param db_opts: optional: database connection options
     :param token: optional: the Telegram bot token, can be supplied via the 'BOT_TOKEN' env variable
     :param parse_mode: optional: the default parse mode for the bot api. Default is 'MarkdownV2'
+    :param workers: optional: the number of threads processing updates concurrently. Updates from the same chat are
+                    always processed in order by the same worker. Default is 4
+    :param max_queue_size: optional: the maximum number of updates waiting to be processed by each worker. When a
+                           worker queue is full, polling pauses until there is room for new updates. Default is 100
+    :param rate_limit_opts: optional: keyword arguments for the botstarter.ratelimit.SendScheduler that paces all
+                            outbound Telegram API calls
+    :param media_cache_opts: optional: keyword arguments for the botstarter.media.MediaCache that tracks the file
+                             ids of uploaded media
+    :param markdown_entities: optional: keep the MarkdownV2 formatting of message texts, like *bold* or [links](url),
+                              and only escape the other reserved characters. By default, texts are sent as they are
+                              and all reserved characters are escaped
+    :param http_opts: optional: keyword arguments for the botstarter.transport.HttpTransport that sends the Telegram
+                      API requests, e.g. connect_timeout or max_retries. By default, the connection pool is sized to
+                      the number of workers
+    :param state_store: optional: the botstarter.state.StateStore that keeps the actions waiting on users' text
+                        replies. Default is a UserFieldStateStore, storing them in the user documents
+    :param callback_codec: optional: the botstarter.callbacks.CallbackCodec packing the callback data of inline
+                           keyboard buttons in a compact form. By default, callback data is packed with
+                           `util.pack_callback_data`
+    :param admin_opts: optional: keyword arguments for the botstarter.admins.AdminRegistry that keeps the admin ids
+                       in memory, e.g. refresh_interval or watch
+    :param lifecycle_opts: optional: keyword arguments for the botstarter.lifecycle.Lifecycle that stops the bot
+                           gracefully on SIGTERM, e.g. drain_timeout or checkpoint
     :param kwargs: additional keyword arguments for the TeleBot object creation
     :return: the created telebot.TeleBot object
     """
+    import telebot
+
     from botstarter.db.base import init_db
+    from botstarter.transport import HttpTransport
     if db_opts is None:
         db_opts = {}
     init_db(**db_opts)
 
+    global __dispatch_opts, __scheduler, __media_cache, __markdown_entities, __transport, __state_store, \
+        __callback_codec, __lifecycle
+    __markdown_entities = markdown_entities
+    __state_store = state_store or UserFieldStateStore()
+    __callback_codec = callback_codec
+    __lifecycle = Lifecycle(**(lifecycle_opts or {}))
+    admins.init_registry(**(admin_opts or {}))
+    if callback_codec is not None:
+        for action in ALL_CALLBACK_ACTIONS:
+            callback_codec.register(action)
+    __dispatch_opts = {
+        "workers": workers,
+        "max_queue_size": max_queue_size
+    }
+    __scheduler = SendScheduler(**(rate_limit_opts or {}))
+    __media_cache = MediaCache(**(media_cache_opts or {}))
+
+    if __transport is not None:
+        __transport.close()
+    # one connection for each worker, plus the polling thread and background senders like broadcasts
+    __transport = HttpTransport(**{"pool_size": workers + 4, **(http_opts or {})})
+    __transport.install()
+
     p_bot_token = token or os.getenv("BOT_TOKEN")
 
     if p_bot_token:
@@ -47,7 +118,7 @@ def init_bot(db_opts=None, token=None, parse_mode="MarkdownV2", **kwargs) -> tel
             "A bot token must be specified either via the 'token' parameter or the 'BOT_TOKEN' environment variable")
 
 
-def get_bot() -> telebot.TeleBot:
+def get_bot() -> "telebot.TeleBot":
     """
     Returns the global object to interact with the Telegram API.
     The get_bot() function returns the telebot.TeleBot object that has been initialized with the init_bot() function.
@@ -62,23 +133,126 @@ def get_bot() -> telebot.TeleBot:
         raise RuntimeError("Bot has not been initialized.")
 
 
-def __wrap_call(func, **kwargs):
+def get_state_store() -> StateStore:
+    """
+    :return: the botstarter.state.StateStore global object keeping the actions waiting on users' text replies
+    """
+    return __state_store
+
+
+def get_callback_codec() -> Optional[CallbackCodec]:
+    """
+    :return: the botstarter.callbacks.CallbackCodec global object, or None if compact callback data is not enabled
+    """
+    return __callback_codec
+
+
+def get_lifecycle() -> Lifecycle:
+    """
+    :return: the botstarter.lifecycle.Lifecycle global object that stops the bot gracefully
+    """
+    return __lifecycle
+
+
+def get_dispatcher() -> Optional[UpdateDispatcher]:
+    """
+    Returns the dispatcher that processes incoming updates, or None if the bot has not been started yet.
+    The dispatcher exposes the `queue_depth` metric with the number of updates waiting to be processed.
+
+    :return: the botstarter.dispatch.UpdateDispatcher global object
+    """
+    return __dispatcher
+
+
+def _init_dispatcher(bot: "telebot.TeleBot") -> UpdateDispatcher:
+    """
+    Routes the updates received by the bot through a concurrent dispatcher. Telebot's update processing is
+    replaced with a function that only queues each update, so the polling thread can immediately fetch more updates
+    while the worker threads run the handlers.
+    """
+    global __dispatcher, __process_new_updates
+    if __dispatcher is not None:
+        return __dispatcher
+
+    process_new_updates = __process_new_updates = bot.process_new_updates
+    tracker = __lifecycle.tracker
+
+    def process_updates(updates):
+        try:
+            process_new_updates(updates)
+        finally:
+            for update in updates:
+                tracker.processed(update.update_id)
+
+    dispatcher = UpdateDispatcher(process_updates, **__dispatch_opts)
+
+    def dispatch_new_updates(updates):
+        for update in updates:
+            if update.update_id > bot.last_update_id:
+                bot.last_update_id = update.update_id
+            if tracker.received(update.update_id):
+                dispatcher.submit(update)
+            else:
+                logging.debug("Skipping update %d, already processed before the last restart", update.update_id)
+        if __lifecycle.stopping:
+            # polling clears the stop flag when it starts, the bot may have been stopped just before
+            bot.stop_polling()
+
+    bot.process_new_updates = dispatch_new_updates
+    dispatcher.start()
+    __dispatcher = dispatcher
+    return dispatcher
+
+
+def get_scheduler() -> SendScheduler:
+    """
+    Returns the scheduler that paces all outbound Telegram API calls made with the functions in this module.
+    The scheduler's stats() method reports the number of calls, rate limit errors and queue wait times.
+
+    :return: the botstarter.ratelimit.SendScheduler global object
+    """
+    global __scheduler
+    if __scheduler is None:
+        __scheduler = SendScheduler()
+    return __scheduler
+
+
+def get_transport() -> Optional["HttpTransport"]:
+    """
+    Returns the HTTP transport sending the Telegram API requests, or None if the bot was not initialized with
+    `init_bot`.
+    """
+    return __transport
+
+
+def get_media_cache() -> MediaCache:
+    """
+    Returns the cache of the Telegram file ids of uploaded media files.
+
+    :return: the botstarter.media.MediaCache global object
+    """
+    global __media_cache
+    if __media_cache is None:
+        __media_cache = MediaCache()
+    return __media_cache
+
+
+def __schedule(func, rate_limit_chat_id=None, **kwargs):
+    return get_scheduler().call(func, rate_limit_chat_id, **kwargs)
+
+
+def __wrap_call(func, rate_limit_chat_id=None, **kwargs):
+    # requests that could not be sent, and the timeouts of methods that only read data, are retried by the transport
     timeout = kwargs.pop("timeout")
     if not timeout:
         timeout = 20
-
-    try:
-        return func(**kwargs, timeout=timeout)
-    except ReadTimeout:
-        logging.debug("Telegram function call timed out. Re-trying with %d seconds timeout...", timeout)
-        sleep(2)
-        return func(**kwargs, timeout=timeout + RETRY_TIMEOUT_INCREASE)
+    return __schedule(func, rate_limit_chat_id, **kwargs, timeout=timeout)
 
 
 def __wrap_text(text, parse_mode=None):
     if text:
         if parse_mode == "MarkdownV2":
-            return util.str2mdown(text)
+            return util.str2mdown(text, keep_entities=__markdown_entities)
         else:
             return text
     else:
@@ -86,13 +260,14 @@ def __wrap_text(text, parse_mode=None):
 
 
 def send_typing(chat_id, timeout=10):
-    get_bot().send_chat_action(chat_id, "typing", timeout)
+    __schedule(get_bot().send_chat_action, chat_id=chat_id, action="typing", timeout=timeout)
 
 
 def send_message(chat_id, text, reply_markup=None, timeout=20, **kwargs):
     logging.debug("Sending message to user with id %d", chat_id)
     return __wrap_call(
         get_bot().send_message,
+        rate_limit_chat_id=chat_id,
         chat_id=chat_id,
         text=__wrap_text(text, get_bot().parse_mode),
         reply_markup=reply_markup,
@@ -105,6 +280,7 @@ def reply_to(reply_to_msg, text, reply_markup=None, timeout=20):
     logging.debug("Sending reply to msg to user with id %d", reply_to_msg.from_user.id)
     return __wrap_call(
         get_bot().reply_to,
+        rate_limit_chat_id=reply_to_msg.chat.id,
         message=reply_to_msg,
         text=__wrap_text(text, get_bot().parse_mode),
         reply_markup=reply_markup,
@@ -114,7 +290,9 @@ def reply_to(reply_to_msg, text, reply_markup=None, timeout=20):
 
 def edit_message_reply_markup(edit_msg, reply_markup=None):
     logging.debug("Updating msg markup to user with id %d", edit_msg.from_user.id)
-    get_bot().edit_message_reply_markup(
+    __schedule(
+        get_bot().edit_message_reply_markup,
+        rate_limit_chat_id=edit_msg.chat.id,
         chat_id=edit_msg.chat.id,
         message_id=edit_msg.message_id,
         reply_markup=reply_markup
@@ -123,7 +301,9 @@ def edit_message_reply_markup(edit_msg, reply_markup=None):
 
 def edit_message_text(edit_msg, text, **kwargs):
     logging.debug("Updating msg text to user with id %d", edit_msg.from_user.id)
-    return get_bot().edit_message_text(
+    return __schedule(
+        get_bot().edit_message_text,
+        rate_limit_chat_id=edit_msg.chat.id,
         chat_id=edit_msg.chat.id,
         text=__wrap_text(text, get_bot().parse_mode),
         message_id=edit_msg.message_id,
@@ -133,7 +313,9 @@ def edit_message_text(edit_msg, text, **kwargs):
 
 def edit_message_id_text(chat_id, message_id, text, **kwargs):
     logging.debug("Updating msg text to chat with id %d", chat_id)
-    return get_bot().edit_message_text(
+    return __schedule(
+        get_bot().edit_message_text,
+        rate_limit_chat_id=chat_id,
         chat_id=chat_id,
         message_id=message_id,
         text=__wrap_text(text, get_bot().parse_mode),
@@ -143,8 +325,9 @@ def edit_message_id_text(chat_id, message_id, text, **kwargs):
 
 def answer_callback_query(call, text=None, show_alert=False):
     logging.debug("Answering callback query to user %d", call.message.from_user.id)
-    get_bot().answer_callback_query(
-        call.id,
+    __schedule(
+        get_bot().answer_callback_query,
+        callback_query_id=call.id,
         text=__wrap_text(text, get_bot().parse_mode),
         show_alert=show_alert
     )
@@ -154,6 +337,7 @@ def send_venue(chat_id, latitude, longitude, title, address, timeout=20, **kwarg
     logging.debug(f"Sending venue to user with id %d", chat_id)
     __wrap_call(
         get_bot().send_venue,
+        rate_limit_chat_id=chat_id,
         chat_id=chat_id,
         latitude=latitude,
         longitude=longitude,
@@ -168,30 +352,57 @@ def send_photo(chat_id, photo, timeout=30):
     logging.debug(f"Sending photo to user with id %d", chat_id)
     return __wrap_call(
         get_bot().send_photo,
+        rate_limit_chat_id=chat_id,
         chat_id=chat_id,
         photo=photo,
         timeout=timeout
     )
 
 
-def send_or_upload_photo(chat_id, photo_path, timeout=30):
-    logging.debug("Sending photo to user with id %d", chat_id)
+def send_media(chat_id, media_type, media, timeout=30, **kwargs):
+    """
+    Sends a media file with the bot API method for its type, e.g. send_document for documents.
+
+    :param chat_id: the id of the chat
+    :param media_type: the media type, one of botstarter.media.MEDIA_TYPES
+    :param media: the Telegram file id, or the file to upload
+    :param timeout: optional: the request timeout. Default is 30 seconds
+    :param kwargs: additional keyword arguments for the bot API method
+    :return: the sent telebot.types.Message
+    """
+    logging.debug("Sending %s to user with id %d", media_type, chat_id)
+    return __wrap_call(
+        getattr(get_bot(), f"send_{media_type}"),
+        rate_limit_chat_id=chat_id,
+        chat_id=chat_id,
+        timeout=timeout,
+        **{media_type: media},
+        **kwargs
+    )
 
-    media = medias.get_media_by_path(photo_path)
-    if media:
-        send_photo(
-            chat_id,
-            photo=media.upload_id,
-            timeout=timeout
-        )
-    else:
-        logging.debug("Uploading photo with path %s", photo_path)
-        result = send_photo(
-            chat_id,
-            photo=open(photo_path, "rb"),
-            timeout=timeout
-        )
-        medias.create_media(photo_path, result.photo[0].file_id)
+
+def send_or_upload_media(chat_id, path, media_type="photo", timeout=30, **kwargs):
+    """
+    Sends a media file from the local file system. The file is uploaded to Telegram only the first time it is sent,
+    afterwards the Telegram file id is used. Files are identified by their content, so an edited file is uploaded
+    again.
+
+    :param chat_id: the id of the chat
+    :param path: the path of the file
+    :param media_type: optional: the media type, one of botstarter.media.MEDIA_TYPES. Default is "photo"
+    :param timeout: optional: the request timeout. Default is 30 seconds
+    :param kwargs: additional keyword arguments for the bot API method
+    :return: the sent telebot.types.Message
+    """
+    return get_media_cache().send(
+        path,
+        media_type,
+        lambda media: send_media(chat_id, media_type, media, timeout=timeout, **kwargs)
+    )
+
+
+def send_or_upload_photo(chat_id, photo_path, timeout=30):
+    return send_or_upload_media(chat_id, photo_path, media_type="photo", timeout=timeout)
 
 
 def delete_message(message=None, chat_id=None, message_id=None, timeout=20):
@@ -214,10 +425,10 @@ def delete_message(message=None, chat_id=None, message_id=None, timeout=20):
         raise Exception("Both message and (chat_id,message_id) are None. One must be defined to delete the message.")
 
 
-def set_my_commands(commands: List[types.BotCommand],
-                    scope: Optional[types.BotCommandScope] = None,
+def set_my_commands(commands: List["types.BotCommand"],
+                    scope: Optional["types.BotCommandScope"] = None,
                     language_code: Optional[str] = None) -> bool:
-    return get_bot().set_my_commands(commands, scope, language_code)
+    return __schedule(get_bot().set_my_commands, commands=commands, scope=scope, language_code=language_code)
 
 
 """
@@ -228,6 +439,10 @@ CALLBACK_ACTION_SPLIT_SEPARATOR = "::"
 
 ALL_WAITING_ON_CALLBACKS = {}
 
+ALL_CALLBACK_ACTIONS = {}
+
+__callback_router_bot = None
+
 
 def admin_handler(commands):
     """
@@ -241,14 +456,14 @@ def admin_handler(commands):
         bot = get_bot()
 
         @bot.message_handler(commands=commands)
+        @metrics.instrument_handler("admin", func.__name__)
         def check_message_from_admin(*args, **kwargs):
             msg = args[0]
             user_id = msg.from_user.id
             secure_chat_id = msg.from_user.id
-            user = users.get_user_by_id(msg.from_user.id)
 
             logging.info(f"admin request from user with id {user_id}")
-            if user is not None and bool(user.is_admin):
+            if admins.is_admin(user_id):
                 logging.info(f"admin request GRANTED to user {user_id}")
                 return func(*args, user_id, secure_chat_id, **kwargs)
             else:
@@ -271,6 +486,7 @@ def user_handler(*args, **kwargs):
         bot = get_bot()
 
         @bot.message_handler(*args, **kwargs)
+        @metrics.instrument_handler("message", wrapped_func.__name__)
         def load_user_information(msg):
             logging.debug("Received user request: %s", msg)
 
@@ -279,22 +495,17 @@ def user_handler(*args, **kwargs):
                 logging.debug("Received message from bot. Discarding. %s", msg)
                 return
 
-            user = users.get_user_by_id(msg.from_user.id)
-            if not user:
-                logging.debug("User with id %s was not found in the system. Creating new user.", msg.from_user.id)
-                user = users.create_user(msg)
+            user = users.get_or_create_user(msg)
 
             additional_args = {}
-            if user.waiting_on:
-                logging.debug("Bot was waiting on user's text reply: %s", user.waiting_on)
-                action_name, action_params = util.unpack_callback_data(
-                    user.waiting_on,
-                    separator=CALLBACK_ACTION_SPLIT_SEPARATOR
-                )
-                additional_args['action_name'] = action_name
-                additional_args['action_params'] = action_params
-                # remove waiting on option once read
-                users.set_user_waiting_on(msg.from_user.id, waiting_on=None)
+            # the state is removed once read
+            state = get_state_store().pop(msg.from_user.id, user=user)
+            if state is not None:
+                logging.debug("Bot was waiting on user's text reply: %s", state)
+                additional_args['action_name'] = state.action
+                additional_args['action_params'] = state.params
+                if state.data is not None:
+                    additional_args['action_data'] = state.data
 
             return wrapped_func(msg, user, **additional_args)
 
@@ -304,14 +515,64 @@ def user_handler(*args, **kwargs):
 
 
 def gen_inline_keyboard_btn(callback_action, label, *values):
-    callback_data = util.pack_callback_data(
-        callback_action,
-        params=values,
-        separator=CALLBACK_ACTION_SPLIT_SEPARATOR
-    )
+    from telebot import types
+
+    if __callback_codec is not None:
+        callback_data = __callback_codec.pack(callback_action, values)
+    else:
+        callback_data = util.pack_callback_data(
+            callback_action,
+            params=values,
+            separator=CALLBACK_ACTION_SPLIT_SEPARATOR
+        )
     return types.InlineKeyboardButton(text=label, callback_data=callback_data)
 
 
+def _is_routed_callback(call) -> bool:
+    if not call.data:
+        return False
+    if __callback_codec is not None and __callback_codec.is_compact(call.data):
+        return True
+    return call.data.split(CALLBACK_ACTION_SPLIT_SEPARATOR, 1)[0] in ALL_CALLBACK_ACTIONS
+
+
+def _unpack_callback_data(data: str):
+    if __callback_codec is not None:
+        return __callback_codec.unpack(data)
+    return util.unpack_callback_data(data, separator=CALLBACK_ACTION_SPLIT_SEPARATOR)
+
+
+def _init_callback_router(bot: "telebot.TeleBot"):
+    """
+    Registers a single callback query handler that routes callback queries to the handlers registered with
+    `callback_response`, looking up the action name in the ALL_CALLBACK_ACTIONS table.
+    """
+    global __callback_router_bot
+    if __callback_router_bot is bot:
+        return
+
+    @bot.callback_query_handler(func=_is_routed_callback)
+    def route_callback_query(call):
+        logging.debug("Received callback action: %s", call)
+
+        try:
+            callback_action, values = _unpack_callback_data(call.data)
+        except ValueError as e:
+            logging.warning("Could not unpack callback data: %s", e)
+            answer_callback_query(call)
+            return
+        logging.debug("Unpacked values for callback: action=%s, values=%s", callback_action, values)
+
+        handler = ALL_CALLBACK_ACTIONS.get(callback_action)
+        if handler is None:
+            logging.warning("Received callback query for unknown action %s", callback_action)
+            answer_callback_query(call)
+            return
+        return handler(call, values)
+
+    __callback_router_bot = bot
+
+
 def callback_response(action, admin_only=False):
     """
     Registers a handler for the callback action specified in the parameters. It is also possible to secure the callback
@@ -321,19 +582,19 @@ def callback_response(action, admin_only=False):
     :param admin_only: callback function is restricted and can only be run in response to messages coming from admins. Default is `False`
     :return: the decorator wrapper function
     """
+    if CALLBACK_ACTION_SPLIT_SEPARATOR in action:
+        raise ValueError(
+            f"Action name [{action}] cannot contain the string separator [{CALLBACK_ACTION_SPLIT_SEPARATOR}].")
 
     def wrapper(func):
-        bot = get_bot()
-
-        @bot.callback_query_handler(func=lambda call: call.data.startswith(f"{action}:"))
-        def read_callback_response(call):
-            logging.debug("Received callback action: %s", call)
-
-            callback_action, values = util.unpack_callback_data(call.data, separator=CALLBACK_ACTION_SPLIT_SEPARATOR)
-            logging.debug("Unpacked values for callback: action=%s, values=%s", callback_action, values)
+        _init_callback_router(get_bot())
+        if __callback_codec is not None:
+            __callback_codec.register(action)
 
+        @metrics.instrument_handler("callback", action)
+        def read_callback_response(call, values):
             user_id = call.from_user.id
-            if admin_only and not users.is_admin(user_id):
+            if admin_only and not admins.is_admin(user_id):
                 logging.warning(f"Received admin request from non-admin user with id {user_id}")
                 answer_callback_query(call)
                 delete_message(message=call.message)
@@ -344,6 +605,9 @@ def callback_response(action, admin_only=False):
             answer_callback_query(call)
             return func(call, user, values)
 
+        if action in ALL_CALLBACK_ACTIONS:
+            logging.warning("Callback action %s was already registered. Replacing its handler.", action)
+        ALL_CALLBACK_ACTIONS[action] = read_callback_response
         return read_callback_response
 
     return wrapper
@@ -363,24 +627,27 @@ def user_msg_callback(action: str):
     return wrapper
 
 
-def wait_on_user_reply(user: users.User, action: str, *action_params: str):
+def wait_on_user_reply(user: users.User, action: str, *action_params: str, data=None, ttl: Optional[float] = None):
     """
     Wait for user's text reply on an action.
 
     :param user: the user object
     :param action: the name of the callback action
     :param action_params: any number of parameters for the wait-on action
+    :param data: optional: structured data for the wait-on action, passed to the handler as the `action_data`
+                 keyword argument. It must be serializable by the state store, e.g. JSON-like for Redis
+    :param ttl: optional: the number of seconds after which the bot stops waiting on the reply. Default is the
+                state store default_ttl
     """
     if not user or user.id is None:
         raise ValueError("Could not wait on user text reply. User object is None or the user does not have an id.")
     if not action or len(action.strip()) == 0:
         raise ValueError("Could not wait on user text reply. Action name was not specified.")
 
-    callback_data = util.pack_callback_data(action, params=action_params, separator=CALLBACK_ACTION_SPLIT_SEPARATOR)
-    users.set_user_waiting_on(
-        user_id=user.id,
-        waiting_on=callback_data
-    )
+    if CALLBACK_ACTION_SPLIT_SEPARATOR in action:
+        raise ValueError(f"Action name [{action}] cannot contain the string separator "
+                         f"[{CALLBACK_ACTION_SPLIT_SEPARATOR}]. Choose a different action name.")
+    get_state_store().set(user.id, ConversationState(action, [str(p) for p in action_params], data), ttl=ttl)
 
 
 def _init_decorators():
@@ -399,11 +666,87 @@ def _init_decorators():
             func(msg, user, action_params, **kwargs)
 
 
+def _shutdown():
+    global __dispatcher, __transport, __process_new_updates
+    dispatcher, __dispatcher = __dispatcher, None
+    transport, __transport = __transport, None
+    process_new_updates, __process_new_updates = __process_new_updates, None
+    if process_new_updates is not None and __bot is not None:
+        # telebot processes the updates itself again, until a new dispatcher is started
+        __bot.process_new_updates = process_new_updates
+    __lifecycle.shutdown(dispatcher, transport)
+
+
 def start():
     """
-    Initialize the bot and start polling Telegram API for new messages.
+    Initialize the bot and start polling Telegram API for new messages, until the process receives SIGTERM or
+    SIGINT. The bot is then stopped gracefully, see botstarter.lifecycle.
     """
     _init_decorators()
 
+    bot = get_bot()
+    __lifecycle.restore_offset(bot)
+    _init_dispatcher(bot)
+    __lifecycle.install(bot.stop_polling)
+
     logging.info("Starting Telegram bot!")
-    get_bot().infinity_polling()
+    try:
+        bot.infinity_polling()
+    finally:
+        _shutdown()
+
+
+"""
+Maximum number of seconds a webhook request waits for room in a full update queue. When the timeout expires the
+request is rejected, and Telegram will deliver the update again later.
+"""
+WEBHOOK_SUBMIT_TIMEOUT = 5
+
+
+def start_webhook(url=None, host="0.0.0.0", port=8443, path="/webhook", secret_token=None, ssl_context=None,
+                  certificate=None, **kwargs):
+    """
+    Initialize the bot and start an embedded HTTP server to receive updates from Telegram via webhook, as an
+    alternative to polling. Updates are acknowledged as soon as they are queued and processed asynchronously.
+
+    :param url: optional: the public HTTPS URL Telegram should post updates to. If set, the webhook is registered
+                with Telegram on startup, otherwise it is assumed to be configured already
+    :param host: optional: the interface the server listens on. Default is "0.0.0.0"
+    :param port: optional: the port the server listens on. Default is 8443
+    :param path: optional: the URL path receiving updates. Default is "/webhook"
+    :param secret_token: optional: a secret token Telegram sends with every update. Requests with a missing or
+                         different token are rejected. Can also be set with the "WEBHOOK_SECRET_TOKEN" environment
+                         variable
+    :param ssl_context: optional: a ssl.SSLContext to serve HTTPS requests directly, when there is no TLS
+                        terminating proxy in front of the bot
+    :param certificate: optional: the public key certificate uploaded to Telegram for self-signed certificates
+    :param kwargs: additional keyword arguments for telebot's set_webhook call
+    """
+    from botstarter.webhook import WebhookServer
+
+    _init_decorators()
+
+    bot = get_bot()
+    dispatcher = _init_dispatcher(bot)
+    p_secret_token = secret_token or os.getenv("WEBHOOK_SECRET_TOKEN")
+
+    if url:
+        logging.info("Registering webhook with url %s", url)
+        bot.set_webhook(url=url, certificate=certificate, secret_token=p_secret_token, **kwargs)
+
+    server = WebhookServer(
+        lambda update: dispatcher.submit(update, timeout=WEBHOOK_SUBMIT_TIMEOUT),
+        host=host,
+        port=port,
+        path=path,
+        secret_token=p_secret_token,
+        ssl_context=ssl_context
+    )
+    # the server must be shut down by a thread other than the one serving requests
+    __lifecycle.install(lambda: threading.Thread(target=server.shutdown, daemon=True).start())
+    logging.info("Starting Telegram bot webhook server on %s:%d%s", host, port, path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        _shutdown()
@@ -0,0 +1,123 @@
+"""
+Bulk messaging of bot users.
+
+Users are streamed from the database in batches with a projection, so memory use doesn't depend on the number of
+users, and messages are sent concurrently through the bot's send scheduler with bulk priority, so interactive replies
+to other users are not delayed.
+
+The progress of each broadcast is checkpointed in the `broadcasts` collection after every batch: running a
+broadcast again with the same `broadcast_id` resumes it after the last completed batch.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional, Union
+
+from bson import ObjectId
+from telebot.apihelper import ApiTelegramException
+
+from botstarter import bot
+from botstarter.db import broadcasts
+from botstarter.db.users import User
+from botstarter.ratelimit import send_priority, PRIORITY_BULK
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CONCURRENCY = 8
+
+"""
+Telegram API error codes returned when a user can't be reached anymore, e.g. the bot was blocked or the account was
+deleted
+"""
+BLOCKED_ERROR_CODES = (403,)
+
+
+class BroadcastReport(NamedTuple):
+    broadcast_id: str
+    delivered: int
+    blocked: int
+    failed: int
+    completed: bool
+
+
+def broadcast(text_or_factory: Union[str, Callable[[User], Optional[str]]], filter: Optional[dict] = None,
+              broadcast_id: Optional[str] = None, projection: Optional[dict] = None,
+              batch_size: int = DEFAULT_BATCH_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+              **send_kwargs) -> BroadcastReport:
+    """
+    Sends a message to every user matching the filter.
+
+    :param text_or_factory: the message text, or a function that returns the text for the user it receives. If the
+                            function returns None, the user is skipped
+    :param filter: optional: a query on the users collection to select the recipients. By default, all users
+    :param broadcast_id: optional: the id of the broadcast. If a broadcast with the same id was interrupted, it is
+                         resumed. By default, a new id is generated
+    :param projection: optional: the user fields to read. When a text is broadcast only the user id is read,
+                       otherwise the whole user document is passed to the factory function
+    :param batch_size: optional: the number of users read from the database and messaged between checkpoints.
+                       Default is 500
+    :param concurrency: optional: the number of messages sent in parallel. Default is 8
+    :param send_kwargs: additional keyword arguments for the bot.send_message function, e.g. reply_markup
+    :return: a BroadcastReport with the number of delivered, blocked and failed messages
+    """
+    if broadcast_id is None:
+        broadcast_id = str(ObjectId())
+
+    if callable(text_or_factory):
+        factory = text_or_factory
+    else:
+        factory = lambda user: text_or_factory
+        if projection is None:
+            projection = {"id": 1}
+
+    query = dict(filter or {})
+    counts = {"delivered": 0, "blocked": 0, "failed": 0}
+    last_user_oid = None
+
+    checkpoint = broadcasts.get_broadcast(broadcast_id)
+    if checkpoint:
+        if checkpoint.completed:
+            logging.info("Broadcast %s was already completed", broadcast_id)
+            return BroadcastReport(broadcast_id, checkpoint.delivered, checkpoint.blocked, checkpoint.failed, True)
+        logging.info("Resuming broadcast %s after user %s", broadcast_id, checkpoint.last_user_oid)
+        counts = {k: checkpoint.get(k, 0) for k in counts}
+        last_user_oid = checkpoint.last_user_oid
+        if last_user_oid is not None:
+            query = {"$and": [query, {"_id": {"$gt": last_user_oid}}]}
+
+    def send(user):
+        text = factory(user)
+        if text is None:
+            return None
+        with send_priority(PRIORITY_BULK):
+            try:
+                bot.send_message(user.id, text, **send_kwargs)
+                return "delivered"
+            except ApiTelegramException as e:
+                if e.error_code in BLOCKED_ERROR_CODES:
+                    return "blocked"
+                logging.warning("Could not deliver broadcast %s to user %s: %s", broadcast_id, user.id, e)
+                return "failed"
+            except Exception:
+                logging.exception("Could not deliver broadcast %s to user %s", broadcast_id, user.id)
+                return "failed"
+
+    def send_batch(executor, batch, completed=False):
+        for result in executor.map(send, batch):
+            if result is not None:
+                counts[result] += 1
+        oid = batch[-1]["_id"] if batch else last_user_oid
+        broadcasts.save_checkpoint(broadcast_id, oid, completed=completed, **counts)
+        logging.debug("Broadcast %s progress: %s", broadcast_id, counts)
+        return oid
+
+    users = User.iter_find(query, projection, batch_size=batch_size, sort=[("_id", 1)])
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="botstarter-broadcast") as executor:
+        batch = []
+        for user in users:
+            batch.append(user)
+            if len(batch) >= batch_size:
+                last_user_oid = send_batch(executor, batch)
+                batch = []
+        send_batch(executor, batch, completed=True)
+
+    logging.info("Broadcast %s completed: %s", broadcast_id, counts)
+    return BroadcastReport(broadcast_id, completed=True, **counts)
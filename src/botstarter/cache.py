@@ -0,0 +1,139 @@
+"""
+In-process caching utilities
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded LRU cache with optional time-to-live expiration.
+
+    When the cache is full, the least recently used entry is evicted to make room for new ones. Entries older than
+    the time-to-live are treated as missing and removed on access.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: the maximum number of entries. A size of 0 disables the cache
+        :param ttl: optional: the number of seconds after which an entry expires. By default, entries never expire
+        """
+        if maxsize < 0:
+            raise ValueError("Cache size cannot be negative.")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._reservations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at is None or expires_at > monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key: Hashable, value: Any):
+        expires_at = monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def reserve(self, key: Hashable) -> object:
+        """
+        Reserves a key before reading its value from the source, e.g. the database. If the key is updated or
+        invalidated while the value is read, `put_reserved` doesn't cache the value, which may be stale.
+
+        :param key: the cache key
+        :return: the reservation token
+        """
+        token = object()
+        with self._lock:
+            self._reservations[key] = token
+        return token
+
+    def put_reserved(self, key: Hashable, value: Any, token: object) -> bool:
+        """
+        Caches a value read after reserving its key, unless the key was updated or invalidated in the meantime.
+
+        :param key: the cache key
+        :param value: the value. None only releases the reservation
+        :param token: the token returned by `reserve`
+        :return: True if the value was cached
+        """
+        with self._lock:
+            if self._reservations.get(key) is not token:
+                return False
+            del self._reservations[key]
+            if value is None or self.maxsize == 0:
+                return False
+            self._put(key, value)
+            return True
+
+    def update(self, key: Hashable, fields: dict, increments: Optional[dict] = None) -> bool:
+        """
+        Updates the fields of a cached dict value in place, without changing its position or expiration.
+
+        :param key: the cache key
+        :param fields: the fields to update
+        :param increments: optional: the amounts to add to numeric fields, missing fields count as 0
+        :return: True if the entry was found and updated, False otherwise
+        """
+        with self._lock:
+            self._reservations.pop(key, None)
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return False
+            value = entry[1]
+            value.update(fields)
+            if increments:
+                for field, amount in increments.items():
+                    value[field] = value.get(field, 0) + amount
+            return True
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._reservations.pop(key, None)
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._reservations.clear()
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: a dict with the cache hit, miss and eviction counters and the current number of entries
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,348 @@
+"""
+Compact callback_data encoding.
+
+Telegram limits the callback_data of inline keyboard buttons to 64 bytes. `util.pack_callback_data` joins the action
+name and the parameters as strings, so a button can hardly carry more than a couple of database ids. The
+CallbackCodec packs callback data in a compact binary form, encoded with base85:
+  - the action name is replaced by a short numeric id
+  - integers are varint-encoded, ObjectIds take 12 bytes instead of 24 hex characters, and strings, bytes, booleans
+    and None keep their type when unpacked
+
+Data that is still too long can be kept server side in an opt-in overflow store, and the button only carries a short
+key of the stored data. The codec is enabled with the `callback_codec` parameter of `bot.init_bot`:
+
+    bot.init_bot(callback_codec=CallbackCodec(actions={"BUY": 1, "PAGE": 2}, overflow_store=MongoOverflowStore()))
+
+Compact callback data starts with a character outside the base85 alphabet, so that the codec also unpacks the
+callback data of buttons sent before it was enabled.
+"""
+import os
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from base64 import b85decode, b85encode
+from datetime import datetime, timedelta, timezone
+from hashlib import blake2b
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import IndexModel
+
+from botstarter import util
+from botstarter.cache import LRUCache
+
+"""
+Maximum size of callback_data in bytes, as defined by the Telegram Bot API
+"""
+MAX_CALLBACK_DATA_SIZE = 64
+
+"""
+First character of compact and overflow callback data. Both are outside the base85 alphabet
+"""
+COMPACT_PREFIX = "."
+OVERFLOW_PREFIX = ","
+
+"""
+Default number of seconds overflow callback data is kept. Buttons pressed after it expired are ignored
+"""
+DEFAULT_OVERFLOW_TTL = 7 * 24 * 60 * 60
+
+DEFAULT_OVERFLOW_COLLECTION = "callback_data"
+
+_NONE, _FALSE, _TRUE, _INT, _STR, _BYTES, _OBJECT_ID = range(7)
+
+
+def _write_varint(buf: bytearray, value: int):
+    while value > 0x7F:
+        buf.append(value & 0x7F | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_param(buf: bytearray, value):
+    if value is None:
+        buf.append(_NONE)
+    elif value is True or value is False:
+        buf.append(_TRUE if value else _FALSE)
+    elif isinstance(value, int):
+        buf.append(_INT)
+        # zigzag encoding, so that small negative numbers are short too
+        _write_varint(buf, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, str):
+        encoded = value.encode()
+        buf.append(_STR)
+        _write_varint(buf, len(encoded))
+        buf += encoded
+    elif isinstance(value, (bytes, bytearray)):
+        buf.append(_BYTES)
+        _write_varint(buf, len(value))
+        buf += value
+    elif isinstance(value, ObjectId):
+        buf.append(_OBJECT_ID)
+        buf += value.binary
+    else:
+        raise TypeError(f"Callback parameters of type {type(value).__name__} cannot be packed.")
+
+
+def _read_param(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    elif tag == _FALSE or tag == _TRUE:
+        return tag == _TRUE, pos
+    elif tag == _INT:
+        value, pos = _read_varint(data, pos)
+        return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+    elif tag == _STR or tag == _BYTES:
+        length, pos = _read_varint(data, pos)
+        value = data[pos:pos + length]
+        if len(value) != length:
+            raise ValueError("Truncated callback data.")
+        return (value.decode() if tag == _STR else value), pos + length
+    elif tag == _OBJECT_ID:
+        if len(data) < pos + 12:
+            raise ValueError("Truncated callback data.")
+        return ObjectId(data[pos:pos + 12]), pos + 12
+    raise ValueError(f"Unknown callback parameter type {tag}.")
+
+
+class OverflowStore(ABC):
+    """
+    A store of callback data too long for the Telegram limit, by key.
+    """
+
+    @abstractmethod
+    def put(self, key: str, value: str):
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """
+        :return: the stored value, or None if it was not found or it expired
+        """
+
+
+class MemoryOverflowStore(OverflowStore):
+    """
+    An in-process overflow store. Data is lost on restart and is not shared between processes.
+    """
+
+    def __init__(self, ttl: Optional[float] = DEFAULT_OVERFLOW_TTL, maxsize: int = 100000):
+        """
+        :param ttl: optional: the number of seconds data is kept. Default is 7 days
+        :param maxsize: optional: the maximum number of stored values. Default is 100000
+        """
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def put(self, key: str, value: str):
+        self._cache.put(key, value)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+
+class MongoOverflowStore(OverflowStore):
+    """
+    An overflow store on a dedicated MongoDB collection, with a TTL index removing expired data.
+    """
+
+    def __init__(self, ttl: Optional[float] = DEFAULT_OVERFLOW_TTL, collection_name: str = DEFAULT_OVERFLOW_COLLECTION,
+                 create_index: bool = True):
+        """
+        :param ttl: optional: the number of seconds data is kept. Default is 7 days
+        :param collection_name: optional: the name of the collection. Default is "callback_data"
+        :param create_index: optional: create the TTL index when the collection is first used. Default is True
+        """
+        self.ttl = ttl
+        self.collection_name = collection_name
+        self.create_index = create_index
+        self.__collection = None
+
+    @property
+    def collection(self):
+        # the database is initialized by init_bot, possibly after the store is created
+        if self.__collection is None:
+            from botstarter.db.base import get_db
+            collection = get_db()[self.collection_name]
+            if self.create_index:
+                collection.create_indexes([IndexModel("expires_at", expireAfterSeconds=0)])
+            self.__collection = collection
+        return self.__collection
+
+    def put(self, key: str, value: str):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl) if self.ttl is not None else None
+        self.collection.update_one({"_id": key}, {"$set": {"value": value, "expires_at": expires_at}}, upsert=True)
+
+    def get(self, key: str) -> Optional[str]:
+        doc = self.collection.find_one({"_id": key})
+        if doc is None:
+            return None
+        expires_at = doc.get("expires_at")
+        if expires_at is not None:
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            if expires_at <= datetime.now(timezone.utc):
+                return None
+        return doc["value"]
+
+
+class RedisOverflowStore(OverflowStore):
+    """
+    An overflow store on a Redis-compatible server, with native key expiration.
+    """
+
+    def __init__(self, ttl: Optional[float] = DEFAULT_OVERFLOW_TTL, url: Optional[str] = None,
+                 prefix: str = "botstarter:callback", client=None):
+        """
+        :param ttl: optional: the number of seconds data is kept. Default is 7 days
+        :param url: optional: the Redis server url. Default is the "REDIS_URL" environment variable, or a local server
+        :param prefix: optional: the prefix of the keys. Default is "botstarter:callback"
+        :param client: optional: a redis.Redis client, used instead of connecting to the url
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("The Redis overflow store requires the 'redis' package. "
+                                  "Install it with: pip install redis") from e
+            client = redis.Redis.from_url(url or os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = client
+
+    def put(self, key: str, value: str):
+        self._redis.set(f"{self.prefix}:{key}", value, px=int(self.ttl * 1000) if self.ttl is not None else None)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._redis.get(f"{self.prefix}:{key}")
+        return value.decode() if value is not None else None
+
+
+class CallbackCodec:
+    """
+    Packs and unpacks compact callback data.
+    """
+
+    def __init__(self, actions: Optional[Dict[str, int]] = None, overflow_store: Optional[OverflowStore] = None,
+                 separator: str = "::"):
+        """
+        :param actions: optional: the ids of the action names. Ids must never change while buttons using them can
+                        still be pressed, and small ids make shorter callback data. Actions without an explicit id
+                        get one derived from their name
+        :param overflow_store: optional: the store of callback data exceeding 64 bytes. By default, packing callback
+                               data that is too long raises a ValueError
+        :param separator: optional: the separator of callback data packed with `util.pack_callback_data`. Default
+                          is "::"
+        """
+        self.overflow_store = overflow_store
+        self.separator = separator
+        self._ids = {}
+        self._actions = {}
+        self._lock = threading.Lock()
+        for action, action_id in (actions or {}).items():
+            self.register(action, action_id)
+
+    def register(self, action: str, action_id: Optional[int] = None) -> int:
+        """
+        Registers an action name, so that its callback data can be unpacked.
+
+        :param action: the action name
+        :param action_id: optional: the action id. By default, a 16 bits id is derived from the action name
+        :return: the action id
+        :raises ValueError: if the id is already used by another action
+        """
+        with self._lock:
+            if action_id is None:
+                action_id = self._ids.get(action)
+                if action_id is not None:
+                    return action_id
+                action_id = zlib.crc32(action.encode()) & 0xFFFF
+            if action_id < 0:
+                raise ValueError("Action ids cannot be negative.")
+            other = self._actions.get(action_id)
+            if other is not None and other != action:
+                raise ValueError(f"Action [{action}] has the same id {action_id} of action [{other}]. "
+                                 "Set a different id in the codec actions.")
+            self._ids[action] = action_id
+            self._actions[action_id] = action
+            return action_id
+
+    def pack(self, action: str, params: Sequence = ()) -> str:
+        """
+        Packs an action and its parameters into callback data.
+
+        :param action: the action name
+        :param params: the action parameters: integers, strings, bytes, booleans, None or bson ObjectIds
+        :return: the callback data string
+        :raises ValueError: if the callback data exceeds 64 bytes and there is no overflow store
+        """
+        action_id = self._ids.get(action)
+        if action_id is None:
+            action_id = self.register(action)
+
+        buf = bytearray()
+        _write_varint(buf, action_id)
+        for param in params:
+            _write_param(buf, param)
+
+        data = COMPACT_PREFIX + b85encode(bytes(buf)).decode("ascii")
+        if len(data) <= MAX_CALLBACK_DATA_SIZE:
+            return data
+        if self.overflow_store is None:
+            raise ValueError(f"Callback data of action [{action}] exceeds {MAX_CALLBACK_DATA_SIZE} bytes. "
+                             "Configure an overflow store to keep it server side.")
+
+        # the same data always has the same key, so that re-sending a keyboard doesn't store it again
+        key = b85encode(blake2b(buf, digest_size=12).digest()).decode("ascii")
+        self.overflow_store.put(key, data)
+        return OVERFLOW_PREFIX + key
+
+    @staticmethod
+    def is_compact(data: str) -> bool:
+        """
+        :return: True if the callback data was packed by a CallbackCodec
+        """
+        return data[:1] in (COMPACT_PREFIX, OVERFLOW_PREFIX)
+
+    def unpack(self, data: str) -> Tuple[str, List]:
+        """
+        Unpacks callback data packed by the codec or by `util.pack_callback_data`.
+
+        :param data: the callback data string
+        :return: a tuple with the action name and the list of parameters
+        :raises ValueError: if the data is invalid, has an unknown action id or expired from the overflow store
+        """
+        if data[:1] == OVERFLOW_PREFIX:
+            stored = self.overflow_store.get(data[1:]) if self.overflow_store is not None else None
+            if stored is None:
+                raise ValueError(f"Callback data [{data}] was not found in the overflow store. It may have expired.")
+            data = stored
+        if data[:1] != COMPACT_PREFIX:
+            return util.unpack_callback_data(data, separator=self.separator)
+
+        try:
+            buf = b85decode(data[1:])
+            action_id, pos = _read_varint(buf, 0)
+            params = []
+            while pos < len(buf):
+                param, pos = _read_param(buf, pos)
+                params.append(param)
+        except IndexError:
+            raise ValueError(f"Truncated callback data [{data}].")
+
+        action = self._actions.get(action_id)
+        if action is None:
+            raise ValueError(f"Unknown callback action id {action_id}.")
+        return action, params
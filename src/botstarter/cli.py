@@ -0,0 +1,62 @@
+"""
+Command line tools for py-bot-starter projects.
+
+    botstarter warm-media --chat-id -1001234567890 "assets/**/*.png"
+
+The bot token and database connection are configured with the same environment variables used by the bot:
+BOT_TOKEN, MONGODB_HOST, MONGODB_PORT and DATABASE_NAME.
+"""
+import argparse
+import logging
+from typing import List, Optional
+
+from botstarter.media import MEDIA_TYPES
+
+
+def warm_media(args):
+    from botstarter import bot, media
+
+    bot.init_bot(token=args.token)
+    report = media.warm_media(
+        args.paths,
+        chat_id=args.chat_id,
+        media_type=args.media_type,
+        concurrency=args.concurrency,
+        delete_messages=not args.keep_messages
+    )
+    print(f"uploaded: {report.uploaded}, skipped: {report.skipped}, failed: {report.failed}")
+    print(f"{report.uploaded_bytes / 1024 / 1024:.1f} MB in {report.seconds:.1f} s "
+          f"({report.files_per_second:.2f} files/s, {report.bytes_per_second / 1024 / 1024:.2f} MB/s)")
+    return 1 if report.failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="botstarter", description="py-bot-starter command line tools")
+    parser.add_argument("--log-level", default="INFO", help="the logging level. Default is INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    warm = commands.add_parser(
+        "warm-media",
+        help="upload media files to a staging chat ahead of time, so users never wait for an upload"
+    )
+    warm.add_argument("paths", nargs="+", help="file paths, directories or glob patterns of the media files")
+    warm.add_argument("--chat-id", type=int, action="append", required=True,
+                      help="the id of the staging chat. Repeat the option to spread uploads across several chats")
+    warm.add_argument("--media-type", choices=MEDIA_TYPES,
+                      help="the media type of all files. By default, it is guessed from the file extension")
+    warm.add_argument("--concurrency", type=int, default=4, help="the number of parallel uploads. Default is 4")
+    warm.add_argument("--keep-messages", action="store_true",
+                      help="don't delete the uploaded messages from the staging chat")
+    warm.add_argument("--token", help="the Telegram bot token. Defaults to the BOT_TOKEN environment variable")
+    warm.set_defaults(func=warm_media)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,331 @@
+"""
+Multi-process and multi-node update processing.
+
+A bot started with `bot.start()` processes all updates in one process, so handlers can use a single CPU core. In
+cluster mode, a supervisor receives the updates, by polling or webhook, and partitions them by chat id over N worker
+processes:
+
+    def setup():
+        # runs in every worker process: initialize the bot and import the modules registering the handlers
+        bot.init_bot()
+        import handlers
+
+    if __name__ == "__main__":
+        cluster.start_cluster(setup, workers=8)
+
+Updates of the same chat always go to the same partition, and each worker processes its partition with an update
+dispatcher, so updates of a chat are still processed one at a time and in order. This also preserves the
+`wait_on_user_reply` semantics for private chats, since the user of a private chat is only ever processed by the
+worker that owns the chat. Bots with group chats should use a state store shared by all workers, like the default
+UserFieldStateStore or a RedisStateStore, rather than a MemoryStateStore.
+
+A user can write in several group chats, which can belong to different workers. For this reason the in-process
+users cache, which could serve a stale `waiting_on` state, is disabled in worker processes by default.
+
+Partitions are exchanged through an UpdateQueue: MultiprocessingUpdateQueue for workers on the same machine, and
+RedisUpdateQueue for workers on other nodes, started with `run_worker()`.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from abc import ABC, abstractmethod
+from queue import Empty
+from typing import Callable, Optional
+
+from telebot import apihelper, types
+
+from botstarter.dispatch import raw_chat_id_of, DEFAULT_MAX_QUEUE_SIZE
+
+"""
+Message sent to a partition to stop its worker
+"""
+STOP_MESSAGE = "__stop__"
+
+DEFAULT_POLLING_TIMEOUT = 20
+
+
+def partition_of(update: dict, partitions: int) -> int:
+    """
+    Returns the partition of an update. Updates of the same chat always have the same partition, in every process.
+
+    :param update: the JSON update received from Telegram
+    :param partitions: the number of partitions
+    :return: the partition index
+    """
+    key = raw_chat_id_of(update)
+    if key is None:
+        key = update["update_id"]
+    return key % partitions
+
+
+class UpdateQueue(ABC):
+    """
+    A queue of JSON updates with one partition for each worker.
+    """
+    partitions: int
+
+    @abstractmethod
+    def put(self, partition: int, payload: str):
+        pass
+
+    @abstractmethod
+    def get(self, partition: int, timeout: float) -> Optional[str]:
+        """
+        :return: the next payload of the partition, or None if the timeout expired
+        """
+
+    def close(self):
+        pass
+
+
+class MultiprocessingUpdateQueue(UpdateQueue):
+    """
+    Bounded multiprocessing queues, one for each partition. When the queue of a partition is full, the supervisor
+    waits for the worker to catch up.
+    """
+
+    def __init__(self, partitions: int, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE, mp_context=None):
+        ctx = mp_context or multiprocessing.get_context()
+        self.partitions = partitions
+        self._queues = [ctx.Queue(maxsize=max_queue_size) for _ in range(partitions)]
+
+    def put(self, partition: int, payload: str):
+        self._queues[partition].put(payload)
+
+    def get(self, partition: int, timeout: float) -> Optional[str]:
+        try:
+            return self._queues[partition].get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        for q in self._queues:
+            q.close()
+
+
+class RedisUpdateQueue(UpdateQueue):
+    """
+    Redis lists, one for each partition, to process updates on workers running on different nodes.
+    """
+
+    def __init__(self, partitions: int, url: Optional[str] = None, prefix: str = "botstarter:updates"):
+        """
+        :param partitions: the number of partitions, the same on the supervisor and on all workers
+        :param url: optional: the Redis server url. Default is the "REDIS_URL" environment variable, or a local server
+        :param prefix: optional: the prefix of the partition list keys. Default is "botstarter:updates"
+        """
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("The Redis update queue requires the 'redis' package. "
+                              "Install it with: pip install redis") from e
+
+        self.partitions = partitions
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(self.url)
+
+    def _key(self, partition):
+        return f"{self.prefix}:{partition}"
+
+    def put(self, partition: int, payload: str):
+        self._redis.lpush(self._key(partition), payload)
+
+    def get(self, partition: int, timeout: float) -> Optional[str]:
+        item = self._redis.brpop([self._key(partition)], timeout=max(1, int(timeout)))
+        return item[1].decode() if item else None
+
+    def close(self):
+        self._redis.close()
+
+    def __getstate__(self):
+        # workers open their own connection
+        state = dict(self.__dict__)
+        del state["_redis"]
+        return state
+
+    def __setstate__(self, state):
+        import redis
+        self.__dict__.update(state)
+        self._redis = redis.Redis.from_url(self.url)
+
+
+def run_worker(setup: Callable[[], None], partition: int, queue: UpdateQueue, user_cache: bool = False):
+    """
+    Processes the updates of a partition until the supervisor stops the cluster, or the process receives SIGTERM or
+    SIGINT. Workers on other nodes run this function with the same setup function and a queue with the same number
+    of partitions as the supervisor.
+
+    :param setup: the function initializing the bot and registering its handlers
+    :param partition: the index of the partition processed by this worker
+    :param queue: the update queue
+    :param user_cache: optional: keep the in-process users cache enabled. Only safe if users never write to the bot
+                       from chats of different partitions, e.g. bots that only have private chats. Default is False
+    """
+    from botstarter import bot
+    from botstarter.db import users
+
+    setup()
+    if not user_cache:
+        users.configure_cache(maxsize=0)
+
+    bot._init_decorators()
+    dispatcher = bot._init_dispatcher(bot.get_bot())
+    lifecycle = bot.get_lifecycle()
+    # on SIGTERM, the updates not taken from the queue are left to the next worker of the partition
+    lifecycle.install(lambda: logging.info("Cluster worker %d stopping", partition))
+    logging.info("Cluster worker %d started with pid %d", partition, os.getpid())
+
+    while not lifecycle.stopping:
+        payload = queue.get(partition, timeout=1)
+        if payload is None:
+            continue
+        if payload == STOP_MESSAGE:
+            break
+        try:
+            dispatcher.submit(types.Update.de_json(payload))
+        except Exception:
+            logging.exception("Could not process update %s", payload)
+
+    # waits for the updates taken from the queue, and writes the pending database updates
+    bot._shutdown()
+    logging.info("Cluster worker %d stopped", partition)
+
+
+class Cluster:
+    """
+    The cluster supervisor: it starts the worker processes and partitions the updates among them.
+    """
+
+    def __init__(self, setup: Callable[[], None], workers: Optional[int] = None, queue: Optional[UpdateQueue] = None,
+                 user_cache: bool = False, mp_context: str = "spawn"):
+        """
+        :param setup: the function initializing the bot and registering its handlers in every worker process. With
+                      the default "spawn" start method, it must be a module-level function
+        :param workers: optional: the number of local worker processes. Default is the number of CPUs. Set it to 0
+                        when all workers run on other nodes
+        :param queue: optional: the update queue. Default is a MultiprocessingUpdateQueue with one partition per
+                      worker
+        :param user_cache: optional: keep the users cache enabled in the workers. See `run_worker`
+        :param mp_context: optional: the multiprocessing start method. Default is "spawn"
+        """
+        self._ctx = multiprocessing.get_context(mp_context)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if queue is None:
+            if workers < 1:
+                raise ValueError("A cluster without local workers needs a queue shared with the remote workers.")
+            queue = MultiprocessingUpdateQueue(workers, mp_context=self._ctx)
+        if workers > queue.partitions:
+            raise ValueError("The number of local workers can't be greater than the number of queue partitions.")
+
+        self.setup = setup
+        self.workers = workers
+        self.queue = queue
+        self.user_cache = user_cache
+        self._processes = []
+        self._stopped = threading.Event()
+
+    def start(self):
+        for partition in range(self.workers):
+            process = self._ctx.Process(
+                target=run_worker,
+                args=(self.setup, partition, self.queue, self.user_cache),
+                name=f"botstarter-worker-{partition}"
+            )
+            process.start()
+            self._processes.append(process)
+        logging.info("Started cluster with %d local workers and %d partitions", self.workers, self.queue.partitions)
+
+    def submit(self, update: dict):
+        """
+        Queues an update on the partition of its chat.
+
+        :param update: the JSON update received from Telegram
+        """
+        self.queue.put(partition_of(update, self.queue.partitions), json.dumps(update))
+
+    def poll(self, token: str, timeout: int = DEFAULT_POLLING_TIMEOUT, allowed_updates=None):
+        """
+        Polls the Telegram API for updates and submits them, until the cluster is stopped.
+
+        :param token: the bot token
+        :param timeout: optional: the long polling timeout in seconds. Default is 20
+        :param allowed_updates: optional: the list of update types to receive
+        """
+        offset = None
+        while not self._stopped.is_set():
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=timeout,
+                                                allowed_updates=allowed_updates, long_polling_timeout=timeout)
+            except Exception:
+                logging.exception("Could not get updates from the Telegram API")
+                self._stopped.wait(3)
+                continue
+            for update in updates:
+                self.submit(update)
+                offset = update["update_id"] + 1
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        Stops the cluster: workers stop after processing the updates already queued.
+
+        :param timeout: optional: the maximum number of seconds to wait for each worker
+        """
+        self._stopped.set()
+        for partition in range(self.queue.partitions):
+            self.queue.put(partition, STOP_MESSAGE)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning("Cluster worker %s did not stop in time, terminating it", process.name)
+                process.terminate()
+        self._processes = []
+        self.queue.close()
+
+
+def start_cluster(setup: Callable[[], None], workers: Optional[int] = None, queue: Optional[UpdateQueue] = None,
+                  token: Optional[str] = None, webhook_opts: Optional[dict] = None, **kwargs):
+    """
+    Starts the cluster supervisor and worker processes, then receives updates until the process is interrupted or
+    terminated.
+
+    :param setup: the function initializing the bot and registering its handlers in every worker process
+    :param workers: optional: the number of local worker processes. Default is the number of CPUs
+    :param queue: optional: the update queue. Default is a local multiprocessing queue
+    :param token: optional: the Telegram bot token, can be supplied via the 'BOT_TOKEN' env variable
+    :param webhook_opts: optional: receive updates with the embedded webhook server instead of polling. Keyword
+                         arguments for the botstarter.webhook.WebhookServer, e.g. port and secret_token
+    :param kwargs: additional keyword arguments for the Cluster object creation
+    """
+    p_bot_token = token or os.getenv("BOT_TOKEN")
+    if not p_bot_token:
+        raise ValueError(
+            "A bot token must be specified either via the 'token' parameter or the 'BOT_TOKEN' environment variable")
+
+    cluster = Cluster(setup, workers=workers, queue=queue, **kwargs)
+    cluster.start()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        if webhook_opts is not None:
+            from botstarter.webhook import WebhookServer
+            server = WebhookServer(cluster.submit, raw_updates=True, **webhook_opts)
+            logging.info("Starting cluster webhook server on port %d", server.server_address[1])
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+        else:
+            logging.info("Starting cluster polling")
+            cluster.poll(p_bot_token)
+    except KeyboardInterrupt:
+        logging.info("Stopping cluster")
+    finally:
+        cluster.shutdown(timeout=30)
@@ -0,0 +1,153 @@
+"""
+Asyncio database layer, built on the Motor driver for MongoDB.
+
+Models are the same classes registered with `register_model`, documents read through this module are returned as
+model objects, and the users cache is shared with the synchronous API.
+"""
+import logging
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from botstarter.db import base
+from botstarter.db.users import User, new_user
+
+__client = None
+__db = None
+__create_indexes = True
+
+
+def init_db(host=None, port=None, database_name=None, auth=None, create_indexes=True, model_packages=None):
+    """
+    Initializes the asyncio database connection with MongoDB.
+    Connection parameters and environment variables are the same supported by `botstarter.db.base.init_db`.
+
+    :param: host: the db hostname. Default is "localhost". Can also be set with "MONGODB_HOST" environment variable
+    :param: port: the db port. Default is "27017". Can also be set with "MONGODB_PORT" environment variable
+    :param: database_name: the name of the database. Default is "pybotstarter". Can also be set with "DATABASE_NAME" environment variable
+    :param: auth: a dict containing the "username" and "password" keys for authentication
+    :param: create_indexes: create the indexes declared by registered models with `ensure_indexes()` when the bot
+                            starts. Default is True
+    :param: model_packages: the names of the packages or modules defining the bot models. See
+                            `botstarter.db.base.discover_models`
+    """
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError as e:
+        raise ImportError("The asyncio database layer requires the 'motor' package. "
+                          "Install it with: pip install py-bot-starter[aio]") from e
+
+    global __client, __db, __create_indexes
+
+    __create_indexes = create_indexes
+    client_kwargs, database_name = base._resolve_connection_params(host, port, database_name, auth)
+    __client = AsyncIOMotorClient(**client_kwargs)
+    __db = __client[database_name]
+    base.discover_models(model_packages)
+    logging.debug("Initialized asyncio database connection")
+
+
+def get_db():
+    global __db
+    if __db is not None:
+        return __db
+    else:
+        raise RuntimeError("""
+Database was not initialised. To fix this issue add the following lines to your main python file:
+
+from botstarter.db.aio import init_db
+
+if __name__ == "__main__":
+    init_db()""")
+
+
+def get_collection(cls):
+    """
+    Returns the Motor collection for a registered model class.
+
+    :param cls: the model class
+    :return: the motor.motor_asyncio.AsyncIOMotorCollection object
+    """
+    for name, model_cls in base.MODEL_CLASSES.items():
+        if model_cls is cls:
+            return get_db()[name]
+    raise ValueError(f"Class {cls.__name__} is not a registered model.")
+
+
+async def get_user_by_id(user_id) -> Optional[User]:
+    if User.__cache__ is None:
+        doc = await get_collection(User).find_one({"id": user_id})
+        return User(doc) if doc else None
+
+    cached = User.__cache__.get(user_id)
+    if cached is not None:
+        return User(cached)
+
+    token = User.__cache__.reserve(user_id)
+    doc = await get_collection(User).find_one({"id": user_id})
+    user = User(doc) if doc else None
+    User.__cache__.put_reserved(user_id, user._cache_value() if user is not None else None, token)
+    return user
+
+
+async def ensure_indexes(force=False):
+    """
+    Creates the indexes declared by all registered models. See `botstarter.db.base.ensure_indexes`.
+
+    :param force: create indexes even if index creation was disabled in `init_db`
+    """
+    if not (__create_indexes or force):
+        return
+    for name, cls in base.MODEL_CLASSES.items():
+        if not cls.__indexes__:
+            continue
+        try:
+            await get_db()[name].create_indexes(cls.__indexes__)
+        except PyMongoError as e:
+            logging.error("Could not create indexes on collection %s: %s", name, e)
+
+
+async def create_user(msg) -> User:
+    user = new_user(msg)
+    res = await get_collection(User).insert_one(user)
+    user["_id"] = res.inserted_id
+    user._put_cache()
+    return user
+
+
+async def get_or_create_user(msg) -> User:
+    """
+    Returns the user that sent the message, creating it with an atomic upsert if it doesn't exist yet.
+    See `botstarter.db.users.get_or_create_user`.
+    """
+    user = await get_user_by_id(msg.from_user.id)
+    if user is not None:
+        return user
+
+    fields = new_user(msg)
+    fields.pop("id")
+    try:
+        doc = await get_collection(User).find_one_and_update(
+            {"id": msg.from_user.id},
+            {"$setOnInsert": fields},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # a concurrent upsert inserted the user first
+        doc = await get_collection(User).find_one({"id": msg.from_user.id})
+    user = User(doc)
+    user._put_cache()
+    return user
+
+
+async def set_user_waiting_on(user_id, waiting_on=None):
+    await get_collection(User).update_one({"id": user_id}, {"$set": {"waiting_on": waiting_on}})
+    if User.__cache__ is not None:
+        User._update_cache({"id": user_id}, {"$set": {"waiting_on": waiting_on}})
+
+
+async def is_admin(user_id) -> bool:
+    doc = await get_collection(User).find_one({"id": user_id, "is_admin": True})
+    return bool(doc)
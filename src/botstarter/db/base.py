@@ -1,72 +1,325 @@
 import logging
 import os
+import pkgutil
+import threading
+import time
+import warnings
 from enum import Enum
 from importlib import import_module
 from os.path import isdir
-from typing import List, TypeVar, Optional
+from typing import Iterable, Iterator, List, TypeVar, Optional
 
 import pymongo
 from bson import ObjectId
 from pymongo import database
 from pymongo.database import Collection
+from pymongo.errors import PyMongoError
 from pymongo.results import UpdateResult, DeleteResult
 
+from botstarter.cache import LRUCache
+from botstarter.metrics import DB_OPERATION_DURATION
+
 __db: database.Database = None
+__create_indexes = True
+__bind_lock = threading.Lock()
+__index_threads: List[threading.Thread] = []
 
 DEFAULT_DATABASE = "pybotstarter"
 
-TBase = TypeVar("TBase", bound="Base")
+"""
+Entry point group of the packages and modules defining the models of a bot, imported by `init_db`:
+
+    entry_points={"botstarter.models": ["mybot = mybot.db"]}
+"""
+MODELS_ENTRY_POINT_GROUP = "botstarter.models"
+
+BUILTIN_MODEL_MODULES = ("botstarter.db.broadcasts", "botstarter.db.medias", "botstarter.db.users")
+
+TBase = TypeVar("TBase", bound="ModelMixin")
+
+
+class _LazyCollection:
+    """
+    The `__collection__` of registered model classes until their first use. The collection is bound when the model
+    is first used after `init_db`, and it replaces this descriptor on the model class.
+    """
+
+    def __get__(self, obj, cls):
+        return _bind_collection(cls)
+
+
+_lazy_collection = _LazyCollection()
+_BOUND_MODELS = []
+_INDEXED_MODELS = set()
 
 
-class Base(dict):
+class ModelMixin:
+    """
+    The database operations of model classes. Models are mappings of the document fields: `Base` models are dicts
+    with any field, while `botstarter.db.document.Document` models only have the fields they declare.
+    """
+    __slots__ = ()
+
     __collection__: Collection = None
 
-    __getattr__ = dict.get
-    __delattr__ = dict.__delitem__
-    __setattr__ = dict.__setitem__
+    """
+    Optional write-through cache of model documents, keyed by the value of the `__cache_key__` field.
+    Models that set a cache can be looked up with `find_cached()`, while `save()`, `reload()`, `remove()` and
+    `update_one()` keep the cached documents up to date.
+    """
+    __cache__: Optional[LRUCache] = None
+    __cache_key__: str = "id"
+
+    __indexes__: List[pymongo.IndexModel] = []
+
+    """
+    Optional write-behind buffer of model updates. See botstarter.db.writebehind
+    """
+    __write_behind__ = None
+
+    """
+    Optional projection of the documents read by the model methods, when they are called without one
+    """
+    __projection__: Optional[dict] = None
+
+    @classmethod
+    def _projection(cls, args, kwargs):
+        # the projection is the second positional argument of pymongo find methods
+        if cls.__projection__ is not None and len(args) < 2 and "projection" not in kwargs:
+            kwargs["projection"] = cls.__projection__
 
     @classmethod
     def get_doc(cls, object_id) -> TBase:
-        doc = cls.__collection__.find_one({"_id": ObjectId(object_id)})
+        with DB_OPERATION_DURATION.time(cls.__name__, "get_doc"):
+            doc = cls.__collection__.find_one({"_id": ObjectId(object_id)}, cls.__projection__)
+        if doc and cls.__write_behind__ is not None and cls.__write_behind__.flush_document(cls, doc):
+            # the document was read before its buffered updates were written
+            with DB_OPERATION_DURATION.time(cls.__name__, "get_doc"):
+                doc = cls.__collection__.find_one({"_id": ObjectId(object_id)}, cls.__projection__)
         if doc:
             return cls(doc)
 
     @classmethod
     def find(cls, *args, **kwargs) -> List[TBase]:
-        docs = cls.__collection__.find(*args, **kwargs)
-        if docs:
-            return [cls(doc) for doc in docs]
+        cls._flush_pending(args[0] if args else kwargs.get("filter"))
+        cls._projection(args, kwargs)
+        with DB_OPERATION_DURATION.time(cls.__name__, "find"):
+            docs = cls.__collection__.find(*args, **kwargs)
+            if docs:
+                return [cls(doc) for doc in docs]
+
+    @classmethod
+    def iter_find(cls, filter=None, projection=None, batch_size=None, limit=0, sort=None,
+                  hint=None) -> Iterator[TBase]:
+        """
+        Finds documents and lazily yields them as model objects, reading them from the database in batches.
+        Unlike find(), documents are not loaded in memory all at once.
+
+        :param filter: optional: the query filter. By default, all documents are returned
+        :param projection: optional: the fields to return, as a list of field names or a dict
+        :param batch_size: optional: the number of documents fetched from the database in each round trip
+        :param limit: optional: the maximum number of documents to return. Default is no limit
+        :param sort: optional: a list of (key, direction) pairs to sort the documents
+        :param hint: optional: the index to use for the query
+        :return: a generator of model objects
+        """
+        cls._flush_pending(filter)
+        cursor = cls.__collection__.find(filter, projection or cls.__projection__, limit=limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        if hint:
+            cursor = cursor.hint(hint)
+        # only the time spent reading from the cursor is observed, not the time the caller spends between documents
+        elapsed = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    doc = next(cursor)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield cls(doc)
+        finally:
+            cursor.close()
+            DB_OPERATION_DURATION.observe(elapsed, cls.__name__, "iter_find")
 
     @classmethod
     def find_one(cls, *args, **kwargs) -> TBase:
-        doc = cls.__collection__.find_one(*args, **kwargs)
+        cls._flush_pending(args[0] if args else kwargs.get("filter"))
+        cls._projection(args, kwargs)
+        with DB_OPERATION_DURATION.time(cls.__name__, "find_one"):
+            doc = cls.__collection__.find_one(*args, **kwargs)
         if doc:
             return cls(doc)
 
     @classmethod
-    def update_one(cls, *args, **kwargs) -> UpdateResult:
-        return cls.__collection__.update_one(*args, **kwargs)
+    def find_cached(cls, key) -> Optional[TBase]:
+        """
+        Finds a document by the value of its `__cache_key__` field, reading it from the model cache when possible.
+
+        :param key: the value of the cache key field
+        :return: the model object, or None if no document was found
+        """
+        if cls.__cache__ is None:
+            return cls.find_one({cls.__cache_key__: key})
+
+        doc = cls.__cache__.get(key)
+        if doc is not None:
+            return cls(doc)
 
-    def save(self):
-        if not self._id:
-            res = self.__collection__.insert_one(self)
-            self['_id'] = res.inserted_id
+        # the document is not cached if it's updated while it's read, since the read may return the previous version
+        token = cls.__cache__.reserve(key)
+        obj = cls.find_one({cls.__cache_key__: key})
+        cls.__cache__.put_reserved(key, obj._cache_value() if obj is not None else None, token)
+        return obj
+
+    @classmethod
+    def update_one(cls, *args, sync: bool = False, **kwargs) -> Optional[UpdateResult]:
+        """
+        Updates a document. If the model has a write-behind buffer, simple updates are buffered and None is returned.
+
+        :param sync: optional: write the update immediately, even if the model has a write-behind buffer. Default
+                     is False
+        :return: the pymongo UpdateResult, or None if the update was buffered
+        """
+        query = args[0] if len(args) > 0 else kwargs.get("filter")
+        update = args[1] if len(args) > 1 else kwargs.get("update")
+        if cls.__write_behind__ is not None:
+            if not sync and len(args) + len(kwargs) == 2 and cls.__write_behind__.update(cls, query, update):
+                if cls.__cache__ is not None:
+                    cls._update_cache(query, update)
+                return None
+            # pending updates of the document are written first
+            cls._flush_pending(query)
+
+        with DB_OPERATION_DURATION.time(cls.__name__, "update_one"):
+            result = cls.__collection__.update_one(*args, **kwargs)
+        if cls.__cache__ is not None:
+            cls._update_cache(query, update)
+        return result
+
+    @classmethod
+    def _flush_pending(cls, query):
+        # writes the buffered updates of the documents matching a query before reading or writing them directly.
+        # Buffered updates are looked up by filter: for queries other than the cache key, any document could match
+        # and all the buffered updates of the model are written
+        if cls.__write_behind__ is not None and cls.__write_behind__.has_pending(cls):
+            if cls.__write_behind__.has_pending(cls, query):
+                cls.__write_behind__.flush(cls, query)
+            elif not isinstance(query, dict) or query.keys() != {cls.__cache_key__}:
+                cls.__write_behind__.flush(cls)
+
+    @classmethod
+    def find_one_and_update(cls, filter, update, **kwargs) -> Optional[TBase]:
+        cls._flush_pending(filter)
+        cls._projection((), kwargs)
+        with DB_OPERATION_DURATION.time(cls.__name__, "find_one_and_update"):
+            doc = cls.__collection__.find_one_and_update(filter, update, **kwargs)
+        if cls.__cache__ is not None:
+            cls._update_cache(filter, update)
+        if doc:
+            return cls(doc)
+
+    @classmethod
+    def _update_cache(cls, query, update):
+        key = query.get(cls.__cache_key__) if isinstance(query, dict) else None
+        if key is None or isinstance(key, dict):
+            # we can't tell which documents were updated
+            cls.__cache__.clear()
+            return
+
+        simple_update = isinstance(update, dict) and update and update.keys() <= {"$set", "$inc"}
+        fields = update.get("$set") or {} if simple_update else {}
+        increments = update.get("$inc") or {} if simple_update else {}
+        if query.keys() == {cls.__cache_key__} and simple_update and \
+                not any("." in f for f in (*fields, *increments)) and cls._has_fields((*fields, *increments)):
+            # write-through simple updates of top-level fields
+            cls.__cache__.update(key, fields, increments)
         else:
-            self.__collection__.update_one({"_id": ObjectId(self._id)}, self)
+            cls.__cache__.invalidate(key)
+
+    @classmethod
+    def _has_fields(cls, fields) -> bool:
+        """
+        :return: True if the model objects can hold all the fields
+        """
+        return True
+
+    def _cache_value(self):
+        """
+        :return: the copy of the model object kept in the model cache
+        """
+        return dict(self)
+
+    def _insert_document(self):
+        """
+        :return: the document inserted by `save()` for a new model object
+        """
+        return self
+
+    def _update_document(self):
+        """
+        :return: the update sent by `save()` for an existing model object
+        """
+        return self
+
+    def _put_cache(self):
+        if self.__cache__ is not None and self.get(self.__cache_key__) is not None:
+            self.__cache__.put(self[self.__cache_key__], self._cache_value())
+
+    def _flush_pending_document(self):
+        # buffered updates are found by the values of the document fields in their filters: flushing them by `_id`
+        # would write the buffered updates of all documents
+        if self.__write_behind__ is not None:
+            self.__write_behind__.flush_document(type(self), self)
+
+    def save(self):
+        object_id = self.get("_id")
+        self._flush_pending_document()
+        with DB_OPERATION_DURATION.time(type(self).__name__, "save"):
+            if not object_id:
+                res = self.__collection__.insert_one(self._insert_document())
+                self['_id'] = res.inserted_id
+            else:
+                self.__collection__.update_one({"_id": ObjectId(object_id)}, self._update_document())
+        self._put_cache()
 
     def reload(self):
-        if self._id:
-            self.update(self.__collection__.find_one({"_id": ObjectId(self._id)}))
+        object_id = self.get("_id")
+        if object_id:
+            self._flush_pending_document()
+            with DB_OPERATION_DURATION.time(type(self).__name__, "reload"):
+                self.update(self.__collection__.find_one({"_id": ObjectId(object_id)}, self.__projection__))
+            self._put_cache()
 
     def remove(self) -> Optional[DeleteResult]:
-        if self._id:
-            result = self.__collection__.delete_one({"_id": ObjectId(self._id)})
+        object_id = self.get("_id")
+        if object_id:
+            if self.__cache__ is not None and self.get(self.__cache_key__) is not None:
+                self.__cache__.invalidate(self[self.__cache_key__])
+            self._flush_pending_document()
+            with DB_OPERATION_DURATION.time(type(self).__name__, "remove"):
+                result = self.__collection__.delete_one({"_id": ObjectId(object_id)})
             self.clear()
             return result
         else:
             return None
 
 
+class Base(ModelMixin, dict):
+    """
+    A model of documents with any field. Fields are accessed as dict items or as attributes, and missing fields are
+    None.
+    """
+    __getattr__ = dict.get
+    __delattr__ = dict.__delitem__
+    __setattr__ = dict.__setitem__
+
+
 def get_db() -> database.Database:
     global __db
     if __db is not None:
@@ -81,6 +334,20 @@ if __name__ == "__main__":
     init_db()""")
 
 
+def close_db():
+    """
+    Closes the connection pool of the database client. Models are bound again to their collections when the
+    database is initialized again.
+    """
+    global __db
+    if __db is None:
+        return
+    _unbind_models()
+    db, __db = __db, None
+    db.client.close()
+    logging.debug("Closed database connection")
+
+
 MODEL_INTERCEPTORS = {}
 MODEL_CLASSES = {}
 
@@ -89,9 +356,31 @@ class InterceptorHooks(Enum):
     SAVE_USER_CREATE = "save_user_create"
 
 
-def register_model(name):
+def register_model(name, indexes: Optional[List[pymongo.IndexModel]] = None):
+    """
+    Registers a model class for a collection.
+
+        @register_model("orders", indexes=[
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+            IndexModel("reference", unique=True),
+            IndexModel("expires_at", expireAfterSeconds=0)
+        ])
+        class Order(Base):
+            pass
+
+    :param name: the name of the collection
+    :param indexes: optional: the pymongo.IndexModel indexes of the collection. Indexes are created when the database
+                    is initialized, if they don't exist yet
+    :return: the decorator wrapper function
+    """
+
     def wrapper(cls):
         MODEL_CLASSES[name] = cls
+        cls.__collection_name__ = name
+        if "__collection__" not in cls.__dict__:
+            cls.__collection__ = _lazy_collection
+        if indexes is not None:
+            cls.__indexes__ = list(indexes)
         return cls
 
     return wrapper
@@ -111,47 +400,135 @@ def get_interceptors(hook_name):
     return MODEL_INTERCEPTORS.get(hook_name)
 
 
-def __create_models():
-    for collection in MODEL_CLASSES.keys():
-        cls = MODEL_CLASSES.get(collection)
-        cls.__collection_name__ = collection
-        cls.__collection__ = get_db()[collection]
+def ensure_indexes(cls):
+    """
+    Creates the indexes declared by a model class. Indexes that already exist are left unchanged.
+
+    :param cls: the registered model class
+    """
+    _create_indexes(cls, cls.__collection__)
+
+
+def _create_indexes(cls, collection):
+    if not cls.__indexes__:
+        return
+    try:
+        names = collection.create_indexes(cls.__indexes__)
+        logging.debug("Ensured indexes %s on collection %s", names, cls.__collection_name__)
+    except PyMongoError as e:
+        logging.error("Could not create indexes on collection %s: %s", cls.__collection_name__, e)
 
 
-def __load_db_modules_extensions():
-    # todo: walk db packages using pkgutil, for now using a workaround
-    # import pkgutil
-    # for loader, module_name, is_pkg in pkgutil.walk_packages(botstarter.db.__path__):
-    #     print(module_name)
-    import_module("botstarter.db.medias")
-    import_module("botstarter.db.users")
+def _create_indexes_in_background(classes):
+    # indexes are created once for each model class, without binding it to its collection
+    classes = [cls for cls in classes if cls.__indexes__ and cls not in _INDEXED_MODELS]
+    if not classes:
+        return
+    _INDEXED_MODELS.update(classes)
+    db = __db
 
-    caller_db_modules_dir = "db"
-    if isdir(caller_db_modules_dir):
-        modules = os.listdir(caller_db_modules_dir)
-        for m in [mod.replace(".py", "") for mod in modules if mod.endswith(".py") and mod != "__init__.py"]:
-            logging.debug("Loading db module %s", m)
-            import_module(f"{caller_db_modules_dir}.{m}")
+    def create():
+        for cls in classes:
+            _create_indexes(cls, db[cls.__collection_name__])
 
+    # index creation waits for the server selection timeout when the database is unreachable, and it must not
+    # delay the startup
+    thread = threading.Thread(target=create, name="botstarter-indexes", daemon=True)
+    __index_threads.append(thread)
+    thread.start()
 
-def init_db(host=None, port=None, database_name=None, auth=None):
+
+def wait_indexes(timeout: Optional[float] = None) -> bool:
     """
-    Initializes the database connection with MongoDB.
-    Parameters for the connection can be set using function parameters or environment variables. Every time a
-    parameter is supplied directly to the function, it will override whatever is defined as an environment variables.
-    In essence, environment variables are used as "fallback values" for missing parameters.
+    Waits for the indexes of the registered models to be created. Indexes are created in the background by
+    `init_db`, and when models registered after the initialization are first used.
 
-    :param: host: the db hostname. Default is "localhost". Can also be set with "MONGODB_HOST" environment variable
-    :param: port: the db port. Default is "27017". Can also be set with "MONGODB_PORT" environment variable
-    :param: database_name: the name of the database. Default is "pybotstarter". Can also be set with "DATABASE_NAME" environment variable
-    :param: auth:   a dict containing the "username" and "password" keys for authentication. If left empty,
-                    no authentication is used. To set authentication with environment variables, both "MONGODB_USERNAME"
-                    and "MONGODB_PASSWORD" environment variables must be defined. If not a ValueError is raised.
+    :param timeout: optional: the maximum number of seconds to wait. Default is no limit
+    :return: True if index creation completed, False if the timeout expired
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    for thread in list(__index_threads):
+        thread.join(max(deadline - time.monotonic(), 0) if deadline is not None else None)
+    __index_threads[:] = [t for t in __index_threads if t.is_alive()]
+    return not __index_threads
+
+
+def _bind_collection(cls) -> Optional[Collection]:
+    if __db is None:
+        # models have no collection until the database is initialized
+        return None
+    with __bind_lock:
+        bound = cls.__dict__.get("__collection__")
+        if bound is not None and bound is not _lazy_collection:
+            # bound by another thread
+            return bound
+        collection = __db[cls.__collection_name__]
+        cls.__collection__ = collection
+        _BOUND_MODELS.append(cls)
+        logging.debug("Bound model %s to collection %s", cls.__name__, cls.__collection_name__)
+        if __create_indexes:
+            _create_indexes_in_background([cls])
+    return collection
+
+
+def _unbind_models():
+    # models are bound again to the collections of the new database on their next use
+    with __bind_lock:
+        for cls in _BOUND_MODELS:
+            cls.__collection__ = _lazy_collection
+        _BOUND_MODELS.clear()
+
+
+def _import_models(module_name):
+    module = import_module(module_name)
+    if hasattr(module, "__path__"):
+        for info in pkgutil.walk_packages(module.__path__, f"{module.__name__}."):
+            logging.debug("Loading db module %s", info.name)
+            import_module(info.name)
+
+
+def _entry_point_modules() -> List[str]:
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=MODELS_ENTRY_POINT_GROUP)
+    else:
+        # python < 3.10
+        eps = eps.get(MODELS_ENTRY_POINT_GROUP, [])
+    return [ep.value.split(":")[0].strip() for ep in eps]
 
 
+def discover_models(packages: Optional[Iterable[str]] = None):
     """
-    global __db
+    Imports the modules defining models, so that their models and interceptors are registered. Packages are walked
+    recursively.
+
+    :param packages: optional: the names of the packages or modules defining models. By default, the modules of the
+                     "botstarter.models" entry points of the installed distributions are imported. If there are
+                     none, the modules of the `db` directory in the working directory are imported, as in previous
+                     versions
+    """
+    for module_name in BUILTIN_MODEL_MODULES:
+        import_module(module_name)
+
+    if packages is None:
+        packages = _entry_point_modules()
+        if not packages and isdir("db"):
+            warnings.warn("Loading models from the db directory of the working directory is deprecated. Set the "
+                          "model packages with the model_packages parameter of init_db, or with a "
+                          f"'{MODELS_ENTRY_POINT_GROUP}' entry point.", DeprecationWarning)
+            packages = ["db"]
 
+    for package in packages:
+        _import_models(package)
+
+
+def _resolve_connection_params(host=None, port=None, database_name=None, auth=None):
+    """
+    Resolves the database connection parameters, falling back to environment variables for missing values.
+
+    :return: a tuple with the client connection keyword arguments and the database name
+    """
     p_host = host or os.getenv("MONGODB_HOST", "localhost")
     p_port = port or os.getenv("MONGODB_PORT", 27017)
     p_database_name = database_name or os.getenv("DATABASE_NAME", DEFAULT_DATABASE)
@@ -170,11 +547,49 @@ def init_db(host=None, port=None, database_name=None, auth=None):
             raise ValueError(
                 "Only one authentication variable is set. Please provide both MONGODB_USERNAME and MONGODB_PASSWORD.")
 
-    client = pymongo.MongoClient(
-        host=p_host,
-        port=int(p_port),
+    client_kwargs = {
+        "host": p_host,
+        "port": int(p_port),
         **auth
-    )
+    }
+    return client_kwargs, p_database_name
+
+
+def init_db(host=None, port=None, database_name=None, auth=None, create_indexes=True,
+            model_packages: Optional[Iterable[str]] = None):
+    """
+    Initializes the database connection with MongoDB.
+    Parameters for the connection can be set using function parameters or environment variables. Every time a
+    parameter is supplied directly to the function, it will override whatever is defined as an environment variables.
+    In essence, environment variables are used as "fallback values" for missing parameters.
+
+    :param: host: the db hostname. Default is "localhost". Can also be set with "MONGODB_HOST" environment variable
+    :param: port: the db port. Default is "27017". Can also be set with "MONGODB_PORT" environment variable
+    :param: database_name: the name of the database. Default is "pybotstarter". Can also be set with "DATABASE_NAME" environment variable
+    :param: auth:   a dict containing the "username" and "password" keys for authentication. If left empty,
+                    no authentication is used. To set authentication with environment variables, both "MONGODB_USERNAME"
+                    and "MONGODB_PASSWORD" environment variables must be defined. If not a ValueError is raised.
+    :param: create_indexes: create the indexes declared by registered models in the background, if they don't exist
+                            yet. Indexes of models registered after initialization are created when the model is first
+                            used. Errors are logged and don't stop the bot. Can be disabled when indexes are managed
+                            separately. Default is True
+    :param: model_packages: the names of the packages or modules defining the bot models, imported with
+                            `discover_models()`. By default, they are read from the "botstarter.models" entry points
+
+    Model classes are bound to their collection when they are first used, so models registered after the
+    initialization can be used as well.
+    """
+    global __db, __create_indexes
+
+    client_kwargs, p_database_name = _resolve_connection_params(host, port, database_name, auth)
+
+    client = pymongo.MongoClient(**client_kwargs)
+    _unbind_models()
     __db = client[p_database_name]
-    __load_db_modules_extensions()
-    __create_models()
+    __create_indexes = create_indexes
+    discover_models(model_packages)
+    if create_indexes:
+        with __bind_lock:
+            _INDEXED_MODELS.clear()
+            _create_indexes_in_background([cls for cls in MODEL_CLASSES.values()
+                                           if cls.__dict__.get("__collection__") is _lazy_collection])
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from botstarter.db.base import Base, register_model
+
+
+@register_model("broadcasts")
+class Broadcast(Base):
+    """
+    A class to represent broadcasts collection, where the progress of each broadcast is checkpointed
+    """
+
+
+def get_broadcast(broadcast_id):
+    return Broadcast.find_one({"_id": broadcast_id})
+
+
+def save_checkpoint(broadcast_id, last_user_oid, delivered, blocked, failed, completed=False):
+    Broadcast.update_one(
+        {"_id": broadcast_id},
+        {
+            "$set": {
+                "last_user_oid": last_user_oid,
+                "delivered": delivered,
+                "blocked": blocked,
+                "failed": failed,
+                "completed": completed,
+                "updated_at": datetime.utcnow()
+            }
+        },
+        upsert=True
+    )
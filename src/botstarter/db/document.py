@@ -0,0 +1,172 @@
+"""
+Typed model documents.
+
+`Base` models are dicts: they hold every field of the documents read from the database, and a misspelled attribute
+is silently None. Document models declare their fields with class annotations instead:
+
+    @register_model("orders")
+    class Order(Document):
+        user_id: int
+        status: str = "new"
+        tags: list = []
+
+Document objects store the declared fields in `__slots__`, which take less memory than a dict: the gain is for
+processes that keep many model objects in memory. Reads are not measurably faster, since their time is spent in the
+database driver. The model methods only fetch the declared fields, and accessing an undeclared attribute raises
+AttributeError.
+
+The built-in `User` model stays a `Base` model, since SAVE_USER_CREATE interceptors can add any field to users.
+
+Documents are mutable mappings of their fields, so they can be used in place of `Base` models with dict-style
+access: `order["status"]`, `order.get("status")` or `dict(order)`. Fields without a default are None when they are
+missing from the database document. The `_id` field is only set when the document has one.
+"""
+from abc import ABCMeta
+from collections.abc import MutableMapping
+from copy import copy
+from typing import ClassVar, get_origin
+
+from botstarter.db.base import ModelMixin
+
+_MISSING = object()
+
+_INIT_DOC = """
+        :param doc: optional: a mapping of field values, e.g. a document read from the database. Undeclared fields
+                    are ignored
+        :param fields: field values, overriding the ones of the doc. Undeclared fields raise AttributeError
+        """
+
+
+def _make_init(fields, defaults):
+    """
+    Generates the __init__ method of a Document class, which sets each field with an attribute assignment, like
+    dataclasses do. It's faster than setting the fields in a loop.
+    """
+    namespace = {"_MISSING": _MISSING, "_NO_FIELDS": {}, "copy": copy}
+    lines = [
+        "def __init__(self, doc=None, **fields):",
+        "    get = doc.get if doc is not None else _NO_FIELDS.get"
+    ]
+    for i, field in enumerate(fields):
+        default = namespace[f"_default_{i}"] = defaults.get(field)
+        if isinstance(default, (list, dict, set)):
+            # mutable defaults are copied, so that objects don't share them
+            lines.append(f"    value = get({field!r}, _MISSING)")
+            lines.append(f"    self.{field} = copy(_default_{i}) if value is _MISSING else value")
+        else:
+            lines.append(f"    self.{field} = get({field!r}, _default_{i})")
+    lines += [
+        "    value = get('_id', _MISSING)",
+        "    if value is not _MISSING:",
+        "        self._id = value",
+        "    for field, value in fields.items():",
+        "        setattr(self, field, value)"
+    ]
+    exec("\n".join(lines), namespace)
+    return namespace["__init__"]
+
+
+class DocumentMeta(ABCMeta):
+    """
+    Builds the `__slots__`, defaults and projection of Document classes from their field annotations.
+    """
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        inherited_fields = ()
+        inherited_defaults = {}
+        for base in bases:
+            inherited_fields += tuple(f for f in getattr(base, "__fields__", ()) if f not in inherited_fields)
+            inherited_defaults.update(getattr(base, "__defaults__", {}))
+
+        fields = []
+        defaults = {}
+        for field, annotation in namespace.get("__annotations__", {}).items():
+            if field.startswith("_") or get_origin(annotation) is ClassVar or annotation is ClassVar:
+                continue
+            if field not in inherited_fields and any(hasattr(base, field) for base in bases):
+                raise TypeError(f"Field [{field}] of {name} has the name of a model or mapping method.")
+            if field in namespace:
+                # class attributes conflict with slots of the same name
+                defaults[field] = namespace.pop(field)
+            if field not in inherited_fields:
+                fields.append(field)
+
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(fields)
+        cls = super().__new__(mcs, name, bases, namespace, **kwargs)
+        cls.__fields__ = inherited_fields + tuple(fields)
+        cls.__defaults__ = {**inherited_defaults, **defaults}
+        cls.__keys__ = ("_id",) + cls.__fields__
+        cls.__keyset__ = frozenset(cls.__keys__)
+        init = _make_init(cls.__fields__, cls.__defaults__)
+        init.__doc__ = _INIT_DOC
+        init.__qualname__ = f"{cls.__qualname__}.__init__"
+        cls.__init__ = init
+        if cls.__fields__:
+            cls.__projection__ = {f: True for f in cls.__fields__}
+        return cls
+
+
+class Document(ModelMixin, MutableMapping, metaclass=DocumentMeta):
+    """
+    A model of documents with declared fields.
+    """
+    __slots__ = ("_id",)
+
+    # __init__ is generated for each Document class by DocumentMeta
+
+    def __getitem__(self, key):
+        if key in self.__keyset__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__keyset__:
+            raise KeyError(f"[{key}] is not a field of {type(self).__name__}.")
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.__keys__:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        if key in self.__keyset__:
+            return getattr(self, key, default)
+        return default
+
+    def copy(self):
+        return type(self)(self)
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__keys__ if hasattr(self, key)}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    @classmethod
+    def _has_fields(cls, fields) -> bool:
+        return cls.__keyset__.issuperset(fields)
+
+    def _cache_value(self):
+        return self.copy()
+
+    def _insert_document(self):
+        return self.to_dict()
+
+    def _update_document(self):
+        # only the declared fields are replaced, the other fields of the stored document are kept
+        fields = self.to_dict()
+        fields.pop("_id", None)
+        return {"$set": fields}
@@ -1,7 +1,16 @@
+from pymongo import IndexModel, ASCENDING
+from pymongo.errors import DuplicateKeyError
+
 from botstarter.db.base import Base, register_model
 
 
-@register_model("medias")
+@register_model("medias", indexes=[
+    IndexModel("path"),
+    # a file is saved once for each media type, even when processes upload it at the same time. Medias created by
+    # path only have no hash, and are not indexed
+    IndexModel([("hash", ASCENDING), ("media_type", ASCENDING)], unique=True,
+               partialFilterExpression={"hash": {"$exists": True}})
+])
 class Media(Base):
     """
     A class to represent medias collection
@@ -21,3 +30,20 @@ def create_media(path, upload_id):
     media.save()
     media.reload()
     return media
+
+
+def get_media_by_hash(content_hash, media_type):
+    return Media.find_one({"hash": content_hash, "media_type": media_type})
+
+
+def save_media(path, upload_id, content_hash, media_type):
+    """
+    Saves the Telegram file id of an uploaded file, identified by the hash of its content and its media type.
+    """
+    media_filter = {"hash": content_hash, "media_type": media_type}
+    update = {"$set": {"path": path, "upload_id": upload_id}}
+    try:
+        Media.update_one(media_filter, update, upsert=True)
+    except DuplicateKeyError:
+        # a concurrent upsert inserted the media first
+        Media.update_one(media_filter, update)
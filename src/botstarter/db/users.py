@@ -1,18 +1,54 @@
+from pymongo import ReturnDocument, IndexModel
+from pymongo.errors import DuplicateKeyError
+
+from botstarter.cache import LRUCache
 from botstarter.db.base import Base, register_model, get_interceptors, InterceptorHooks
 
+"""
+Default size and time-to-live, in seconds, of the in-process users cache
+"""
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300
+
 
-@register_model("users")
+@register_model("users", indexes=[
+    IndexModel("id", unique=True),
+    # only admins are indexed, to look them up without scanning all users
+    IndexModel("is_admin", partialFilterExpression={"is_admin": True})
+])
 class User(Base):
     """
     A class to represent users collection
     """
+    __cache__ = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def configure_cache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+    """
+    Replaces the in-process users cache with a new one.
+
+    :param maxsize: the maximum number of cached users. A size of 0 disables the cache
+    :param ttl: the number of seconds after which a cached user is read again from the database
+    """
+    User.__cache__ = LRUCache(maxsize=maxsize, ttl=ttl)
+
+
+def get_cache_stats():
+    """
+    :return: a dict with the hit, miss and eviction counters of the users cache
+    """
+    return User.__cache__.stats()
 
 
 def get_user_by_id(user_id):
-    return User.find_one({"id": user_id})
+    return User.find_cached(user_id)
 
 
-def create_user(msg):
+def new_user(msg) -> User:
+    """
+    Builds a new user object from the sender of a message, applying the SAVE_USER_CREATE interceptor.
+    The user is not saved to the database.
+    """
     user = User({
         "id": msg.from_user.id,
         "is_admin": False,
@@ -25,15 +61,62 @@ def create_user(msg):
     if create_interceptor:
         create_interceptor(user, msg)
 
+    return user
+
+
+def create_user(msg):
+    user = new_user(msg)
     user.save()
     user.reload()
     return user
 
 
+def get_or_create_user(msg) -> User:
+    """
+    Returns the user that sent the message, creating it if it doesn't exist yet.
+    New users are created with an atomic upsert: fields of the new user, including the ones set by the SAVE_USER_CREATE
+    interceptor, are only written if the user is inserted. The interceptor only runs when the user is not found.
+
+    :param msg: the telebot.types.Message object
+    :return: the User object
+    """
+    user = User.find_cached(msg.from_user.id)
+    if user is not None:
+        return user
+
+    fields = new_user(msg)
+    fields.pop("id")
+    try:
+        user = User.find_one_and_update(
+            {"id": msg.from_user.id},
+            {"$setOnInsert": fields},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # a concurrent upsert inserted the user first
+        user = User.find_one({"id": msg.from_user.id})
+    user._put_cache()
+    return user
+
+
 def set_user_waiting_on(user_id, waiting_on=None):
     User.update_one({"id": user_id}, {"$set": {"waiting_on": waiting_on}})
 
 
+def set_admin(user_id, is_admin=True):
+    """
+    Grants or revokes the admin role of a user, and reloads the admin registry of this process.
+
+    :param user_id: the user id
+    :param is_admin: optional: True to grant the admin role, False to revoke it. Default is True
+    """
+    from botstarter import admins
+    # the admin registry reads the database, the update can't be buffered
+    User.update_one({"id": user_id}, {"$set": {"is_admin": is_admin}}, sync=True)
+    admins.invalidate()
+
+
 def is_admin(user_id):
     user = User.find_one({"id": user_id, "is_admin": True})
     return bool(user)
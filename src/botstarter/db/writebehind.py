@@ -0,0 +1,315 @@
+"""
+Write-behind buffering of model updates.
+
+Models with a write-behind buffer don't send simple `update_one` calls to the database on the handler thread. The
+buffer merges the `$set` and `$inc` updates of the same document into a single update, and a background thread sends
+all pending updates with one `bulk_write` per collection, every `flush_interval` seconds or as soon as
+`max_pending` documents have pending updates:
+
+    enable_write_behind(User, flush_interval=1)
+
+    User.update_one({"id": user_id}, {"$inc": {"messages": 1}, "$set": {"last_seen": now}})  # buffered
+    User.update_one({"id": user_id}, {"$set": {"plan": "pro"}}, sync=True)  # written immediately
+
+Only updates with an equality filter on top-level fields, `$set` and `$inc` operators and no other options are
+buffered: other updates are written immediately, after the pending updates of the same document. Buffered updates
+are applied to the model cache immediately, and the model methods reading or writing documents write the pending
+updates of the documents first. Queries sent with the pymongo collection directly see buffered updates only once
+they are flushed.
+
+Updates are kept for the next flush while the database is unreachable. Updates rejected by the database, e.g. by a
+schema validation, are retried in the next flushes and dropped after `max_write_failures` failures. Pending updates
+are flushed when the buffer is closed, at interpreter exit or by `close_all()`.
+"""
+import atexit
+import logging
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from botstarter.metrics import DB_OPERATION_DURATION
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_MAX_WRITE_FAILURES = 3
+
+_buffers = weakref.WeakSet()
+
+
+def _buffer_key(filter) -> Optional[Tuple]:
+    # only equality filters on top-level fields identify a single document to merge updates on
+    if not isinstance(filter, dict) or not filter:
+        return None
+    for field, value in filter.items():
+        if field.startswith("$") or "." in field or isinstance(value, (dict, list)):
+            return None
+    try:
+        key = tuple(sorted(filter.items()))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _is_bufferable(update) -> bool:
+    if not isinstance(update, dict) or not update or not update.keys() <= {"$set", "$inc"}:
+        return False
+    fields = [*update.get("$set", {}), *update.get("$inc", {})]
+    return all(not f.startswith("$") and "." not in f for f in fields) and \
+        all(_is_number(n) for n in update.get("$inc", {}).values())
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _PendingUpdate:
+    __slots__ = ("filter", "set", "inc", "failures")
+
+    def __init__(self, filter):
+        self.filter = filter
+        self.set = {}
+        self.inc = {}
+        self.failures = 0
+
+    def merge(self, update: dict):
+        for field, value in update.get("$set", {}).items():
+            self.inc.pop(field, None)
+            self.set[field] = value
+        for field, amount in update.get("$inc", {}).items():
+            if field in self.set:
+                value = self.set.pop(field)
+                if _is_number(value):
+                    self.set[field] = value + amount
+                    continue
+                # the increment replaces a value that can't be incremented, like two separate updates would fail
+            self.inc[field] = self.inc.get(field, 0) + amount
+
+    def merge_under(self, older: "_PendingUpdate"):
+        # merges updates that happened before the ones of this object, e.g. the ones of a failed flush
+        for field, value in older.set.items():
+            if field in self.set:
+                continue
+            if field in self.inc and _is_number(value):
+                self.set[field] = value + self.inc.pop(field)
+            elif field not in self.inc:
+                self.set[field] = value
+        for field, amount in older.inc.items():
+            if field not in self.set:
+                self.inc[field] = self.inc.get(field, 0) + amount
+        self.failures = max(self.failures, older.failures)
+
+    def to_update(self) -> dict:
+        update = {}
+        if self.set:
+            update["$set"] = self.set
+        if self.inc:
+            update["$inc"] = self.inc
+        return update
+
+
+class WriteBehindBuffer:
+    """
+    A buffer of coalesced model updates, flushed by a background thread.
+    """
+
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_pending: int = DEFAULT_MAX_PENDING,
+                 max_write_failures: int = DEFAULT_MAX_WRITE_FAILURES):
+        """
+        :param flush_interval: optional: the maximum number of seconds an update stays in the buffer. Default is 1
+        :param max_pending: optional: the number of documents with pending updates that triggers a flush before the
+                            interval expires. Default is 1000
+        :param max_write_failures: optional: the number of flushes an update rejected by the database is tried in,
+                                   before it's dropped. Updates are not dropped while the database is unreachable.
+                                   Default is 3
+        """
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_write_failures = max_write_failures
+        self._pending: Dict[type, Dict[Tuple, _PendingUpdate]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        # only one flush writes to the database at a time, so that updates of a document are written in order
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="botstarter-write-behind", daemon=True)
+        self._thread.start()
+        _buffers.add(self)
+
+    def update(self, model_cls, filter, update) -> bool:
+        """
+        Buffers an update.
+
+        :param model_cls: the model class
+        :param filter: the update filter
+        :param update: the update document
+        :return: True if the update was buffered, False if it must be written immediately
+        """
+        key = _buffer_key(filter)
+        if self._closed or key is None or not _is_bufferable(update):
+            return False
+
+        with self._lock:
+            updates = self._pending.setdefault(model_cls, {})
+            pending = updates.get(key)
+            if pending is None:
+                pending = updates[key] = _PendingUpdate(dict(filter))
+                self._size += 1
+            pending.merge(update)
+            size = self._size
+        if size >= self.max_pending:
+            self._wakeup.set()
+        return True
+
+    def has_pending(self, model_cls, filter=None) -> bool:
+        with self._lock:
+            updates = self._pending.get(model_cls)
+            if not updates:
+                return False
+            return filter is None or _buffer_key(filter) in updates
+
+    def flush(self, model_cls=None, filter=None):
+        """
+        Writes pending updates to the database, on the calling thread.
+
+        :param model_cls: optional: only write the updates of this model class
+        :param filter: optional: only write the updates of the document with this filter
+        """
+        with self._flush_lock:
+            with self._lock:
+                if model_cls is None:
+                    batches, self._pending = self._pending, {}
+                elif filter is None:
+                    batches = {model_cls: self._pending.pop(model_cls, {})}
+                else:
+                    pending = self._pending.get(model_cls, {}).pop(_buffer_key(filter), None)
+                    batches = {model_cls: {_buffer_key(filter): pending}} if pending is not None else {}
+                self._size -= sum(len(updates) for updates in batches.values())
+
+            for cls, updates in batches.items():
+                if updates:
+                    self._write(cls, updates)
+
+    def flush_document(self, model_cls, doc) -> bool:
+        """
+        Writes the pending updates of a document, on the calling thread. The updates are found by the values of the
+        document fields in their filters, e.g. to write the updates of a document read by `_id`.
+
+        :param model_cls: the model class
+        :param doc: the document, e.g. a model object
+        :return: True if the document had pending updates
+        """
+        with self._flush_lock:
+            with self._lock:
+                updates = self._pending.get(model_cls)
+                if not updates:
+                    return False
+                keys = [key for key in updates if all(field in doc and doc[field] == value for field, value in key)]
+                batch = {key: updates.pop(key) for key in keys}
+                self._size -= len(batch)
+            if batch:
+                self._write(model_cls, batch)
+        return bool(batch)
+
+    def _write(self, model_cls, updates: Dict[Tuple, _PendingUpdate]):
+        requests = [UpdateOne(pending.filter, pending.to_update()) for pending in updates.values()]
+        try:
+            with DB_OPERATION_DURATION.time(model_cls.__name__, "bulk_write"):
+                model_cls.__collection__.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            pending = list(updates.items())
+            failed = {}
+            for error in errors:
+                key, update = pending[error["index"]]
+                update.failures += 1
+                if update.failures < self.max_write_failures and not self._closed:
+                    failed[key] = update
+            logging.error("Could not write %d buffered updates of %s, %d will be retried: %s",
+                          len(errors), model_cls.__name__, len(failed), errors)
+            self._requeue(model_cls, failed)
+        except PyMongoError as e:
+            # the database is unreachable: keep the updates for the next flush
+            logging.warning("Could not flush %d buffered updates of %s, retrying later: %s",
+                            len(requests), model_cls.__name__, e)
+            self._requeue(model_cls, updates)
+            if self._closed:
+                raise
+
+    def _requeue(self, model_cls, updates: Dict[Tuple, _PendingUpdate]):
+        with self._lock:
+            current = self._pending.setdefault(model_cls, {})
+            for key, pending in updates.items():
+                newer = current.get(key)
+                if newer is None:
+                    current[key] = pending
+                    self._size += 1
+                else:
+                    newer.merge_under(pending)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Write-behind flush failed")
+
+    def pending(self) -> int:
+        """
+        :return: the number of documents with pending updates
+        """
+        return self._size
+
+    def close(self):
+        """
+        Stops the background thread and writes all pending updates. Updates sent to a closed buffer are written
+        immediately.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+
+def enable_write_behind(*model_classes, **kwargs) -> WriteBehindBuffer:
+    """
+    Buffers the updates of model classes in a new write-behind buffer.
+
+    :param model_classes: the model classes
+    :param kwargs: keyword arguments for the WriteBehindBuffer object creation
+    :return: the WriteBehindBuffer object
+    """
+    buffer = WriteBehindBuffer(**kwargs)
+    for cls in model_classes:
+        cls.__write_behind__ = buffer
+    return buffer
+
+
+def flush_all():
+    """
+    Writes the pending updates of all write-behind buffers.
+    """
+    for buffer in list(_buffers):
+        buffer.flush()
+
+
+def close_all():
+    """
+    Closes all write-behind buffers, writing their pending updates.
+    """
+    for buffer in list(_buffers):
+        try:
+            buffer.close()
+        except Exception:
+            logging.exception("Could not flush write-behind buffer")
+
+
+atexit.register(close_all)
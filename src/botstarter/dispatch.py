@@ -0,0 +1,204 @@
+"""
+Concurrent dispatch of Telegram updates.
+
+Updates are sharded by chat id over a fixed pool of worker threads: updates for the same chat always land on the
+same worker and are processed in the order they were received, while updates for different chats can be processed
+in parallel.
+"""
+import logging
+import queue
+import threading
+from time import monotonic
+from typing import Callable, List, Optional
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE_SIZE = 100
+
+_STOP = object()
+
+
+"""
+Update types, by the way the chat id can be found in them
+"""
+_MESSAGE_UPDATES = ("message", "edited_message", "channel_post", "edited_channel_post")
+_MEMBER_UPDATES = ("my_chat_member", "chat_member", "chat_join_request")
+_QUERY_UPDATES = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+
+def chat_id_of(update) -> Optional[int]:
+    """
+    Extracts the id of the chat an update belongs to.
+
+    :param update: a telebot.types.Update object
+    :return: the chat id, or the id of the user that originated the update if there is no chat. None if neither
+             can be found.
+    """
+    for name in _MESSAGE_UPDATES:
+        message = getattr(update, name, None)
+        if message is not None:
+            return message.chat.id
+
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+
+    for name in _MEMBER_UPDATES:
+        member_update = getattr(update, name, None)
+        if member_update is not None:
+            return member_update.chat.id
+
+    for name in _QUERY_UPDATES:
+        query = getattr(update, name, None)
+        if query is not None:
+            user = getattr(query, "from_user", None) or getattr(query, "user", None)
+            if user is not None:
+                return user.id
+
+    return None
+
+
+def raw_chat_id_of(update: dict) -> Optional[int]:
+    """
+    Extracts the id of the chat an update belongs to, like `chat_id_of`, from the JSON update received from Telegram.
+
+    :param update: the update dict
+    :return: the chat id, or the id of the user that originated the update. None if neither can be found.
+    """
+    for name in _MESSAGE_UPDATES + _MEMBER_UPDATES:
+        obj = update.get(name)
+        if obj is not None:
+            return obj["chat"]["id"]
+
+    callback_query = update.get("callback_query")
+    if callback_query is not None:
+        if callback_query.get("message") is not None:
+            return callback_query["message"]["chat"]["id"]
+        return callback_query["from"]["id"]
+
+    for name in _QUERY_UPDATES:
+        query = update.get(name)
+        if query is not None:
+            user = query.get("from") or query.get("user")
+            if user is not None:
+                return user["id"]
+
+    return None
+
+
+class UpdateDispatcher:
+    """
+    A bounded worker pool that processes updates in order within each chat and in parallel across chats.
+
+    Every worker owns a bounded queue. When the queue of a worker is full, `submit()` blocks the caller until there
+    is room for the new update, which slows down the producer (e.g. the polling loop) instead of buffering updates
+    without limits.
+    """
+
+    def __init__(self, process: Callable[[List], None], workers: int = DEFAULT_WORKERS,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE, submit_timeout: Optional[float] = None):
+        """
+        :param process: the function that processes a list of updates, usually telebot's `process_new_updates`
+        :param workers: the number of worker threads. Default is 4
+        :param max_queue_size: the maximum number of pending updates per worker. Default is 100
+        :param submit_timeout: optional: maximum number of seconds `submit()` waits for room in a full queue
+                               before raising `queue.Full`. By default, it waits indefinitely
+        """
+        if workers < 1:
+            raise ValueError("The number of dispatch workers must be at least 1.")
+        if max_queue_size < 1:
+            raise ValueError("The dispatch queue size must be at least 1.")
+
+        self.process = process
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.submit_timeout = submit_timeout
+
+        self._queues = [queue.Queue(maxsize=max_queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"botstarter-dispatch-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        logging.debug("Started update dispatcher with %d workers", self.workers)
+
+    def submit(self, update, timeout: Optional[float] = None):
+        """
+        Queues an update for processing. Blocks while the target worker queue is full.
+
+        :param update: the telebot.types.Update object to process
+        :param timeout: optional: overrides the dispatcher's `submit_timeout`
+        :raises queue.Full: if the update could not be queued before the timeout expired
+        """
+        if timeout is None:
+            timeout = self.submit_timeout
+        self._queues[self._shard(update)].put(update, timeout=timeout)
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        :return: the total number of updates waiting to be processed
+        """
+        return sum(q.qsize() for q in self._queues)
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stops the worker threads once all queued updates have been processed.
+
+        :param wait: wait for the worker threads to terminate. Default is True
+        :param timeout: optional: the maximum number of seconds to wait for each worker thread
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for q in self._queues[:len(threads)]:
+            q.put(_STOP)
+        if wait:
+            for t in threads:
+                t.join(timeout)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stops the worker threads once all queued updates have been processed, waiting at most `timeout` seconds in
+        total.
+
+        :param timeout: optional: the maximum number of seconds to wait. By default, it waits indefinitely
+        :return: True if all queued updates were processed before the timeout expired
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for q in self._queues[:len(threads)]:
+            try:
+                q.put(_STOP, timeout=max(deadline - monotonic(), 0) if deadline is not None else None)
+            except queue.Full:
+                return False
+        for t in threads:
+            t.join(max(deadline - monotonic(), 0) if deadline is not None else None)
+            if t.is_alive():
+                return False
+        return True
+
+    def _shard(self, update) -> int:
+        key = chat_id_of(update)
+        if key is None:
+            key = update.update_id
+        return hash(key) % self.workers
+
+    def _run(self, q: queue.Queue):
+        while True:
+            update = q.get()
+            try:
+                if update is _STOP:
+                    return
+                self.process([update])
+            except Exception:
+                logging.exception("Error processing update %s", getattr(update, "update_id", None))
+            finally:
+                q.task_done()
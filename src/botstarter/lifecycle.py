@@ -0,0 +1,304 @@
+"""
+Graceful shutdown of the bot.
+
+When the bot process receives SIGTERM, e.g. from the container orchestrator during a rolling deploy, or SIGINT, the
+lifecycle manager:
+  - stops receiving updates: polling stops after the current getUpdates request, and the webhook server stops
+    accepting requests
+  - waits for the updates already received to be processed, until the drain timeout expires. The drain timeout
+    counts from the signal, so it also bounds the wait for the last getUpdates request to return
+  - writes the pending updates of the write-behind buffers
+  - saves the update offset checkpoint, in polling mode
+  - closes the connection pools of the Telegram API and of the MongoDB client
+
+Telegram sends the updates again until they are confirmed by a getUpdates request with a higher offset. Updates of
+different chats are processed out of order, so the checkpoint keeps the highest offset below which all updates were
+processed, together with the ids of the updates above it that were processed too. The next process polls from the
+checkpoint offset and skips the updates that were already processed: updates of the last getUpdates response that
+were not processed are handled by the next process, and processed updates are not handled twice. Updates confirmed by
+previous requests that are still queued when the drain timeout expires are lost, and their number is logged.
+
+In webhook mode, updates are confirmed to Telegram as soon as they are queued, so there is no offset to checkpoint:
+the updates still queued when the drain timeout expires are lost, and their number is logged. Cluster workers
+started with `cluster.run_worker` stop taking updates from their partition on SIGTERM and SIGINT, and drain the
+updates they took: the others stay in the queue for the next worker.
+
+The lifecycle manager is configured with the `lifecycle_opts` parameter of `bot.init_bot`:
+
+    bot.init_bot(lifecycle_opts={"drain_timeout": 15})
+
+A second signal received while the bot is shutting down terminates the process immediately. The database connection
+is closed on shutdown, so a bot started again in the same process must be initialized again with `bot.init_bot`.
+"""
+import logging
+import signal
+import threading
+from time import monotonic
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo.errors import PyMongoError
+
+from botstarter import admins
+from botstarter.db import base, writebehind
+
+"""
+Default maximum number of seconds between the stop signal and the end of the drain. It should leave time to write the
+pending updates and close the connections before the orchestrator kills the process, e.g. after 30 seconds on
+Kubernetes
+"""
+DEFAULT_DRAIN_TIMEOUT = 20
+
+DEFAULT_CHECKPOINT_COLLECTION = "bot_checkpoints"
+
+DEFAULT_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class OffsetTracker:
+    """
+    Tracks the ids of the updates received and processed, to find the offset below which all updates were processed.
+    """
+
+    def __init__(self, offset: int = 0, processed: Iterable[int] = ()):
+        """
+        :param offset: optional: the id of the last update of a sequence of processed updates. Default is 0
+        :param processed: optional: the ids of the updates above the offset that were processed too
+        """
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self.reset(offset, processed)
+
+    def reset(self, offset: int = 0, processed: Iterable[int] = ()):
+        with self._lock:
+            self._offset = offset
+            self._last_received = offset
+            self._processed = {i for i in processed if i > offset}
+            self._prune_size = 2 * len(self._processed) + 100
+
+    def received(self, update_id: int) -> bool:
+        """
+        Marks an update as received.
+
+        :param update_id: the update id
+        :return: False if the update was already processed, True otherwise
+        """
+        with self._lock:
+            if update_id <= self._offset or update_id in self._processed:
+                return False
+            self._in_flight.add(update_id)
+            if update_id > self._last_received:
+                self._last_received = update_id
+            return True
+
+    def processed(self, update_id: int):
+        """
+        Marks an update as processed.
+
+        :param update_id: the update id
+        """
+        with self._lock:
+            self._in_flight.discard(update_id)
+            self._processed.add(update_id)
+            # the processed ids are pruned once their number doubled, so that pruning takes constant amortized time
+            if not self._in_flight or len(self._processed) >= self._prune_size:
+                self._advance()
+
+    def _advance(self):
+        offset = min(self._in_flight) - 1 if self._in_flight else self._last_received
+        # the processed ids above the last received update, e.g. restored from a checkpoint, only move the offset when
+        # they are contiguous: the updates between them were not received yet
+        while offset + 1 in self._processed:
+            offset += 1
+        if offset > self._offset:
+            self._offset = offset
+            self._processed = {i for i in self._processed if i > offset}
+        self._prune_size = 2 * len(self._processed) + 100
+
+    def checkpoint(self) -> Tuple[int, List[int]]:
+        """
+        :return: a tuple with the offset below which all updates were processed, and the sorted ids of the updates
+                 above the offset that were processed too
+        """
+        with self._lock:
+            self._advance()
+            return self._offset, sorted(self._processed)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        :return: the number of updates received and not processed yet
+        """
+        return len(self._in_flight)
+
+
+class OffsetCheckpoint:
+    """
+    Saves the update offset checkpoints in a MongoDB collection, with one document for each bot.
+    """
+
+    def __init__(self, collection_name: str = DEFAULT_CHECKPOINT_COLLECTION):
+        """
+        :param collection_name: optional: the name of the checkpoints collection. Default is "bot_checkpoints"
+        """
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        return base.get_db()[self.collection_name]
+
+    def load(self, bot_id: str) -> Optional[Tuple[int, List[int]]]:
+        """
+        :param bot_id: the bot id
+        :return: a tuple with the offset and the ids of the processed updates above it, or None if the bot has no
+                 checkpoint
+        """
+        doc = self.collection.find_one({"_id": bot_id})
+        if doc is None:
+            return None
+        return doc["offset"], list(doc.get("processed") or [])
+
+    def save(self, bot_id: str, offset: int, processed: Sequence[int] = ()):
+        self.collection.replace_one({"_id": bot_id}, {"offset": offset, "processed": list(processed)}, upsert=True)
+
+
+def bot_id_of(bot) -> str:
+    # the numeric prefix of the token identifies the bot, without storing the token secret
+    return str(bot.token).split(":", 1)[0]
+
+
+class Lifecycle:
+    """
+    Stops the bot gracefully on termination signals.
+    """
+
+    def __init__(self, drain_timeout: Optional[float] = DEFAULT_DRAIN_TIMEOUT, checkpoint: bool = True,
+                 checkpoint_collection: str = DEFAULT_CHECKPOINT_COLLECTION,
+                 signals: Sequence[signal.Signals] = DEFAULT_SIGNALS):
+        """
+        :param drain_timeout: optional: the maximum number of seconds to wait for the received updates to be
+                              processed on shutdown, counted from the stop signal. None means no limit. Default is
+                              20
+        :param checkpoint: optional: save the update offset on shutdown and restore it on start, in polling mode.
+                           Default is True
+        :param checkpoint_collection: optional: the name of the checkpoints collection. Default is "bot_checkpoints"
+        :param signals: optional: the signals that stop the bot. Default is SIGTERM and SIGINT
+        """
+        self.drain_timeout = drain_timeout
+        self.signals = tuple(signals)
+        self.tracker = OffsetTracker()
+        self._checkpoint = OffsetCheckpoint(checkpoint_collection) if checkpoint else None
+        self._bot_id = None
+        self._stopping = threading.Event()
+        self._stopped_at = None
+        self._stop_callbacks = []
+        self._previous_handlers = {}
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def restore_offset(self, bot):
+        """
+        Makes the bot poll updates from its checkpoint offset, skipping the updates that were already processed.
+
+        :param bot: the telebot.TeleBot object
+        """
+        if self._checkpoint is None:
+            return
+        self._bot_id = bot_id_of(bot)
+        try:
+            saved = self._checkpoint.load(self._bot_id)
+        except PyMongoError as e:
+            logging.warning("Could not load the update offset checkpoint: %s", e)
+            return
+        if saved is not None:
+            offset, processed = saved
+            self.tracker.reset(offset, processed)
+            bot.last_update_id = max(bot.last_update_id, offset)
+            logging.info("Polling updates from checkpoint offset %d", offset)
+
+    def install(self, stop: Callable[[], None]):
+        """
+        Registers a function that stops receiving updates, and handles the termination signals. Signals can only be
+        handled when this method is called by the main thread.
+
+        :param stop: the function, called by the thread receiving the signal
+        """
+        self._stop_callbacks.append(stop)
+        if threading.current_thread() is not threading.main_thread():
+            logging.warning("The bot was not started by the main thread: termination signals are not handled")
+            return
+        for sig in self.signals:
+            if sig not in self._previous_handlers:
+                self._previous_handlers[sig] = signal.signal(sig, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        logging.info("Received signal %s. Stopping the bot", signal.Signals(signum).name)
+        # a second signal is handled by the previous handlers, e.g. terminating the process
+        self._restore_handlers()
+        self.stop()
+
+    def _restore_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for sig, handler in self._previous_handlers.items():
+            signal.signal(sig, handler if handler is not None else signal.SIG_DFL)
+        self._previous_handlers.clear()
+
+    def stop(self):
+        """
+        Stops receiving updates. Can be called by any thread.
+        """
+        if self._stopping.is_set():
+            return
+        self._stopped_at = monotonic()
+        self._stopping.set()
+        for callback in self._stop_callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Could not stop receiving updates")
+
+    def shutdown(self, dispatcher=None, transport=None) -> bool:
+        """
+        Stops receiving updates, waits for the received updates to be processed, writes the pending database updates
+        and the update offset checkpoint, and closes the connection pools.
+
+        :param dispatcher: optional: the botstarter.dispatch.UpdateDispatcher processing the updates
+        :param transport: optional: the botstarter.transport.HttpTransport sending the Telegram API requests
+        :return: True if all received updates were processed before the drain timeout expired
+        """
+        self.stop()
+
+        drained = True
+        if dispatcher is not None:
+            timeout = self.drain_timeout
+            if timeout is not None:
+                # the time spent waiting for the polling to stop counts towards the drain timeout
+                timeout = max(timeout - (monotonic() - self._stopped_at), 0)
+            drained = dispatcher.drain(timeout)
+            if not drained:
+                logging.error("%d updates were not processed before the drain timeout of %s seconds",
+                              max(dispatcher.queue_depth, self.tracker.in_flight), self.drain_timeout)
+
+        writebehind.close_all()
+        self._save_checkpoint()
+        admins.get_registry().stop()
+        if transport is not None:
+            transport.close()
+        base.close_db()
+        self._restore_handlers()
+        self._stop_callbacks.clear()
+        # the lifecycle can be installed again when the bot is started again
+        self._stopping.clear()
+        logging.info("Bot stopped")
+        return drained
+
+    def _save_checkpoint(self):
+        if self._checkpoint is None or self._bot_id is None:
+            return
+        offset, processed = self.tracker.checkpoint()
+        try:
+            self._checkpoint.save(self._bot_id, offset, processed)
+            logging.info("Saved update offset checkpoint %d", offset)
+        except (PyMongoError, RuntimeError) as e:
+            logging.error("Could not save the update offset checkpoint %d: %s", offset, e)
@@ -0,0 +1,268 @@
+"""
+Upload-once cache of media files sent to Telegram.
+
+Once a file is uploaded, Telegram returns a file id that can be used to send the same file again without uploading
+it. The MediaCache keeps track of these file ids by the hash of the file content, so that:
+  - the same file stored at different paths is uploaded only once
+  - a file edited in place is uploaded again, instead of sending the stale version
+  - concurrent first sends of the same file wait for a single upload
+
+File hashes are cached by path, modification time and size, and file ids are cached in memory in front of the
+`medias` collection. Both caches are size-bounded LRU caches.
+"""
+import glob
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Tuple, Union, IO
+
+from botstarter.cache import LRUCache
+from botstarter.db import medias
+from botstarter.ratelimit import send_priority, PRIORITY_BULK
+
+"""
+Media types supported by the cache. Each type is sent with the bot API method `send_<media_type>`.
+"""
+MEDIA_TYPES = ("photo", "document", "video", "audio", "animation")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def extract_file_id(message, media_type: str) -> str:
+    """
+    Returns the file id of the media sent with a message.
+
+    :param message: the telebot.types.Message returned by the API
+    :param media_type: the media type
+    :return: the Telegram file id
+    """
+    if media_type == "photo":
+        # photos are returned in several sizes, the last one is the original
+        return message.photo[-1].file_id
+    return getattr(message, media_type).file_id
+
+
+class _Upload:
+    def __init__(self):
+        self.done = threading.Event()
+        self.file_id = None
+
+
+class MediaCache:
+    """
+    A cache of Telegram file ids, keyed by file content hash and media type.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        :param maxsize: the maximum number of file hashes and file ids kept in memory. Default is 4096
+        """
+        self._hashes = LRUCache(maxsize=maxsize)
+        self._file_ids = LRUCache(maxsize=maxsize)
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def content_hash(self, path: str) -> str:
+        """
+        Returns the sha256 hash of a file. The file is read again only if its modification time or size changed.
+
+        :param path: the file path
+        :return: the hex digest of the file content
+        """
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        self._hashes.put(path, (signature, content_hash))
+        return content_hash
+
+    def get_file_id(self, path: str, media_type: str) -> Tuple[str, Optional[str]]:
+        """
+        Looks up the Telegram file id of a file, first in memory then in the database.
+
+        :param path: the file path
+        :param media_type: the media type
+        :return: a tuple with the file content hash and the file id, or None if the file was never uploaded
+        """
+        content_hash = self.content_hash(path)
+        key = (content_hash, media_type)
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            media = medias.get_media_by_hash(content_hash, media_type)
+            if media:
+                file_id = media.upload_id
+                self._file_ids.put(key, file_id)
+        return content_hash, file_id
+
+    def put(self, path: str, content_hash: str, media_type: str, file_id: str):
+        self._file_ids.put((content_hash, media_type), file_id)
+        medias.save_media(path, file_id, content_hash, media_type)
+
+    def send(self, path: str, media_type: str, send: Callable[[Union[str, IO]], Any]):
+        """
+        Sends a media file, uploading it only if it isn't cached yet.
+
+        :param path: the file path
+        :param media_type: the media type, one of MEDIA_TYPES
+        :param send: the function sending the media. It receives either the file id or the open file to upload
+        :return: the result of the send function
+        """
+        if media_type not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported media type [{media_type}]. Supported types are {MEDIA_TYPES}.")
+
+        while True:
+            content_hash, file_id = self.get_file_id(path, media_type)
+            if file_id:
+                return send(file_id)
+
+            key = (content_hash, media_type)
+            with self._lock:
+                upload = self._uploads.get(key)
+                leader = upload is None
+                if leader:
+                    upload = self._uploads[key] = _Upload()
+
+            if leader:
+                break
+
+            # another thread is uploading the same file
+            upload.done.wait()
+            if upload.file_id:
+                return send(upload.file_id)
+            # the upload failed, try again
+
+        try:
+            logging.debug("Uploading %s with path %s", media_type, path)
+            with open(path, "rb") as f:
+                result = send(f)
+            upload.file_id = extract_file_id(result, media_type)
+            self.put(path, content_hash, media_type, upload.file_id)
+            return result
+        finally:
+            with self._lock:
+                del self._uploads[key]
+            upload.done.set()
+
+    def stats(self) -> dict:
+        """
+        :return: a dict with the stats of the file hash and file id caches
+        """
+        return {
+            "hashes": self._hashes.stats(),
+            "file_ids": self._file_ids.stats()
+        }
+
+
+class WarmupReport(NamedTuple):
+    uploaded: int
+    skipped: int
+    failed: int
+    uploaded_bytes: int
+    seconds: float
+
+    @property
+    def files_per_second(self) -> float:
+        return self.uploaded / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.uploaded_bytes / self.seconds if self.seconds else 0.0
+
+
+def guess_media_type(path: str) -> str:
+    """
+    Guesses the media type of a file from its extension. Files that are not images, videos or audio are sent as
+    documents.
+    """
+    mime_type, _ = mimetypes.guess_type(path)
+    if mime_type == "image/gif":
+        return "animation"
+    if mime_type in ("image/jpeg", "image/png", "image/webp"):
+        return "photo"
+    if mime_type and mime_type.startswith("video/"):
+        return "video"
+    if mime_type and mime_type.startswith("audio/"):
+        return "audio"
+    return "document"
+
+
+def expand_paths(paths_or_globs: Union[str, Iterable[str]]) -> List[str]:
+    """
+    Expands file paths, directories and glob patterns to the list of files they match.
+    """
+    if isinstance(paths_or_globs, str):
+        paths_or_globs = [paths_or_globs]
+
+    files = []
+    for pattern in paths_or_globs:
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.extend(os.path.join(root, name) for name in sorted(names))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                logging.warning("No file found matching %s", path)
+    return list(dict.fromkeys(files))
+
+
+def warm_media(paths_or_globs: Union[str, Iterable[str]], chat_id: Union[int, List[int]],
+               media_type: Optional[str] = None, concurrency: int = 4, delete_messages: bool = True) -> WarmupReport:
+    """
+    Uploads media files to a staging chat ahead of time and records their Telegram file ids, so that users never
+    wait for an upload. Files that were already uploaded are skipped.
+
+    Uploads are paced by the bot's send scheduler like any other message, so the upload rate to a single staging chat
+    is bound by the per-chat rate limit. Pass several staging chats to spread the uploads across them.
+
+    :param paths_or_globs: file paths, directories or glob patterns, e.g. "assets/**/*.png"
+    :param chat_id: the id of the staging chat files are uploaded to, or a list of staging chat ids
+    :param media_type: optional: the media type of all files. By default, it is guessed from the file extension
+    :param concurrency: optional: the number of parallel uploads. Default is 4
+    :param delete_messages: optional: delete the uploaded messages from the staging chat. Default is True
+    :return: a WarmupReport with the number of uploaded, skipped and failed files and the upload throughput
+    """
+    from botstarter import bot
+
+    cache = bot.get_media_cache()
+    chat_ids = list(chat_id) if isinstance(chat_id, (list, tuple)) else [chat_id]
+    started = monotonic()
+
+    def upload(i, path):
+        p_media_type = media_type or guess_media_type(path)
+        try:
+            _, file_id = cache.get_file_id(path, p_media_type)
+            if file_id:
+                return "skipped", 0
+            with send_priority(PRIORITY_BULK):
+                message = bot.send_or_upload_media(chat_ids[i % len(chat_ids)], path, media_type=p_media_type)
+                if delete_messages and message is not None:
+                    bot.delete_message(message=message)
+            return "uploaded", os.path.getsize(path)
+        except Exception:
+            logging.exception("Could not upload %s", path)
+            return "failed", 0
+
+    files = expand_paths(paths_or_globs)
+    counts = {"uploaded": 0, "skipped": 0, "failed": 0}
+    uploaded_bytes = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="botstarter-warm-media") as executor:
+        for result, size in executor.map(upload, range(len(files)), files):
+            counts[result] += 1
+            uploaded_bytes += size
+
+    report = WarmupReport(uploaded_bytes=uploaded_bytes, seconds=monotonic() - started, **counts)
+    logging.info("Warmed up media: %d uploaded, %d skipped, %d failed in %.1f seconds",
+                 report.uploaded, report.skipped, report.failed, report.seconds)
+    return report
@@ -0,0 +1,343 @@
+"""
+Built-in instrumentation of the bot hot paths.
+
+Three views are collected out of the box:
+  - the latency of message, callback and admin handlers, by handler name
+  - the duration of Telegram API calls by method, the time they waited for the rate limits, and the number of
+    timeouts and retries
+  - the duration of MongoDB operations made through model classes, by model and operation
+
+Metrics are kept in memory and can be exported in the Prometheus text format with `render_prometheus()` or the
+embedded `/metrics` HTTP endpoint started with `start_http_server()`. To forward observations to another monitoring
+system, register a sink function with `add_sink()`.
+
+Recording an observation costs a dictionary lookup and a lock, so instrumentation can be left on in production.
+It can be turned off with `set_enabled(False)`.
+"""
+import bisect
+import functools
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+"""
+Default histogram buckets in seconds, from 1ms to 30s
+"""
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = True
+_sinks: List[Callable[[str, Dict[str, str], float], None]] = []
+
+
+def set_enabled(enabled: bool):
+    """
+    Turns the recording of metrics on or off.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def add_sink(sink: Callable[[str, Dict[str, str], float], None]):
+    """
+    Registers a function called with the metric name, the labels and the value of every observation, e.g. to forward
+    metrics to StatsD. Sinks are called synchronously on the instrumented thread, so they should not block.
+
+    :param sink: the sink function
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Callable[[str, Dict[str, str], float], None]):
+    _sinks.remove(sink)
+
+
+def _notify_sinks(name, label_names, label_values, value):
+    labels = dict(zip(label_names, label_values))
+    for sink in _sinks:
+        try:
+            sink(name, labels, value)
+        except Exception:
+            logging.exception("Metrics sink %s failed", sink)
+
+
+class _Metric(ABC):
+    kind = None
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    @abstractmethod
+    def _render(self) -> List[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render())
+        return "\n".join(lines)
+
+    def _labels(self, label_values: Tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count, e.g. the number of API call retries.
+    """
+    kind = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1):
+        """
+        :param label_values: the values of the counter labels, in the order they were declared
+        :param amount: optional: the increment. Default is 1
+        """
+        if not _enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+        if _sinks:
+            _notify_sinks(self.name, self.label_names, label_values, amount)
+
+    def get(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def _render(self) -> List[str]:
+        return [f"{self.name}{self._labels(k)} {_format(v)}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    A distribution of durations, counted in cumulative buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values: str):
+        """
+        :param value: the observed value, in seconds for durations
+        :param label_values: the values of the histogram labels, in the order they were declared
+        """
+        if not _enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # per-bucket counts, including the +Inf bucket, followed by the sum
+                state = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[i] += 1
+            state[-1] += value
+        if _sinks:
+            _notify_sinks(self.name, self.label_names, label_values, value)
+
+    @contextmanager
+    def time(self, *label_values: str):
+        """
+        Observes the duration of the code block.
+
+            with API_CALL_DURATION.time("send_message"):
+                ...
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, *label_values)
+
+    def get(self, *label_values: str) -> Optional[dict]:
+        """
+        :return: a dict with the observation count, sum and cumulative bucket counts, or None if nothing was observed
+        """
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                return None
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                buckets[bound] = cumulative
+            return {"count": cumulative, "sum": state[-1], "buckets": buckets}
+
+    def _render(self) -> List[str]:
+        lines = []
+        for label_values, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = 'le="' + _format(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._labels(label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(label_values)} {_format(state[-1])}")
+            lines.append(f"{self.name}_count{self._labels(label_values)} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+METRICS: Dict[str, _Metric] = {}
+
+
+def counter(name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+    """
+    Creates a counter and registers it for export, or returns the counter already registered with the same name.
+    """
+    if name not in METRICS:
+        METRICS[name] = Counter(name, documentation, label_names)
+    return METRICS[name]
+
+
+def histogram(name: str, documentation: str, label_names: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """
+    Creates a histogram and registers it for export, or returns the histogram already registered with the same name.
+    """
+    if name not in METRICS:
+        METRICS[name] = Histogram(name, documentation, label_names, buckets)
+    return METRICS[name]
+
+
+HANDLER_DURATION = histogram(
+    "botstarter_handler_duration_seconds",
+    "Duration of bot handlers, including database and API calls",
+    ("kind", "handler")
+)
+HANDLER_ERRORS = counter(
+    "botstarter_handler_errors_total",
+    "Number of bot handlers that raised an exception",
+    ("kind", "handler")
+)
+API_CALL_DURATION = histogram(
+    "botstarter_api_call_duration_seconds",
+    "Duration of Telegram API calls, excluding rate limiting waits",
+    ("method",)
+)
+API_CALL_WAIT = histogram(
+    "botstarter_api_call_wait_seconds",
+    "Time Telegram API calls waited for the rate limits, including the retry delays of rate limit errors",
+    ("method",)
+)
+API_CALL_TIMEOUTS = counter(
+    "botstarter_api_call_timeouts_total",
+    "Number of Telegram API calls that timed out",
+    ("method",)
+)
+API_CALL_RETRIES = counter(
+    "botstarter_api_call_retries_total",
+    "Number of Telegram API calls retried after a connection error, a timeout, a server error or a rate limit error",
+    ("method", "reason")
+)
+HTTP_CONNECTIONS = counter(
+    "botstarter_http_connections_total",
+    "Number of HTTP connections opened to the Telegram API"
+)
+DB_OPERATION_DURATION = histogram(
+    "botstarter_db_operation_duration_seconds",
+    "Duration of MongoDB operations made through model classes",
+    ("model", "operation")
+)
+
+
+def instrument_handler(kind: str, name: str) -> Callable[[Callable], Callable]:
+    """
+    Creates a decorator that records the duration and errors of a handler function.
+
+    :param kind: the handler kind, e.g. "message", "callback" or "admin"
+    :param name: the handler name
+    :return: the decorator function
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def instrumented_handler(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(kind, name)
+                raise
+            finally:
+                HANDLER_DURATION.observe(perf_counter() - started, kind, name)
+
+        return instrumented_handler
+
+    return decorator
+
+
+def render_prometheus() -> str:
+    """
+    :return: all registered metrics in the Prometheus text exposition format
+    """
+    return "\n".join(metric.render() for metric in METRICS.values()) + "\n"
+
+
+def reset():
+    """
+    Clears all recorded values.
+    """
+    for metric in METRICS.values():
+        metric.clear()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics endpoint: " + format, *args)
+
+
+def start_http_server(port: int = 9464, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serves the metrics in the Prometheus text format at the `/metrics` path, on a background thread.
+
+    :param port: optional: the port number. Default is 9464
+    :param host: optional: the interface to bind. Default is all interfaces
+    :return: the running http.server.ThreadingHTTPServer. Call shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="botstarter-metrics", daemon=True)
+    thread.start()
+    logging.info("Serving metrics at http://%s:%d/metrics", host, server.server_address[1])
+    return server
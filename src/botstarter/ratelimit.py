@@ -0,0 +1,232 @@
+"""
+Outbound Telegram API rate limiting.
+
+Telegram limits how fast a bot can send messages: about 30 messages per second overall, one message per second in
+the same chat (short bursts are tolerated) and 20 messages per minute in the same group. Going over these limits
+makes the API fail with a 429 error and a `retry_after` delay.
+
+The SendScheduler paces every outbound call with token buckets for the global, per-chat and per-group limits, and
+honors the `retry_after` delay of 429 errors. Calls waiting for the global limit are served by priority, so
+interactive replies go ahead of bulk sends like broadcasts.
+"""
+import heapq
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic, perf_counter, sleep
+from typing import Callable, Optional
+
+from botstarter import metrics
+from botstarter.cache import LRUCache
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+_priority: ContextVar[int] = ContextVar("botstarter_send_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """
+    Sets the priority of the API calls made in the context. Lower values are served first.
+
+        with send_priority(PRIORITY_BULK):
+            bot.send_message(chat_id, text)
+
+    :param priority: the priority of the calls, PRIORITY_INTERACTIVE by default
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    A token bucket with reservations: tokens can be taken ahead of time, and the caller is told how long to wait for
+    the reserved token to become available.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: the number of tokens added every second
+        :param capacity: the maximum number of tokens, i.e. the largest allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """
+        :return: the number of seconds until a token is available, without taking it
+        """
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def reserve(self, now: float) -> float:
+        """
+        Takes a token, possibly in advance.
+
+        :return: the number of seconds the caller has to wait before using the token
+        """
+        wait = self.delay(now)
+        self.tokens -= 1
+        return wait
+
+    def pause(self, now: float, seconds: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class SendScheduler:
+    """
+    Paces Telegram API calls according to the global, per-chat and per-group rate limits.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 3, max_retries: int = 3,
+                 max_chat_buckets: int = 10000):
+        """
+        :param global_rate: the number of calls per second across all chats. Default is 30
+        :param chat_rate: the number of calls per second to the same private chat. Default is 1
+        :param chat_burst: the number of calls to the same private chat that can be sent at once. Default is 3
+        :param group_rate: the number of calls per second to the same group. Default is 20 per minute
+        :param group_burst: the number of calls to the same group that can be sent at once. Default is 3
+        :param max_retries: the number of times a call is retried when it fails with a 429 error. Default is 3
+        :param max_chat_buckets: the number of chats whose rate is tracked. Buckets of chats that haven't been used
+                                 for a while are discarded first
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = LRUCache(maxsize=max_chat_buckets)
+        self._lock = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+
+        self._calls = 0
+        self._rate_limited = 0
+        self._wait_time = {}
+
+    def call(self, func: Callable, rate_limit_chat_id: Optional[int] = None, **kwargs):
+        """
+        Calls a Telegram API function once the rate limits allow it, retrying it if Telegram replies with a 429
+        error.
+
+        :param func: the API function
+        :param rate_limit_chat_id: optional: the id of the chat the call is addressed to. Calls that aren't addressed
+                                   to a chat are only subject to the global limit
+        :param kwargs: the keyword arguments of the API function
+        :return: the result of the API function
+        """
+        # imported here, so that importing this module doesn't import telebot
+        from telebot.apihelper import ApiTelegramException
+
+        method = getattr(func, "__name__", "unknown")
+        attempt = 0
+        waited = 0.0
+        try:
+            while True:
+                started = perf_counter()
+                self.acquire(rate_limit_chat_id)
+                waited += perf_counter() - started
+                try:
+                    with metrics.API_CALL_DURATION.time(method):
+                        return func(**kwargs)
+                except ApiTelegramException as e:
+                    if e.error_code != 429 or attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    metrics.API_CALL_RETRIES.inc(method, "rate_limit")
+                    retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                    logging.warning("Telegram API rate limit exceeded for chat %s. Retrying in %s seconds",
+                                    rate_limit_chat_id, retry_after)
+                    self._pause(rate_limit_chat_id, retry_after)
+        finally:
+            # the rate limit waits, including the retry_after delays of 429 errors, are not part of the call duration
+            metrics.API_CALL_WAIT.observe(waited, method)
+
+    def acquire(self, chat_id: Optional[int] = None, priority: Optional[int] = None):
+        """
+        Blocks until a call to the given chat can be made.
+
+        :param chat_id: optional: the id of the chat
+        :param priority: optional: the call priority. Defaults to the priority set with `send_priority`
+        """
+        if priority is None:
+            priority = _priority.get()
+        started = monotonic()
+
+        if chat_id is not None:
+            with self._lock:
+                wait = self._chat_bucket(chat_id).reserve(monotonic())
+            if wait > 0:
+                sleep(wait)
+
+        entry = (priority, next(self._seq))
+        with self._lock:
+            heapq.heappush(self._waiters, entry)
+            while True:
+                wait = self._global.delay(monotonic())
+                if self._waiters[0] == entry and wait <= 0:
+                    heapq.heappop(self._waiters)
+                    self._global.tokens -= 1
+                    self._lock.notify_all()
+                    break
+                self._lock.wait(wait if wait > 0 else None)
+
+            self._calls += 1
+            total, count, longest = self._wait_time.get(priority, (0.0, 0, 0.0))
+            waited = monotonic() - started
+            self._wait_time[priority] = (total + waited, count + 1, max(longest, waited))
+
+    def stats(self) -> dict:
+        """
+        :return: a dict with the number of calls, of 429 errors and the queue wait time per priority
+        """
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "rate_limited": self._rate_limited,
+                "waiting": len(self._waiters),
+                "wait_time": {
+                    priority: {"total": total, "count": count, "max": longest}
+                    for priority, (total, count, longest) in self._wait_time.items()
+                }
+            }
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if not isinstance(chat_id, int) or chat_id < 0:
+                # groups, supergroups and channels
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats.put(chat_id, bucket)
+        return bucket
+
+    def _pause(self, chat_id, seconds):
+        with self._lock:
+            self._rate_limited += 1
+            now = monotonic()
+            if chat_id is not None:
+                self._chat_bucket(chat_id).pause(now, seconds)
+            else:
+                self._global.pause(now, seconds)
+                self._lock.notify_all()
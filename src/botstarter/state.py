@@ -0,0 +1,291 @@
+"""
+Conversation state stores.
+
+`bot.wait_on_user_reply` saves a ConversationState for the user, and the next text message of the user is routed to
+the `user_msg_callback` handler of the state action. The state is read and removed with a single atomic operation.
+
+The store is set with the `state_store` parameter of `bot.init_bot`:
+  - UserFieldStateStore: the default. The state is kept in the `waiting_on` field of the user document, and the user
+    document that is read for every message tells if there is a state to pop
+  - MemoryStateStore: an in-process store, without database writes. States are lost on restart and are not shared
+    between processes
+  - MongoStateStore: a dedicated collection, with a TTL index removing abandoned dialogs
+  - RedisStateStore: a Redis-compatible server, with native key expiration
+
+States expire after a time-to-live, so that a dialog abandoned by the user doesn't capture a message sent days later.
+Besides the action name and its parameters, a state can carry structured data:
+
+    bot.wait_on_user_reply(user, "ASK_ADDRESS", order_id, data={"items": [1, 2]}, ttl=600)
+
+    @bot.user_msg_callback("ASK_ADDRESS")
+    def on_address(msg, user, action_params, action_data=None):
+        ...
+"""
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import Any, List, NamedTuple, Optional
+
+from pymongo import IndexModel, ReturnDocument
+
+from botstarter import util
+
+"""
+Default number of seconds after which a conversation state expires
+"""
+DEFAULT_STATE_TTL = 24 * 60 * 60
+
+DEFAULT_STATE_COLLECTION = "conversation_states"
+
+"""
+Separator of the action name and parameters in states packed as strings, the same used for callback data
+"""
+STATE_SEPARATOR = "::"
+
+
+class ConversationState(NamedTuple):
+    action: str
+    params: List[str] = []
+    data: Any = None
+
+    def to_dict(self) -> dict:
+        return {"action": self.action, "params": list(self.params), "data": self.data}
+
+    @classmethod
+    def from_dict(cls, doc: dict) -> "ConversationState":
+        return cls(doc["action"], list(doc.get("params") or []), doc.get("data"))
+
+
+class StateStore(ABC):
+    """
+    A store of conversation states by user id.
+    """
+
+    def __init__(self, default_ttl: Optional[float] = DEFAULT_STATE_TTL):
+        """
+        :param default_ttl: optional: the number of seconds after which a state expires, when it's set without a
+                            ttl. None means states never expire. Default is one day
+        """
+        self.default_ttl = default_ttl
+
+    def _ttl(self, ttl: Optional[float]) -> Optional[float]:
+        return self.default_ttl if ttl is None else ttl
+
+    @abstractmethod
+    def set(self, user_id: int, state: ConversationState, ttl: Optional[float] = None):
+        """
+        Saves the state of a user, replacing the previous one.
+
+        :param user_id: the user id
+        :param state: the ConversationState object
+        :param ttl: optional: the number of seconds after which the state expires. Default is the store default_ttl
+        """
+
+    @abstractmethod
+    def pop(self, user_id: int, user=None) -> Optional[ConversationState]:
+        """
+        Atomically reads and removes the state of a user.
+
+        :param user_id: the user id
+        :param user: optional: the user document already read by the caller, which stores can use to skip a lookup
+        :return: the ConversationState object, or None if the user has no state or it expired
+        """
+
+    def delete(self, user_id: int):
+        self.pop(user_id)
+
+
+class MemoryStateStore(StateStore):
+    """
+    An in-process state store. The oldest states are dropped when the store is full.
+    """
+
+    def __init__(self, default_ttl: Optional[float] = DEFAULT_STATE_TTL, maxsize: int = 100000):
+        """
+        :param default_ttl: optional: see StateStore. Default is one day
+        :param maxsize: optional: the maximum number of states. Default is 100000
+        """
+        super().__init__(default_ttl)
+        self.maxsize = maxsize
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set(self, user_id: int, state: ConversationState, ttl: Optional[float] = None):
+        ttl = self._ttl(ttl)
+        expires_at = monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._states[user_id] = (expires_at, state)
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.maxsize:
+                self._states.popitem(last=False)
+
+    def pop(self, user_id: int, user=None) -> Optional[ConversationState]:
+        with self._lock:
+            entry = self._states.pop(user_id, None)
+        if entry is None:
+            return None
+        expires_at, state = entry
+        if expires_at is not None and expires_at <= monotonic():
+            return None
+        return state
+
+    def __len__(self):
+        return len(self._states)
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[datetime]:
+    return datetime.now(timezone.utc) + timedelta(seconds=ttl) if ttl is not None else None
+
+
+def _is_expired(expires_at: Optional[datetime]) -> bool:
+    if expires_at is None:
+        return False
+    if expires_at.tzinfo is None:
+        # pymongo returns naive UTC datetimes by default
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at <= datetime.now(timezone.utc)
+
+
+class MongoStateStore(StateStore):
+    """
+    A state store on a dedicated MongoDB collection. Each state is a document with the user id as `_id`, and a TTL
+    index on the `expires_at` field removes expired states. Since MongoDB removes expired documents periodically,
+    expiration is also checked when a state is read.
+    """
+
+    def __init__(self, default_ttl: Optional[float] = DEFAULT_STATE_TTL,
+                 collection_name: str = DEFAULT_STATE_COLLECTION, create_index: bool = True):
+        """
+        :param default_ttl: optional: see StateStore. Default is one day
+        :param collection_name: optional: the name of the states collection. Default is "conversation_states"
+        :param create_index: optional: create the TTL index when the collection is first used. Default is True
+        """
+        super().__init__(default_ttl)
+        self.collection_name = collection_name
+        self.create_index = create_index
+        self.__collection = None
+
+    @property
+    def collection(self):
+        # the database is initialized by init_bot, possibly after the store is created
+        if self.__collection is None:
+            from botstarter.db.base import get_db
+            collection = get_db()[self.collection_name]
+            if self.create_index:
+                collection.create_indexes([IndexModel("expires_at", expireAfterSeconds=0)])
+            self.__collection = collection
+        return self.__collection
+
+    def set(self, user_id: int, state: ConversationState, ttl: Optional[float] = None):
+        doc = state.to_dict()
+        doc["expires_at"] = _expires_at(self._ttl(ttl))
+        self.collection.replace_one({"_id": user_id}, doc, upsert=True)
+
+    def pop(self, user_id: int, user=None) -> Optional[ConversationState]:
+        doc = self.collection.find_one_and_delete({"_id": user_id})
+        if doc is None or _is_expired(doc.get("expires_at")):
+            return None
+        return ConversationState.from_dict(doc)
+
+
+class RedisStateStore(StateStore):
+    """
+    A state store on a Redis-compatible server. States are JSON strings read and removed with GETDEL, which requires
+    Redis 6.2 or a compatible server.
+    """
+
+    def __init__(self, default_ttl: Optional[float] = DEFAULT_STATE_TTL, url: Optional[str] = None,
+                 prefix: str = "botstarter:state", client=None):
+        """
+        :param default_ttl: optional: see StateStore. Default is one day
+        :param url: optional: the Redis server url. Default is the "REDIS_URL" environment variable, or a local server
+        :param prefix: optional: the prefix of the state keys. Default is "botstarter:state"
+        :param client: optional: a redis.Redis client, used instead of connecting to the url
+        """
+        super().__init__(default_ttl)
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("The Redis state store requires the 'redis' package. "
+                                  "Install it with: pip install redis") from e
+            client = redis.Redis.from_url(url or os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        self.prefix = prefix
+        self._redis = client
+
+    def _key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    def set(self, user_id: int, state: ConversationState, ttl: Optional[float] = None):
+        ttl = self._ttl(ttl)
+        if ttl is not None and ttl <= 0:
+            # Redis rejects non-positive expiration times, the state is expired already
+            self._redis.delete(self._key(user_id))
+            return
+        self._redis.set(self._key(user_id), json.dumps(state.to_dict()),
+                        px=int(ttl * 1000) if ttl is not None else None)
+
+    def pop(self, user_id: int, user=None) -> Optional[ConversationState]:
+        value = self._redis.getdel(self._key(user_id))
+        if value is None:
+            return None
+        return ConversationState.from_dict(json.loads(value))
+
+
+def parse_waiting_on(waiting_on) -> Optional[ConversationState]:
+    """
+    Reads the state kept in the `waiting_on` field of a user document by UserFieldStateStore, either packed as a
+    string or as a dict with data and expiration.
+
+    :param waiting_on: the value of the field
+    :return: the ConversationState object, or None if there is no state or it expired
+    """
+    if not waiting_on:
+        return None
+    if isinstance(waiting_on, str):
+        action, params = util.unpack_callback_data(waiting_on, separator=STATE_SEPARATOR)
+        return ConversationState(action, params)
+    if _is_expired(waiting_on.get("expires_at")):
+        return None
+    return ConversationState.from_dict(waiting_on)
+
+
+class UserFieldStateStore(StateStore):
+    """
+    The state store of previous versions: states are kept in the `waiting_on` field of user documents. States
+    without data or expiration are packed as strings, so that they are compatible with `db.aio.set_user_waiting_on`.
+    By default, states of this store don't expire.
+    """
+
+    def __init__(self, default_ttl: Optional[float] = None):
+        super().__init__(default_ttl)
+
+    def set(self, user_id: int, state: ConversationState, ttl: Optional[float] = None):
+        from botstarter.db.users import set_user_waiting_on
+        ttl = self._ttl(ttl)
+        if state.data is None and ttl is None:
+            waiting_on = util.pack_callback_data(state.action, params=state.params, separator=STATE_SEPARATOR)
+        else:
+            waiting_on = state.to_dict()
+            waiting_on["expires_at"] = _expires_at(ttl)
+        set_user_waiting_on(user_id, waiting_on=waiting_on)
+
+    def pop(self, user_id: int, user=None) -> Optional[ConversationState]:
+        from botstarter.db.users import User
+        if user is not None:
+            waiting_on = user.get("waiting_on")
+            if not waiting_on:
+                # the user document was just read: there is no state to pop
+                return None
+            User.update_one({"id": user_id}, {"$set": {"waiting_on": None}})
+        else:
+            doc = User.find_one_and_update({"id": user_id, "waiting_on": {"$ne": None}},
+                                           {"$set": {"waiting_on": None}},
+                                           projection={"waiting_on": True},
+                                           return_document=ReturnDocument.BEFORE)
+            waiting_on = doc.get("waiting_on") if doc is not None else None
+        return parse_waiting_on(waiting_on)
@@ -0,0 +1,261 @@
+"""
+Pre-escaped message templates.
+
+Templates use the `str.format` syntax. The static text of a template is parsed and escaped for the parse mode once,
+when the template is compiled, while at render time only the interpolated values are escaped:
+
+    welcome = Template("Hello {name}! Your order #{order.id} is ready.")
+    bot.send_message(chat_id, welcome.render(name=user.first_name, order=order))
+
+Rendered templates are `util.EscapedText` strings, which the bot helpers send without escaping them again.
+
+Templates can be organized in per-language catalogs, and compiled templates are kept in a size-bounded cache:
+
+    init_catalog({
+        "en": {"welcome": "Hello {name}!"},
+        "it": {"welcome": "Ciao {name}!"}
+    })
+    bot.send_message(chat_id, render("welcome", language=user.language_code, name=user.first_name))
+"""
+import html
+import json
+import os
+import re
+from string import Formatter
+from typing import Dict, Optional, Union
+
+from botstarter import util
+from botstarter.cache import LRUCache
+
+DEFAULT_LANGUAGE = "en"
+TEMPLATE_CACHE_SIZE = 1024
+
+_formatter = Formatter()
+_FIELD_MARK = "\x00"
+
+_NEEDS_ESCAPE = {
+    "MarkdownV2": re.compile("[" + re.escape(util.MARKDOWN_V2_RESERVED_CHARS + "\\") + "]").search,
+    "HTML": re.compile("[<>&]").search
+}
+
+__catalog = None
+
+
+def escape(text: str, parse_mode: Optional[str] = "MarkdownV2", keep_entities: bool = False) -> str:
+    """
+    Escapes a text for the given parse mode.
+
+    :param text: the text
+    :param parse_mode: optional: "MarkdownV2", "HTML" or None for plain text. Default is "MarkdownV2"
+    :param keep_entities: optional: keep the MarkdownV2 formatting entities of the text. Default is False
+    :return: the escaped text
+    """
+    if parse_mode == "MarkdownV2":
+        return util.str2mdown(text, keep_entities=keep_entities)
+    elif parse_mode == "HTML" and not keep_entities:
+        return html.escape(text, quote=False)
+    return text
+
+
+class Template:
+    """
+    A message template compiled for a parse mode.
+    """
+
+    def __init__(self, source: str, parse_mode: Optional[str] = "MarkdownV2", keep_entities: bool = False):
+        """
+        :param source: the template text, in `str.format` syntax
+        :param parse_mode: optional: the parse mode of the rendered messages, "MarkdownV2", "HTML" or None for plain
+                           text. Default is "MarkdownV2"
+        :param keep_entities: optional: keep the formatting of the template static text, e.g. *bold* in MarkdownV2
+                              templates or <b>bold</b> in HTML templates. Interpolated values are always escaped.
+                              Default is False
+        """
+        if _FIELD_MARK in source:
+            raise ValueError("Templates cannot contain NUL characters.")
+        self.source = source
+        self.parse_mode = parse_mode
+        self._needs_escape = _NEEDS_ESCAPE.get(parse_mode, lambda value: False)
+
+        # the static text is escaped as a whole, with a placeholder for each field, so that formatting entities
+        # spanning over fields, like links with a variable text, are recognized
+        fields = []
+        text = []
+        for literal, field_name, format_spec, conversion in _formatter.parse(source):
+            text.append(literal)
+            if field_name is not None:
+                if not field_name or field_name.isdigit():
+                    raise ValueError(f"Template fields must be named: {source!r}")
+                text.append(f"{_FIELD_MARK}{len(fields)}{_FIELD_MARK}")
+                fields.append((field_name, conversion, format_spec))
+
+        self._parts = []
+        for i, chunk in enumerate(escape("".join(text), parse_mode, keep_entities).split(_FIELD_MARK)):
+            if i % 2 == 0:
+                if chunk:
+                    self._parts.append(chunk)
+            else:
+                self._parts.append(fields[int(chunk)])
+
+    def render(self, **values) -> util.EscapedText:
+        """
+        Renders the template, escaping the interpolated values.
+
+        :param values: the values of the template fields
+        :return: the rendered text
+        """
+        chunks = []
+        for part in self._parts:
+            if part.__class__ is str:
+                chunks.append(part)
+                continue
+
+            field_name, conversion, format_spec = part
+            if conversion is None and not format_spec and field_name in values:
+                # fast path for plain {name} fields
+                value = values[field_name]
+                if value.__class__ is not str:
+                    value = format(value)
+            else:
+                value, _ = _formatter.get_field(field_name, (), values)
+                value = _formatter.format_field(_formatter.convert_field(value, conversion), format_spec)
+
+            if self._needs_escape(value):
+                value = escape(value, self.parse_mode)
+            chunks.append(value)
+        return util.EscapedText("".join(chunks))
+
+    def __repr__(self):
+        return f"Template({self.source!r}, parse_mode={self.parse_mode!r})"
+
+
+__compiled_templates = LRUCache(maxsize=TEMPLATE_CACHE_SIZE)
+
+
+def compile_template(source: str, parse_mode: Optional[str] = "MarkdownV2", keep_entities: bool = False) -> Template:
+    """
+    Returns the compiled template for the source text, compiling it only if it isn't in the templates cache.
+    See `Template` for the parameters.
+    """
+    key = (source, parse_mode, keep_entities)
+    template = __compiled_templates.get(key)
+    if template is None:
+        template = Template(source, parse_mode, keep_entities)
+        __compiled_templates.put(key, template)
+    return template
+
+
+def get_template_cache_stats() -> dict:
+    return __compiled_templates.stats()
+
+
+class TemplateCatalog:
+    """
+    Message templates by language and name.
+    """
+
+    def __init__(self, templates: Dict[str, Dict[str, str]], default_language: str = DEFAULT_LANGUAGE,
+                 parse_mode: Optional[str] = "MarkdownV2", keep_entities: bool = False):
+        """
+        :param templates: a dict of template sources by name, for each language code
+        :param default_language: optional: the language used when a template doesn't exist in the requested language.
+                                 Default is "en"
+        :param parse_mode: optional: the parse mode of the rendered messages. Default is "MarkdownV2"
+        :param keep_entities: optional: keep the formatting of the templates static text. Default is False
+        """
+        if default_language not in templates:
+            raise ValueError(f"The catalog has no templates for the default language [{default_language}].")
+        self.templates = templates
+        self.default_language = default_language
+        self.parse_mode = parse_mode
+        self.keep_entities = keep_entities
+
+    @classmethod
+    def from_directory(cls, path: str, **kwargs) -> "TemplateCatalog":
+        """
+        Loads a catalog from a directory with a JSON file of templates by name for each language, e.g. "en.json".
+
+        :param path: the directory path
+        :param kwargs: additional keyword arguments for the catalog creation
+        :return: the TemplateCatalog object
+        """
+        templates = {}
+        for file_name in sorted(os.listdir(path)):
+            language, ext = os.path.splitext(file_name)
+            if ext == ".json":
+                with open(os.path.join(path, file_name), encoding="utf-8") as f:
+                    templates[language] = json.load(f)
+        return cls(templates, **kwargs)
+
+    def _resolve_language(self, language: Optional[str]) -> str:
+        if language:
+            language = language.lower()
+            if language in self.templates:
+                return language
+            # "pt-br" falls back to "pt"
+            base_language = language.split("-", 1)[0]
+            if base_language in self.templates:
+                return base_language
+        return self.default_language
+
+    def get(self, name: str, language: Optional[str] = None) -> Template:
+        """
+        Returns a compiled template, in the requested language if available or in the default language otherwise.
+
+        :param name: the template name
+        :param language: optional: the language code, e.g. the user's `language_code`
+        :return: the Template object
+        """
+        source = self.templates[self._resolve_language(language)].get(name)
+        if source is None:
+            source = self.templates[self.default_language].get(name)
+        if source is None:
+            raise KeyError(f"Template [{name}] was not found.")
+        return compile_template(source, self.parse_mode, self.keep_entities)
+
+    def render(self, name: str, language: Optional[str] = None, /, **values) -> util.EscapedText:
+        return self.get(name, language).render(**values)
+
+
+def init_catalog(templates: Union[str, Dict[str, Dict[str, str]]], **kwargs) -> TemplateCatalog:
+    """
+    Initializes the global template catalog.
+
+    :param templates: a dict of template sources by name for each language code, or the path of a directory with a
+                      JSON file of templates for each language. See `TemplateCatalog.from_directory`
+    :param kwargs: additional keyword arguments for the catalog creation
+    :return: the TemplateCatalog object
+    """
+    global __catalog
+    if isinstance(templates, str):
+        __catalog = TemplateCatalog.from_directory(templates, **kwargs)
+    else:
+        __catalog = TemplateCatalog(templates, **kwargs)
+    return __catalog
+
+
+def get_catalog() -> TemplateCatalog:
+    global __catalog
+    if __catalog is not None:
+        return __catalog
+    else:
+        raise RuntimeError("""
+Template catalog was not initialised. To fix this issue add the following lines to your main python file:
+
+from botstarter.templates import init_catalog
+
+if __name__ == "__main__":
+    init_catalog("templates/")""")
+
+
+def render(name: str, language: Optional[str] = None, /, **values) -> util.EscapedText:
+    """
+    Renders a template of the global catalog. Template name and language are positional arguments, so that templates
+    can have fields with the same names.
+
+    :param name: the template name
+    :param language: optional: the language code, e.g. the user's `language_code`
+    :param values: the values of the template fields
+    :return: the rendered text
+    """
+    return get_catalog().render(name, language, **values)
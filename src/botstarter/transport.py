@@ -0,0 +1,198 @@
+"""
+HTTP transport of the Telegram Bot API calls.
+
+By default, telebot sends requests with one `requests` session per thread and the same timeout to connect and to
+read the response. The HttpTransport replaces it with:
+  - a single session with a keep-alive connection pool, sized to the number of threads sending requests
+  - separate connect and read timeouts, so that an unreachable API fails fast while slow uploads have time to finish
+  - retries of connection errors, timeouts and server errors with exponential backoff and jitter, so that requests
+    failing at the same time are not retried all at once. Requests that may have reached the API are only retried
+    for the methods that read data, like getUpdates: a sendMessage request is retried only if the connection could
+    not be established, so that the message is not sent twice
+  - counters of requests, opened connections and retries
+
+The transport is installed by `bot.init_bot` and can be configured with its `http_opts` parameter.
+"""
+import logging
+import random
+import re
+import threading
+from time import sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from telebot import apihelper
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+
+from botstarter import metrics
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 20
+DEFAULT_MAX_RETRIES = 3
+
+"""
+HTTP status codes of server errors that are retried. Telegram returns them when the API is temporarily unavailable.
+"""
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+"""
+Prefix of the API methods that only read data. Their requests are retried even if they may have reached the API
+"""
+IDEMPOTENT_METHOD_PREFIX = "get"
+
+_method_names = {}
+
+
+def _method_name(url: str) -> str:
+    # "https://api.telegram.org/bot<token>/sendMessage" -> "send_message", like the TeleBot method names
+    api_method = url.rsplit("/", 1)[-1]
+    name = _method_names.get(api_method)
+    if name is None:
+        name = _method_names[api_method] = re.sub(r"(?<!^)(?=[A-Z])", "_", api_method).lower()
+    return name
+
+
+def _not_sent(error: ConnectionError) -> bool:
+    # the connection could not be established, e.g. it was refused or timed out, so the request was not sent
+    if isinstance(error, ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class HttpTransport:
+    """
+    A pooled keep-alive HTTP transport for telebot API requests, with retries.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = 0.5, backoff_max: float = 10):
+        """
+        :param pool_size: optional: the number of connections kept open to the API. It should be at least the number
+                          of threads sending requests concurrently. Default is 10
+        :param connect_timeout: optional: the timeout to establish a connection, in seconds. Default is 5
+        :param read_timeout: optional: the timeout to receive a response, in seconds, for calls that don't set their
+                             own timeout. Default is 20
+        :param max_retries: optional: the number of times a request is retried after a connection error, a timeout
+                            or a server error. Requests of methods that don't start with "get" are only retried when
+                            they were not sent. Default is 3
+        :param backoff_base: optional: the delay before the first retry, in seconds. The delay doubles at each retry,
+                             and a random delay between zero and this value is actually waited. Default is 0.5
+        :param backoff_max: optional: the maximum delay between retries, in seconds. Default is 10
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections = 0
+        self._retries = 0
+
+        transport = self
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                transport._count_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                transport._count_connection()
+                return super()._new_conn()
+
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _count_connection(self):
+        with self._lock:
+            self._connections += 1
+        metrics.HTTP_CONNECTIONS.inc()
+
+    def backoff(self, attempt: int) -> float:
+        """
+        :return: the delay before the given retry attempt, with "full jitter"
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method: str, url: str, params=None, files=None, timeout=None, proxies=None):
+        """
+        Sends an API request, retrying it on failure. The signature matches telebot's `CUSTOM_REQUEST_SENDER`.
+
+        :param timeout: optional: the timeout set by telebot, a (connect, read) tuple or a number. Only the read
+                        timeout is used, the connect timeout is always the one configured in the transport
+        :return: the requests.Response object
+        """
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout or self.read_timeout
+        method_name = _method_name(url)
+        idempotent = method_name.startswith(IDEMPOTENT_METHOD_PREFIX)
+
+        attempt = 0
+        while True:
+            with self._lock:
+                self._requests += 1
+            try:
+                if files and attempt > 0:
+                    # files were read by the failed request, rewind them
+                    for f in files.values():
+                        f = f[1] if isinstance(f, tuple) else f
+                        if hasattr(f, "seek"):
+                            f.seek(0)
+                response = self.session.request(method, url, params=params, files=files, proxies=proxies,
+                                                timeout=(self.connect_timeout, read_timeout))
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries or not idempotent:
+                    return response
+                reason = "server_error"
+            except (ConnectionError, Timeout) as e:
+                if isinstance(e, Timeout):
+                    metrics.API_CALL_TIMEOUTS.inc(method_name)
+                # the API may have processed a request whose response was lost
+                if attempt >= self.max_retries or not (idempotent or _not_sent(e)):
+                    raise
+                reason = "timeout" if isinstance(e, Timeout) else "connection"
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            with self._lock:
+                self._retries += 1
+            metrics.API_CALL_RETRIES.inc(method_name, reason)
+            logging.debug("Telegram API request %s failed (%s). Retrying in %.2f seconds", method_name, reason, delay)
+            sleep(delay)
+
+    def install(self):
+        """
+        Sends all telebot API requests through this transport.
+        """
+        apihelper.CUSTOM_REQUEST_SENDER = self.request
+
+    def close(self):
+        """
+        Closes the pooled connections and uninstalls the transport.
+        """
+        if apihelper.CUSTOM_REQUEST_SENDER == self.request:
+            apihelper.CUSTOM_REQUEST_SENDER = None
+        self.session.close()
+
+    def stats(self) -> dict:
+        """
+        :return: a dict with the number of requests, opened connections, reused connections and retries
+        """
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "connections": self._connections,
+                "reused": self._requests - self._connections,
+                "retries": self._retries
+            }
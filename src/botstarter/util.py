@@ -1,24 +1,94 @@
 """
 A collection of useful functions
 """
+import re
+
+"""
+Characters that must be escaped in MarkdownV2 text, according to the Telegram Bot API documentation.
+"""
+MARKDOWN_V2_RESERVED_CHARS = "_*[]()~`>#+-=|{}.!"
+
+"""
+Characters used to mark bold, italic, underline, strikethrough and spoiler text in MarkdownV2
+"""
+MARKDOWN_V2_FORMATTING_CHARS = "*_~|"
+
+_MARKDOWN_V2_ENTITY = re.compile(
+    r"(?P<pre>```.*?```)"
+    r"|(?P<code>`[^`\n]*`)"
+    r"|\[(?P<link_text>[^\]\n]*)\]\((?P<link_url>(?:\\[\x01-\x7e]|[^)\\\n])*)\)"
+    r"|(?P<escaped>\\[\x01-\x7e])",
+    re.DOTALL
+)
+
+
+def _escape_chars(text, chars):
+    # str.replace scans in C and returns the same string when there is nothing to replace, which makes a sequence
+    # of replacements faster than a single pass in python code, even when translate() or re.sub() are used
+    text = text.replace("\\", "\\\\")
+    for c in chars:
+        if c in text:
+            text = text.replace(c, "\\" + c)
+    return text
+
+
+def _escape_code(text):
+    return text.replace("\\", "\\\\").replace("`", "\\`")
 
 
-def str2mdown(text):
+def _escape_keeping_entities(text):
+    chunks = []
+    position = 0
+    for match in _MARKDOWN_V2_ENTITY.finditer(text):
+        chunks.append(_escape_chars(text[position:match.start()], _MARKDOWN_V2_PLAIN_RESERVED_CHARS))
+        position = match.end()
+
+        kind = match.lastgroup
+        if kind == "escaped":
+            chunks.append(match.group(kind))
+        elif kind == "pre":
+            chunks.append("```" + _escape_code(match.group(kind)[3:-3]) + "```")
+        elif kind == "code":
+            chunks.append("`" + _escape_code(match.group(kind)[1:-1]) + "`")
+        else:
+            # links: the text can contain other entities, the url is kept as it is
+            chunks.append(f"[{_escape_keeping_entities(match.group('link_text'))}]({match.group('link_url')})")
+    chunks.append(_escape_chars(text[position:], _MARKDOWN_V2_PLAIN_RESERVED_CHARS))
+    return "".join(chunks)
+
+
+_MARKDOWN_V2_PLAIN_RESERVED_CHARS = "".join(c for c in MARKDOWN_V2_RESERVED_CHARS if c not in MARKDOWN_V2_FORMATTING_CHARS)
+
+
+class EscapedText(str):
     """
-    Converts the given text string to Markdown .
+    A text that is already escaped for the bot parse mode, e.g. a rendered template. str2mdown returns escaped texts
+    unchanged, so they are not escaped twice when sent with the bot helpers.
+    """
+    __slots__ = ()
+
+
+def str2mdown(text, keep_entities=False):
+    """
+    Escapes the given text string for the MarkdownV2 parse mode.
+
+    By default, all the MarkdownV2 reserved characters are escaped and the text is sent as it is. With
+    `keep_entities`, the text is expected to contain MarkdownV2 formatting: bold, italic, underline, strikethrough and
+    spoiler markers, inline code, pre-formatted code blocks and links are kept, while the other reserved characters
+    are escaped. Characters already escaped with a backslash are left untouched, so a formatting marker can be sent
+    as a literal character by escaping it, e.g. "2 \\* 3". EscapedText strings are returned as they are.
 
     :param text: The string to be converted.
+    :param keep_entities: optional: keep the MarkdownV2 formatting entities of the text. Default is False
     :return: The Markdown converted text.
     """
 
-    if text is None:
-        return None
+    if text is None or isinstance(text, EscapedText):
+        return text
+    elif keep_entities:
+        return _escape_keeping_entities(text)
     else:
-        return text.replace("-", "\\-") \
-            .replace("!", "\\!") \
-            .replace(".", "\\.") \
-            .replace(">", "\\>") \
-            .replace("_", "\\_")
+        return _escape_chars(text, MARKDOWN_V2_RESERVED_CHARS)
 
 
 def _break_pattern(ptn: str):
@@ -0,0 +1,118 @@
+"""
+Embedded HTTP server to receive Telegram updates via webhook.
+
+Requests are acknowledged as soon as the update is queued for processing, while handlers run asynchronously on the
+update dispatcher's worker threads.
+"""
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from telebot import types
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+"""
+Maximum size of a webhook request body. Larger requests are rejected without being read.
+"""
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != self.server.path:
+            return self._reply(404)
+
+        secret_token = self.server.secret_token
+        if secret_token is not None:
+            received = self.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(received.encode(), secret_token.encode()):
+                logging.warning("Received webhook request with an invalid secret token from %s", self.client_address[0])
+                return self._reply(403)
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return self._reply(400)
+        if length <= 0 or length > MAX_BODY_SIZE:
+            return self._reply(413 if length > MAX_BODY_SIZE else 400)
+
+        try:
+            update = json.loads(self.rfile.read(length))
+            if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+                raise ValueError()
+            if not self.server.raw_updates:
+                update = types.Update.de_json(update)
+        except (ValueError, KeyError, TypeError):
+            logging.warning("Received malformed webhook update")
+            return self._reply(400)
+
+        try:
+            self.server.on_update(update)
+        except queue.Full:
+            # Telegram will deliver the update again later
+            logging.warning("Update queue is full. Rejecting update %s", self._update_id(update))
+            return self._reply(503)
+        self._reply(200)
+
+    @staticmethod
+    def _update_id(update):
+        return update["update_id"] if isinstance(update, dict) else update.update_id
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        if status != 200:
+            # the request body might not have been read
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+    def log_message(self, fmt, *args):
+        logging.debug("Webhook request from %s: " + fmt, self.client_address[0], *args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server that receives Telegram updates and hands them over to the `on_update` callback.
+    """
+    daemon_threads = True
+
+    def __init__(self, on_update: Callable[[types.Update], None], host="0.0.0.0", port=8443, path="/webhook",
+                 secret_token: Optional[str] = None, ssl_context=None, raw_updates: bool = False):
+        """
+        :param on_update: the function called with every received update. It should return quickly, raising
+                          `queue.Full` if the update can't be accepted
+        :param host: the interface to listen on. Default is "0.0.0.0"
+        :param port: the port to listen on. Default is 8443
+        :param path: the URL path Telegram posts updates to. Default is "/webhook"
+        :param secret_token: optional: the secret token Telegram sends in every request header. Requests with a
+                             missing or different token are rejected
+        :param ssl_context: optional: a ssl.SSLContext to serve requests over HTTPS
+        :param raw_updates: optional: call `on_update` with the JSON update as a dict, instead of parsing it into a
+                            telebot.types.Update object. Default is False
+        """
+        super().__init__((host, port), _WebhookRequestHandler)
+        if ssl_context is not None:
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+        self.on_update = on_update
+        self.path = path
+        self.secret_token = secret_token
+        self.raw_updates = raw_updates
+
+    def start(self) -> threading.Thread:
+        """
+        Starts serving requests on a background thread.
+
+        :return: the server thread
+        """
+        t = threading.Thread(target=self.serve_forever, name="botstarter-webhook", daemon=True)
+        t.start()
+        return t
@@ -1,9 +1,15 @@
 import os
+import threading
+import types
 
 import mock
+import mongomock
 import pytest
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import ServerSelectionTimeoutError
 
-from botstarter.db.base import init_db
+from botstarter.db.base import init_db, Base, register_model, ensure_indexes, discover_models, wait_indexes, \
+    MODEL_CLASSES
 
 MONGODB_DEFAULT_HOST = "localhost"
 MONGODB_DEFAULT_PORT = 27017
@@ -80,3 +86,147 @@ def test_base_init_db_should_fail_if_only_password_set():
 
     with pytest.raises(ValueError):
         init_db()
+
+
+class Model(Base):
+    """A model class for tests"""
+
+
+@pytest.fixture
+def model_collection():
+    collection = mongomock.MongoClient().db.models
+    collection.insert_many([{"n": i, "name": f"doc{i}", "payload": "x" * 10} for i in range(10)])
+    with mock.patch.object(Model, "__collection__", collection):
+        yield collection
+
+
+def test_iter_find_yields_model_objects_lazily(model_collection):
+    """Tests iter_find returns a generator of model objects"""
+    docs = Model.iter_find({"n": {"$lt": 3}}, sort=[("n", 1)])
+
+    assert isinstance(docs, types.GeneratorType)
+    first = next(docs)
+    assert isinstance(first, Model)
+    assert first.n == 0
+    assert [d.n for d in docs] == [1, 2]
+
+
+def test_iter_find_with_projection_limit_and_sort(model_collection):
+    """Tests iter_find applies projection, limit, sort and batch size"""
+    docs = list(Model.iter_find(projection={"n": 1, "_id": 0}, limit=3, sort=[("n", -1)], batch_size=2))
+
+    assert docs == [{"n": 9}, {"n": 8}, {"n": 7}]
+
+
+def test_find_returns_list(model_collection):
+    """Tests find still returns a list of model objects"""
+    docs = Model.find({"n": {"$gte": 8}})
+
+    assert isinstance(docs, list)
+    assert sorted(d.n for d in docs) == [8, 9]
+
+
+def test_register_model_declares_indexes():
+    """Tests indexes declared with register_model are created by ensure_indexes"""
+    collection = mongomock.MongoClient().db.test_indexed_models
+
+    with mock.patch.dict(MODEL_CLASSES):
+        @register_model("test_indexed_models", indexes=[
+            IndexModel("code", unique=True),
+            IndexModel([("a", ASCENDING), ("b", DESCENDING)]),
+            IndexModel("expires_at", expireAfterSeconds=60)
+        ])
+        class IndexedModel(Base):
+            __collection__ = collection
+            __collection_name__ = "test_indexed_models"
+
+        ensure_indexes(IndexedModel)
+
+    info = collection.index_information()
+    assert info["code_1"]["unique"]
+    assert list(info["a_1_b_-1"]["key"]) == [("a", ASCENDING), ("b", DESCENDING)]
+    assert info["expires_at_1"]["expireAfterSeconds"] == 60
+
+
+@mock.patch("pymongo.MongoClient")
+def test_base_init_db_can_skip_index_creation(mongo_client):
+    """Tests indexes are not created when create_indexes is False"""
+    os.environ.pop("MONGODB_USERNAME", default=None)
+    os.environ.pop("MONGODB_PASSWORD", default=None)
+
+    init_db(create_indexes=False)
+    mongo_client.return_value.__getitem__.return_value.__getitem__.return_value.create_indexes.assert_not_called()
+
+    init_db()
+    assert wait_indexes(timeout=5)
+    mongo_client.return_value.__getitem__.return_value.__getitem__.return_value.create_indexes.assert_called()
+
+
+@mock.patch("pymongo.MongoClient")
+def test_models_are_bound_to_their_collection_on_first_use(mongo_client):
+    """Tests models registered after init_db are bound to their collection when first used"""
+    mongo_client.side_effect = lambda **kwargs: mongomock.MongoClient()
+    init_db(model_packages=[])
+
+    with mock.patch.dict(MODEL_CLASSES):
+        @register_model("late_models", indexes=[IndexModel("code", unique=True)])
+        class LateModel(Base):
+            pass
+
+        LateModel({"code": 1}).save()
+        collection = LateModel.__collection__
+        assert collection.name == "late_models"
+        assert wait_indexes(timeout=5)
+        assert "code_1" in collection.index_information()
+        assert LateModel.find_one({"code": 1}).code == 1
+
+        # initializing the database again binds the models to the new database
+        init_db(model_packages=[])
+        assert LateModel.__collection__ is not collection
+        assert LateModel.find_one({"code": 1}) is None
+
+
+@mock.patch("pymongo.MongoClient")
+def test_base_init_db_does_not_wait_for_unreachable_database(mongo_client):
+    """Tests index creation errors are logged in the background without delaying or failing the initialization"""
+    release = threading.Event()
+
+    def create_indexes(indexes):
+        release.wait(5)
+        raise ServerSelectionTimeoutError("localhost:27017: connection refused")
+
+    mongo_client.return_value.__getitem__.return_value.__getitem__.return_value.create_indexes.side_effect = \
+        create_indexes
+    init_db(model_packages=[])
+    assert not wait_indexes(timeout=0)
+
+    release.set()
+    assert wait_indexes(timeout=5)
+
+
+def test_discover_models_walks_packages(tmp_path, monkeypatch):
+    """Tests discover_models imports all the modules of the model packages and of the entry points"""
+    package = tmp_path / "discovered_models"
+    (package / "shop").mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    (package / "shop" / "__init__.py").write_text("")
+    (package / "shop" / "orders.py").write_text(
+        "from botstarter.db.base import Base, register_model\n\n\n"
+        "@register_model('discovered_orders')\n"
+        "class Order(Base):\n"
+        "    pass\n")
+    (tmp_path / "discovered_entry_point.py").write_text(
+        "from botstarter.db.base import Base, register_model\n\n\n"
+        "@register_model('discovered_items')\n"
+        "class Item(Base):\n"
+        "    pass\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    with mock.patch.dict(MODEL_CLASSES), mock.patch.dict("sys.modules"):
+        discover_models(["discovered_models"])
+        assert MODEL_CLASSES["discovered_orders"].__module__ == "discovered_models.shop.orders"
+        assert "discovered_items" not in MODEL_CLASSES
+
+        with mock.patch("botstarter.db.base._entry_point_modules", return_value=["discovered_entry_point"]):
+            discover_models()
+        assert MODEL_CLASSES["discovered_items"].__collection_name__ == "discovered_items"
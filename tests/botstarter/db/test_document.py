@@ -0,0 +1,128 @@
+import mock
+import mongomock
+import pytest
+
+from botstarter.cache import LRUCache
+from botstarter.db.base import Base, register_model, MODEL_CLASSES
+from botstarter.db.document import Document
+
+
+class Order(Document):
+    """A document class for tests"""
+    user_id: int
+    status: str = "new"
+    tags: list = []
+
+
+@pytest.fixture
+def orders():
+    collection = mongomock.MongoClient().db.orders
+    collection.insert_many([{"user_id": i, "status": "paid", "notes": "x" * 100} for i in range(3)])
+    with mock.patch.object(Order, "__collection__", collection), \
+            mock.patch.object(Order, "__cache__", None):
+        yield collection
+
+
+def test_document_fields_and_defaults():
+    """Tests documents have the declared fields, with defaults for the missing ones"""
+    order = Order({"user_id": 1, "undeclared": True})
+    assert order.user_id == 1
+    assert order.status == "new"
+    assert order.tags == [] and order.tags is not Order().tags
+    assert dict(order) == {"user_id": 1, "status": "new", "tags": []}
+    assert "_id" not in order
+    assert not hasattr(order, "__dict__")
+
+
+def test_document_undeclared_attributes_raise():
+    """Tests misspelled fields raise errors instead of returning None"""
+    order = Order()
+    with pytest.raises(AttributeError):
+        order.stauts
+    with pytest.raises(AttributeError):
+        order.stauts = "paid"
+    with pytest.raises(KeyError):
+        order["stauts"] = "paid"
+    assert order.get("stauts") is None
+
+
+def test_document_dict_style_access():
+    """Tests documents can be used like Base models"""
+    order = Order(user_id=1)
+    order["status"] = "paid"
+    order.update({"tags": ["a"]})
+    assert order["status"] == "paid"
+    assert order.get("tags") == ["a"]
+    assert order == {"user_id": 1, "status": "paid", "tags": ["a"]}
+    assert order == Base({"user_id": 1, "status": "paid", "tags": ["a"]})
+    del order["tags"]
+    assert "tags" not in order
+
+
+def test_document_fields_are_inherited():
+    """Tests subclasses add fields to the ones of their base documents"""
+    class PriorityOrder(Order):
+        priority: int = 1
+
+    assert PriorityOrder.__fields__ == ("user_id", "status", "tags", "priority")
+    assert PriorityOrder({"user_id": 1}).priority == 1
+
+
+def test_document_fields_cannot_shadow_methods():
+    """Tests fields can't have the name of mapping or model methods"""
+    with pytest.raises(TypeError):
+        class Broken(Document):
+            items: list
+
+
+def test_document_reads_only_declared_fields(orders):
+    """Tests model methods fetch the declared fields only"""
+    order = Order.find_one({"user_id": 1})
+    assert isinstance(order, Order)
+    assert order.status == "paid"
+    assert "notes" not in orders.find_one({"user_id": 1}, Order.__projection__)
+    assert [o.user_id for o in Order.find({}, sort=[("user_id", 1)])] == [0, 1, 2]
+    assert [o.user_id for o in Order.iter_find({"user_id": {"$gt": 0}})] == [1, 2]
+
+
+def test_document_save_keeps_undeclared_fields(orders):
+    """Tests saving a document inserts it, then only updates the declared fields"""
+    order = Order(user_id=10)
+    order.save()
+    assert orders.find_one({"_id": order._id}, {"_id": 0}) == {"user_id": 10, "status": "new", "tags": []}
+
+    existing = Order.find_one({"user_id": 1})
+    existing.status = "shipped"
+    existing.save()
+    assert orders.find_one({"user_id": 1})["status"] == "shipped"
+    assert orders.find_one({"user_id": 1})["notes"] == "x" * 100
+
+    existing.remove()
+    assert orders.count_documents({"user_id": 1}) == 0
+    assert dict(existing) == {}
+
+
+def test_document_cache(orders):
+    """Tests cached documents are copies, updated by simple updates and invalidated by unknown fields"""
+    with mock.patch.object(Order, "__cache__", LRUCache(maxsize=10)), \
+            mock.patch.object(Order, "__cache_key__", "user_id"):
+        order = Order.find_cached(1)
+        order.status = "changed"
+        assert Order.find_cached(1).status == "paid"
+
+        Order.update_one({"user_id": 1}, {"$set": {"status": "shipped"}})
+        assert Order.__cache__.get(1).status == "shipped"
+        Order.update_one({"user_id": 1}, {"$set": {"notes": ""}})
+        assert Order.__cache__.get(1) is None
+
+
+def test_register_document_model():
+    """Tests document classes are registered like Base models"""
+    @register_model("test_documents")
+    class Registered(Document):
+        name: str
+
+    try:
+        assert MODEL_CLASSES["test_documents"] is Registered
+    finally:
+        MODEL_CLASSES.pop("test_documents")
@@ -0,0 +1,154 @@
+import mock
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from botstarter.db import users
+from botstarter.db.base import model_interceptor, InterceptorHooks, ensure_indexes
+
+
+@pytest.fixture
+def users_collection():
+    collection = mongomock.MongoClient().db.users
+    with mock.patch.object(users.User, "__collection__", collection):
+        users.configure_cache(maxsize=10, ttl=None)
+        yield collection
+
+
+def _msg(user_id):
+    msg = mock.MagicMock()
+    msg.from_user.id = user_id
+    msg.from_user.username = "username"
+    msg.from_user.first_name = "first"
+    msg.from_user.last_name = "last"
+    return msg
+
+
+def test_get_user_by_id_reads_from_cache(users_collection):
+    """Tests users are read from the database only once"""
+    users_collection.insert_one({"id": 1, "first_name": "first"})
+
+    assert users.get_user_by_id(1).first_name == "first"
+    users_collection.delete_many({})
+    assert users.get_user_by_id(1).first_name == "first"
+
+    stats = users.get_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_get_user_by_id_returns_copies(users_collection):
+    """Tests changes to a returned user object don't alter the cached document"""
+    users_collection.insert_one({"id": 1, "first_name": "first"})
+
+    users.get_user_by_id(1).first_name = "changed"
+    assert users.get_user_by_id(1).first_name == "first"
+
+
+def test_create_user_populates_cache(users_collection):
+    """Tests a newly created user is served from the cache"""
+    users.create_user(_msg(1))
+    assert users.get_user_by_id(1).username == "username"
+    assert users.get_cache_stats()["hits"] == 1
+
+
+def test_set_user_waiting_on_writes_through_cache(users_collection):
+    """Tests updates to the waiting_on field are visible to cached reads"""
+    users_collection.insert_one({"id": 1})
+    users.get_user_by_id(1)
+
+    users.set_user_waiting_on(1, "ACTION::1")
+    assert users.get_user_by_id(1).waiting_on == "ACTION::1"
+    assert users_collection.find_one({"id": 1})["waiting_on"] == "ACTION::1"
+
+
+def test_remove_user_invalidates_cache(users_collection):
+    """Tests a removed user is not returned from the cache"""
+    users.create_user(_msg(1))
+    users.get_user_by_id(1).remove()
+
+    assert users.get_user_by_id(1) is None
+
+
+def test_update_with_operators_invalidates_cache(users_collection):
+    """Tests updates that can't be applied to the cached document invalidate it"""
+    users_collection.insert_one({"id": 1, "count": 1})
+    users.get_user_by_id(1)
+
+    users.User.update_one({"id": 1}, {"$inc": {"count": 1}})
+    assert users.get_user_by_id(1).count == 2
+
+
+def test_get_or_create_user_inserts_new_user(users_collection):
+    """Tests the user is created with a single upsert on first contact"""
+    user = users.get_or_create_user(_msg(1))
+
+    assert user.id == 1
+    assert user._id is not None
+    assert user.first_name == "first"
+    assert users_collection.count_documents({"id": 1}) == 1
+
+
+def test_get_or_create_user_returns_existing_user(users_collection):
+    """Tests existing users are not modified"""
+    users_collection.insert_one({"id": 1, "first_name": "existing", "is_admin": True})
+
+    user = users.get_or_create_user(_msg(1))
+
+    assert user.first_name == "existing"
+    assert user.is_admin
+    assert users_collection.count_documents({"id": 1}) == 1
+
+
+@mock.patch.dict("botstarter.db.base.MODEL_INTERCEPTORS")
+def test_get_or_create_user_applies_create_interceptor(users_collection):
+    """Tests fields set by the SAVE_USER_CREATE interceptor are saved with new users"""
+
+    @model_interceptor(InterceptorHooks.SAVE_USER_CREATE)
+    def set_language(user, msg):
+        user["lang"] = "it"
+
+    assert users.get_or_create_user(_msg(1)).lang == "it"
+    assert users_collection.find_one({"id": 1})["lang"] == "it"
+
+
+@mock.patch.dict("botstarter.db.base.MODEL_INTERCEPTORS")
+def test_get_or_create_user_skips_create_interceptor_for_existing_users(users_collection):
+    """Tests the SAVE_USER_CREATE interceptor doesn't run for users that are not cached but exist"""
+    users_collection.insert_one({"id": 1, "first_name": "existing"})
+    interceptor = mock.MagicMock()
+    model_interceptor(InterceptorHooks.SAVE_USER_CREATE)(interceptor)
+
+    assert users.get_or_create_user(_msg(1)).first_name == "existing"
+    interceptor.assert_not_called()
+
+
+def test_get_or_create_user_reads_user_inserted_by_concurrent_upsert(users_collection):
+    """Tests the user is read again when a concurrent upsert inserted it first"""
+    def concurrent_upsert(*args, **kwargs):
+        users_collection.insert_one({"id": 1, "first_name": "concurrent"})
+        raise DuplicateKeyError("E11000 duplicate key error")
+
+    with mock.patch.object(users_collection, "find_one_and_update", side_effect=concurrent_upsert):
+        user = users.get_or_create_user(_msg(1))
+
+    assert user.first_name == "concurrent"
+    assert users.get_user_by_id(1).first_name == "concurrent"
+
+
+def test_get_or_create_user_uses_cache(users_collection):
+    """Tests cached users are returned without querying the database"""
+    users.get_or_create_user(_msg(1))
+    users_collection.delete_many({})
+
+    assert users.get_or_create_user(_msg(1)).id == 1
+    assert users_collection.count_documents({}) == 0
+
+
+def test_user_indexes_prevent_duplicate_users(users_collection):
+    """Tests the unique index on the users id prevents duplicate users"""
+    ensure_indexes(users.User)
+
+    users_collection.insert_one({"id": 1})
+    with pytest.raises(DuplicateKeyError):
+        users_collection.insert_one({"id": 1})
@@ -0,0 +1,192 @@
+import mock
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from botstarter.db import users
+from botstarter.db.base import Base
+from botstarter.db.writebehind import WriteBehindBuffer
+
+
+class Counter(Base):
+    pass
+
+
+def _collection(name):
+    collection = mongomock.MongoClient().db[name]
+
+    # mongomock doesn't support the UpdateOne operations of recent pymongo versions
+    def bulk_write(requests, ordered=True):
+        for request in requests:
+            collection.update_one(request._filter, request._doc)
+
+    collection.bulk_write = bulk_write
+    return collection
+
+
+@pytest.fixture
+def buffer():
+    collection = _collection("counters")
+    collection.insert_many([{"id": 1, "count": 0}, {"id": 2, "count": 0}])
+    # a long interval, so that tests flush explicitly
+    buffer = WriteBehindBuffer(flush_interval=60)
+    with mock.patch.object(Counter, "__collection__", collection), \
+            mock.patch.object(Counter, "__write_behind__", buffer):
+        yield buffer
+        buffer.close()
+
+
+def test_updates_are_coalesced_into_one_write(buffer):
+    """Tests updates of the same document are merged and written with a single bulk write"""
+    for _ in range(5):
+        assert Counter.update_one({"id": 1}, {"$inc": {"count": 1}}) is None
+    Counter.update_one({"id": 1}, {"$set": {"name": "one"}})
+    Counter.update_one({"id": 2}, {"$set": {"count": 10}})
+    Counter.update_one({"id": 2}, {"$inc": {"count": 1}})
+    assert buffer.pending() == 2
+    assert Counter.__collection__.find_one({"id": 1})["count"] == 0
+
+    with mock.patch.object(Counter.__collection__, "bulk_write", wraps=Counter.__collection__.bulk_write) as bulk:
+        buffer.flush()
+    bulk.assert_called_once()
+    assert buffer.pending() == 0
+    assert Counter.__collection__.find_one({"id": 1}, {"_id": 0}) == {"id": 1, "count": 5, "name": "one"}
+    assert Counter.__collection__.find_one({"id": 2})["count"] == 11
+
+
+def test_set_after_inc_overrides_it(buffer):
+    """Tests a $set buffered after an $inc of the same field replaces it"""
+    Counter.update_one({"id": 1}, {"$inc": {"count": 3}})
+    Counter.update_one({"id": 1}, {"$set": {"count": 7}})
+    buffer.flush()
+    assert Counter.__collection__.find_one({"id": 1})["count"] == 7
+
+
+def test_inc_after_set_of_a_value_that_is_not_a_number_replaces_it(buffer):
+    """Tests an $inc buffered after a $set of a non-numeric value of the same field replaces it"""
+    Counter.update_one({"id": 1}, {"$set": {"count": None}})
+    Counter.update_one({"id": 1}, {"$inc": {"count": 2}})
+
+    assert buffer._pending[Counter][(("id", 1),)].to_update() == {"$inc": {"count": 2}}
+
+
+def test_sync_and_unbufferable_updates_are_written_after_pending_ones(buffer):
+    """Tests direct writes are sent immediately, after the pending updates of the document"""
+    Counter.update_one({"id": 1}, {"$set": {"count": 1}})
+    assert Counter.update_one({"id": 1}, {"$inc": {"count": 1}}, sync=True).modified_count == 1
+    assert Counter.__collection__.find_one({"id": 1})["count"] == 2
+
+    Counter.update_one({"id": 1}, {"$set": {"count": 5}})
+    Counter.update_one({"id": 1}, {"$push": {"tags": "a"}})
+    assert Counter.__collection__.find_one({"id": 1})["count"] == 5
+    assert buffer.pending() == 0
+
+
+def test_model_reads_see_buffered_updates(buffer):
+    """Tests model reads write the pending updates of the documents first"""
+    Counter.update_one({"id": 1}, {"$inc": {"count": 2}})
+    Counter.update_one({"id": 2}, {"$inc": {"count": 2}})
+    assert Counter.find_one({"id": 1})["count"] == 2
+    assert buffer.has_pending(Counter, {"id": 2})
+    assert [c["count"] for c in Counter.find({"count": 2})] == [2, 2]
+
+
+def test_iter_find_sees_buffered_updates(buffer):
+    """Tests iter_find writes the pending updates of the documents before reading them"""
+    Counter.update_one({"id": 1}, {"$set": {"name": "first"}})
+    Counter.update_one({"id": 2}, {"$inc": {"count": 3}})
+    counters = list(Counter.iter_find(sort=[("id", 1)]))
+    assert [(c.get("name"), c["count"]) for c in counters] == [("first", 0), (None, 3)]
+    assert not buffer.has_pending(Counter, {"id": 2})
+
+
+def test_documents_read_by_id_only_write_their_own_updates(buffer):
+    """Tests reading or removing a document by _id writes its pending updates, and not the ones of other documents"""
+    counter = Counter.find_one({"id": 1})
+    Counter.update_one({"id": 1}, {"$inc": {"count": 2}})
+    Counter.update_one({"id": 2}, {"$inc": {"count": 2}})
+
+    assert Counter.get_doc(counter._id).count == 2
+    assert buffer.has_pending(Counter, {"id": 2})
+
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    counter.reload()
+    assert counter.count == 3
+
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    with mock.patch.object(Counter.__collection__, "bulk_write", wraps=Counter.__collection__.bulk_write) as bulk:
+        counter.remove()
+    assert [r._filter for r in bulk.call_args.args[0]] == [{"id": 1}]
+    assert buffer.has_pending(Counter, {"id": 2})
+
+
+def test_buffered_updates_are_applied_to_the_cache():
+    """Tests cached documents see buffered $set and $inc updates"""
+    collection = _collection("users")
+    collection.insert_one({"id": 1, "messages": 1})
+    buffer = WriteBehindBuffer(flush_interval=60)
+    with mock.patch.object(users.User, "__collection__", collection), \
+            mock.patch.object(users.User, "__write_behind__", buffer):
+        users.configure_cache(maxsize=10, ttl=None)
+        users.get_user_by_id(1)
+        users.User.update_one({"id": 1}, {"$inc": {"messages": 1}, "$set": {"waiting_on": "ACT"}})
+        with mock.patch.object(collection, "find_one") as find_mock:
+            user = users.get_user_by_id(1)
+        find_mock.assert_not_called()
+        assert (user.messages, user.waiting_on) == (2, "ACT")
+        buffer.close()
+    assert collection.find_one({"id": 1})["messages"] == 2
+
+
+def test_failed_flush_keeps_updates(buffer):
+    """Tests updates are kept for the next flush when the database is unreachable"""
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    with mock.patch.object(Counter.__collection__, "bulk_write", side_effect=AutoReconnect()):
+        buffer.flush()
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    buffer.flush()
+    assert Counter.__collection__.find_one({"id": 1})["count"] == 2
+
+
+def test_rejected_updates_are_retried_then_dropped(buffer):
+    """Tests updates rejected by the database are kept for the next flushes, up to the maximum number of failures"""
+    buffer.max_write_failures = 2
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    Counter.update_one({"id": 2}, {"$inc": {"count": 1}})
+    bulk_write = Counter.__collection__.bulk_write
+
+    def reject_second_counter(requests, ordered=True):
+        bulk_write([r for r in requests if r._filter != {"id": 2}])
+        raise BulkWriteError({"writeErrors": [
+            {"index": i, "code": 121, "errmsg": "Document failed validation"}
+            for i, r in enumerate(requests) if r._filter == {"id": 2}
+        ]})
+
+    with mock.patch.object(Counter.__collection__, "bulk_write", side_effect=reject_second_counter):
+        buffer.flush()
+        assert buffer.pending() == 1
+        assert buffer.has_pending(Counter, {"id": 2})
+
+        buffer.flush()
+        assert buffer.pending() == 0
+    assert [c["count"] for c in Counter.__collection__.find(sort=[("id", 1)])] == [1, 0]
+
+
+def test_background_thread_flushes_on_size_threshold(buffer):
+    """Tests the background thread writes the updates once enough documents have pending updates"""
+    buffer.max_pending = 2
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    Counter.update_one({"id": 2}, {"$inc": {"count": 1}})
+    for _ in range(100):
+        if buffer.pending() == 0:
+            break
+        buffer._thread.join(0.01)
+    assert Counter.__collection__.count_documents({"count": 1}) == 2
+
+
+def test_close_writes_pending_updates(buffer):
+    """Tests closing the buffer writes the pending updates, and later updates are written immediately"""
+    Counter.update_one({"id": 1}, {"$inc": {"count": 1}})
+    buffer.close()
+    assert Counter.__collection__.find_one({"id": 1})["count"] == 1
+    assert Counter.update_one({"id": 1}, {"$inc": {"count": 1}}) is not None
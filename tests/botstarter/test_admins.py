@@ -0,0 +1,111 @@
+import mock
+import mongomock
+import pytest
+from pymongo.errors import PyMongoError
+
+from botstarter import admins
+from botstarter.admins import AdminRegistry
+from botstarter.db import users
+
+
+@pytest.fixture
+def users_collection():
+    collection = mongomock.MongoClient().db.users
+    collection.insert_many([{"id": 1, "is_admin": True}, {"id": 2, "is_admin": False}, {"id": 3}])
+    with mock.patch.object(users.User, "__collection__", collection):
+        users.configure_cache(maxsize=10, ttl=None)
+        yield collection
+        admins.init_registry()
+
+
+def test_registry_loads_admin_ids_once(users_collection):
+    """Tests admin checks are answered from memory after the first load"""
+    registry = AdminRegistry()
+    with mock.patch.object(registry, "load", wraps=registry.load) as load_mock:
+        assert registry.is_admin(1)
+        assert not registry.is_admin(2)
+        assert not registry.is_admin(3)
+        assert not registry.is_admin(4)
+    load_mock.assert_called_once()
+    assert registry.get_admins() == frozenset({1})
+
+
+def test_registry_loads_admin_ids_on_start(users_collection):
+    """Tests the admin set is loaded when the registry is started, so that the first check doesn't read it"""
+    registry = AdminRegistry()
+    with mock.patch.object(registry, "load", wraps=registry.load) as load_mock:
+        registry.start()
+        assert registry.is_admin(1)
+    load_mock.assert_called_once()
+    registry.stop()
+
+
+def test_registry_loads_admin_ids_on_first_check_if_start_failed(users_collection):
+    """Tests the admin set is loaded by the first check when it could not be loaded on start"""
+    registry = AdminRegistry()
+    with mock.patch.object(users_collection, "find", side_effect=PyMongoError("unreachable")):
+        registry.start()
+        registry._thread.join()
+    assert registry.is_admin(1)
+    registry.stop()
+
+
+def test_registry_reloads_after_refresh_interval(users_collection):
+    """Tests the admin set is reloaded once it's older than the refresh interval"""
+    registry = AdminRegistry(refresh_interval=0)
+    assert not registry.is_admin(2)
+    users_collection.update_one({"id": 2}, {"$set": {"is_admin": True}})
+    assert registry.is_admin(2)
+
+
+def test_registry_without_refresh_interval_only_reloads_when_invalidated(users_collection):
+    """Tests the admin set is kept until invalidated when there is no refresh interval"""
+    registry = AdminRegistry(refresh_interval=None)
+    assert not registry.is_admin(2)
+    users_collection.update_one({"id": 2}, {"$set": {"is_admin": True}})
+    assert not registry.is_admin(2)
+    registry.invalidate()
+    assert registry.is_admin(2)
+
+
+def test_set_admin_invalidates_global_registry(users_collection):
+    """Tests granting and revoking the admin role is visible to the next check"""
+    admins.init_registry(refresh_interval=None)
+    assert not admins.is_admin(2)
+    users.set_admin(2)
+    assert admins.is_admin(2)
+    users.set_admin(1, is_admin=False)
+    assert not admins.is_admin(1)
+    assert users.get_user_by_id(1).is_admin is False
+
+
+def test_registry_invalidated_while_loading_is_reloaded(users_collection):
+    """Tests an invalidation received while the admin set is read is not overwritten by the load"""
+    registry = AdminRegistry(refresh_interval=None)
+    find = users_collection.find
+
+    def find_and_change(*args, **kwargs):
+        docs = list(find(*args, **kwargs))
+        # the change is made after the set was read
+        users_collection.update_one({"id": 2}, {"$set": {"is_admin": True}})
+        registry.invalidate()
+        return docs
+
+    with mock.patch.object(users_collection, "find", side_effect=find_and_change):
+        assert not registry.is_admin(2)
+    assert registry.is_admin(2)
+
+
+def test_registry_watches_admin_role_removal(users_collection):
+    """Tests the change stream matches updates that remove the is_admin field"""
+    registry = AdminRegistry(watch=True)
+
+    def watch(pipeline, **kwargs):
+        registry.stop()
+        raise PyMongoError("not a replica set")
+
+    with mock.patch.object(users_collection, "watch", side_effect=watch, create=True) as watch_mock:
+        registry._watch()
+
+    conditions = watch_mock.call_args.args[0][0]["$match"]["$or"]
+    assert {"updateDescription.removedFields": "is_admin"} in conditions
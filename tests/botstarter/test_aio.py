@@ -0,0 +1,139 @@
+import asyncio
+
+import aiohttp
+import mock
+import pytest
+
+from botstarter import aio
+from botstarter.db.users import User
+
+
+class _FakeAsyncBot:
+    """Collects the handlers registered by the botstarter.aio decorators"""
+
+    def __init__(self):
+        self.parse_mode = "MarkdownV2"
+        self.message_handlers = []
+        self.callback_handlers = []
+        self.send_message = mock.AsyncMock()
+        self.send_message.__name__ = "send_message"
+        self.get_chat = mock.AsyncMock()
+        self.get_chat.__name__ = "get_chat"
+
+    def message_handler(self, *args, **kwargs):
+        def wrapper(func):
+            self.message_handlers.append(func)
+            return func
+
+        return wrapper
+
+    def callback_query_handler(self, func=None, **kwargs):
+        def wrapper(handler):
+            self.callback_handlers.append((func, handler))
+            return handler
+
+        return wrapper
+
+
+@pytest.fixture
+def fake_bot():
+    bot = _FakeAsyncBot()
+    with mock.patch("botstarter.aio.__bot", bot):
+        yield bot
+
+
+def _msg(user_id=1):
+    msg = mock.MagicMock()
+    msg.from_user.id = user_id
+    msg.from_user.is_bot = False
+    return msg
+
+
+def test_get_bot_should_raise_error_not_initialized():
+    """Tests raises runtime error if bot was not initialized"""
+    aio.__bot = None
+    with pytest.raises(RuntimeError):
+        aio.get_bot()
+
+
+@mock.patch("botstarter.aio.db")
+def test_user_handler_creates_new_user(db_mock, fake_bot):
+    """Tests the user_handler gets or creates the user and passes it to the handler"""
+    user = User({"id": 1})
+    db_mock.get_or_create_user = mock.AsyncMock(return_value=user)
+    handler = mock.AsyncMock()
+
+    aio.user_handler(commands=["start"])(handler)
+    asyncio.run(fake_bot.message_handlers[0](_msg()))
+
+    db_mock.get_or_create_user.assert_awaited_once()
+    handler.assert_awaited_once()
+    assert handler.await_args.args[1] is user
+
+
+@mock.patch("botstarter.aio.db")
+def test_user_handler_reads_waiting_on_action(db_mock, fake_bot):
+    """Tests the user_handler unpacks the waiting_on action and clears it"""
+    db_mock.get_or_create_user = mock.AsyncMock(return_value=User({"id": 1, "waiting_on": "ACTION::p1"}))
+    db_mock.set_user_waiting_on = mock.AsyncMock()
+    handler = mock.AsyncMock()
+
+    aio.user_handler(commands=["start"])(handler)
+    asyncio.run(fake_bot.message_handlers[0](_msg()))
+
+    assert handler.await_args.kwargs == {"action_name": "ACTION", "action_params": ["p1"]}
+    db_mock.set_user_waiting_on.assert_awaited_once_with(1, waiting_on=None)
+
+
+@mock.patch("botstarter.aio.db")
+def test_user_handler_reads_waiting_on_state_with_data(db_mock, fake_bot):
+    """Tests the user_handler reads states saved with data or a ttl by the state store of botstarter.bot"""
+    waiting_on = {"action": "ACTION", "params": ["p1"], "data": {"items": [1]}, "expires_at": None}
+    db_mock.get_or_create_user = mock.AsyncMock(return_value=User({"id": 1, "waiting_on": waiting_on}))
+    db_mock.set_user_waiting_on = mock.AsyncMock()
+    handler = mock.AsyncMock()
+
+    aio.user_handler(commands=["start"])(handler)
+    asyncio.run(fake_bot.message_handlers[0](_msg()))
+
+    assert handler.await_args.kwargs == {
+        "action_name": "ACTION",
+        "action_params": ["p1"],
+        "action_data": {"items": [1]}
+    }
+    db_mock.set_user_waiting_on.assert_awaited_once_with(1, waiting_on=None)
+
+
+def test_send_message_is_not_retried_on_timeout(fake_bot):
+    """Tests send_message is not retried when the request timed out, since the message may have been sent"""
+    fake_bot.send_message.side_effect = [asyncio.TimeoutError(), "sent"]
+
+    with mock.patch("botstarter.aio.asyncio.sleep", new=mock.AsyncMock()):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(aio.send_message(1, "hello", timeout=10))
+
+    assert fake_bot.send_message.await_count == 1
+
+
+def test_send_message_retries_when_not_sent(fake_bot):
+    """Tests send_message retries with an increased timeout when the connection could not be established"""
+    timeout = aio.RequestTimeout("Request timeout")
+    timeout.__cause__ = aiohttp.ClientConnectorError(mock.MagicMock(), OSError("Connection refused"))
+    fake_bot.send_message.side_effect = [timeout, "sent"]
+
+    with mock.patch("botstarter.aio.asyncio.sleep", new=mock.AsyncMock()):
+        result = asyncio.run(aio.send_message(1, "hello", timeout=10))
+
+    assert result == "sent"
+    assert fake_bot.send_message.await_args.kwargs["timeout"] == 10 + aio.RETRY_TIMEOUT_INCREASE
+
+
+def test_get_methods_are_retried_on_timeout(fake_bot):
+    """Tests the methods reading data are retried when the request times out"""
+    fake_bot.get_chat.side_effect = [asyncio.TimeoutError(), "chat"]
+
+    with mock.patch("botstarter.aio.asyncio.sleep", new=mock.AsyncMock()):
+        result = asyncio.run(aio.__wrap_call(fake_bot.get_chat, chat_id=1, timeout=10))
+
+    assert result == "chat"
+    assert fake_bot.get_chat.await_count == 2
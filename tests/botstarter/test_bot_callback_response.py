@@ -0,0 +1,110 @@
+import mock
+import pytest
+import telebot
+from telebot import types
+
+from botstarter import bot
+
+
+@pytest.fixture
+def test_bot():
+    test_bot = telebot.TeleBot("123:TEST", threaded=False)
+    with mock.patch("botstarter.bot.__bot", test_bot), \
+            mock.patch.dict(bot.ALL_CALLBACK_ACTIONS, clear=True), \
+            mock.patch("botstarter.bot.answer_callback_query"), \
+            mock.patch("botstarter.bot.delete_message"), \
+            mock.patch("botstarter.bot.users") as users_mock, \
+            mock.patch("botstarter.bot.admins") as admins_mock:
+        test_bot.users_mock = users_mock
+        test_bot.admins_mock = admins_mock
+        yield test_bot
+
+
+def _callback_update(data, user_id=1):
+    return types.Update.de_json({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1",
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "test"},
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "hello"
+            }
+        }
+    })
+
+
+def test_callback_response_routes_by_action_name(test_bot):
+    """Tests callback queries are routed to the handler of the exact action name"""
+    act, act_long = mock.MagicMock(), mock.MagicMock()
+    bot.callback_response("ACT")(act)
+    bot.callback_response("ACT_LONG")(act_long)
+
+    test_bot.process_new_updates([_callback_update("ACT_LONG::1::2")])
+
+    act.assert_not_called()
+    act_long.assert_called_once()
+    assert act_long.call_args.args[2] == ["1", "2"]
+
+
+def test_callback_response_routes_actions_without_params(test_bot):
+    """Tests callback queries with no parameters are routed to the action handler"""
+    act = mock.MagicMock()
+    bot.callback_response("ACT")(act)
+
+    test_bot.process_new_updates([_callback_update("ACT")])
+
+    act.assert_called_once()
+    assert act.call_args.args[2] == []
+
+
+def test_callback_response_registers_a_single_telebot_handler(test_bot):
+    """Tests a single callback query handler is registered with telebot for all actions"""
+    for i in range(10):
+        bot.callback_response(f"ACT{i}")(mock.MagicMock())
+
+    assert len(test_bot.callback_query_handlers) == 1
+
+
+def test_callback_response_ignores_unknown_actions(test_bot):
+    """Tests callback queries for unregistered actions are not handled"""
+    act = mock.MagicMock()
+    bot.callback_response("ACT")(act)
+
+    test_bot.process_new_updates([_callback_update("OTHER::1")])
+
+    act.assert_not_called()
+
+
+def test_callback_response_admin_only_denied(test_bot):
+    """Tests admin-only callback handlers are not run for non-admin users"""
+    test_bot.admins_mock.is_admin.return_value = False
+    act = mock.MagicMock()
+    bot.callback_response("ACT", admin_only=True)(act)
+
+    test_bot.process_new_updates([_callback_update("ACT::1")])
+
+    act.assert_not_called()
+    bot.delete_message.assert_called_once()
+
+
+def test_callback_response_admin_only_granted(test_bot):
+    """Tests admin-only callback handlers are run for admins"""
+    test_bot.admins_mock.is_admin.return_value = True
+    act = mock.MagicMock()
+    bot.callback_response("ACT", admin_only=True)(act)
+
+    test_bot.process_new_updates([_callback_update("ACT::1")])
+
+    act.assert_called_once()
+    test_bot.admins_mock.is_admin.assert_called_once_with(1)
+
+
+def test_callback_response_should_fail_if_separator_in_action_name():
+    """Tests a ValueError is raised if the action name contains the separator"""
+    with pytest.raises(ValueError):
+        bot.callback_response("ACT::ION")
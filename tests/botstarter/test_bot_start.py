@@ -1,4 +1,6 @@
 import os
+import subprocess
+import sys
 
 import mock
 import pytest
@@ -31,3 +33,12 @@ def test_init_bot_should_fail_if_no_token():
 
     with pytest.raises(ValueError):
         bot.init_bot()
+
+
+def test_import_bot_does_not_import_telebot():
+    """Tests telebot and requests are only imported when the bot is initialized"""
+    script = "import sys, botstarter.bot; print(sorted(m for m in ('telebot', 'requests') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)})
+
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,83 @@
+import mock
+import mongomock
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from botstarter import broadcast
+from botstarter.db.broadcasts import Broadcast
+from botstarter.db.users import User
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    with mock.patch.object(User, "__collection__", db.users), \
+            mock.patch.object(Broadcast, "__collection__", db.broadcasts):
+        db.users.insert_many([{"id": i, "first_name": f"user{i}", "lang": "en" if i % 2 else "it"}
+                              for i in range(1, 11)])
+        yield db
+
+
+def _blocked():
+    return ApiTelegramException("sendMessage", None, {"ok": False, "error_code": 403, "description": "Forbidden"})
+
+
+@mock.patch("botstarter.broadcast.bot.send_message")
+def test_broadcast_text_to_all_users(send_message, db):
+    """Tests a text is sent to every user and the broadcast is marked completed"""
+    report = broadcast.broadcast("hello", batch_size=3, concurrency=2)
+
+    assert report.delivered == 10
+    assert report.completed
+    assert sorted(c.args[0] for c in send_message.call_args_list) == list(range(1, 11))
+    assert db.broadcasts.find_one({"_id": report.broadcast_id})["completed"]
+
+
+@mock.patch("botstarter.broadcast.bot.send_message")
+def test_broadcast_with_filter_and_factory(send_message, db):
+    """Tests the factory is called with each user matching the filter"""
+    report = broadcast.broadcast(lambda user: f"ciao {user.first_name}", filter={"lang": "it"})
+
+    assert report.delivered == 5
+    assert {c.args[1] for c in send_message.call_args_list} == {f"ciao user{i}" for i in range(2, 11, 2)}
+
+
+@mock.patch("botstarter.broadcast.bot.send_message")
+def test_broadcast_counts_blocked_and_failed(send_message, db):
+    """Tests blocked and failed deliveries are reported"""
+
+    def send(chat_id, text, **kwargs):
+        if chat_id == 1:
+            raise _blocked()
+        if chat_id == 2:
+            raise RuntimeError("network error")
+
+    send_message.side_effect = send
+    report = broadcast.broadcast("hello")
+
+    assert (report.delivered, report.blocked, report.failed) == (8, 1, 1)
+
+
+@mock.patch("botstarter.broadcast.bot.send_message")
+def test_broadcast_resumes_from_checkpoint(send_message, db):
+    """Tests an interrupted broadcast resumes after the last completed batch"""
+    sent = []
+
+    def send(chat_id, text, **kwargs):
+        if chat_id == 7:
+            raise KeyboardInterrupt()
+        sent.append(chat_id)
+
+    send_message.side_effect = send
+    with pytest.raises(KeyboardInterrupt):
+        broadcast.broadcast("hello", broadcast_id="b1", batch_size=3, concurrency=1)
+    checkpoint = db.broadcasts.find_one({"_id": "b1"})
+    assert checkpoint["last_user_oid"] == db.users.find_one({"id": 6})["_id"]
+    assert not checkpoint["completed"]
+
+    send_message.side_effect = None
+    report = broadcast.broadcast("hello", broadcast_id="b1", batch_size=3)
+
+    assert sorted(c.args[0] for c in send_message.call_args_list[-4:]) == [7, 8, 9, 10]
+    assert report.delivered == 10
+    assert report.completed
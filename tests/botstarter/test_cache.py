@@ -0,0 +1,85 @@
+import mock
+import pytest
+
+from botstarter.cache import LRUCache
+
+
+def test_cache_get_put():
+    """Tests cached values are returned and hits and misses are counted"""
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_should_evict_least_recently_used():
+    """Tests the least recently used entry is evicted when the cache is full"""
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+@mock.patch("botstarter.cache.monotonic")
+def test_cache_entries_should_expire(monotonic_mock):
+    """Tests entries older than the time-to-live are not returned"""
+    monotonic_mock.return_value = 100
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.put("a", 1)
+
+    monotonic_mock.return_value = 105
+    assert cache.get("a") == 1
+    monotonic_mock.return_value = 111
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cache_update_fields_in_place():
+    """Tests the fields of a cached dict can be updated without replacing the entry"""
+    cache = LRUCache()
+    cache.put("a", {"x": 1, "y": 2})
+
+    assert cache.update("a", {"y": 3})
+    assert not cache.update("b", {"y": 3})
+    assert cache.get("a") == {"x": 1, "y": 3}
+
+
+def test_cache_put_reserved_skips_values_invalidated_while_read():
+    """Tests a value read after reserving its key is not cached if the key was invalidated in the meantime"""
+    cache = LRUCache()
+    token = cache.reserve("a")
+    assert cache.put_reserved("a", 1, token)
+    assert cache.get("a") == 1
+
+    token = cache.reserve("b")
+    cache.invalidate("b")
+    assert not cache.put_reserved("b", 1, token)
+    assert cache.get("b") is None
+
+    token = cache.reserve("c")
+    cache.update("c", {"x": 1})
+    assert not cache.put_reserved("c", {"x": 0}, token)
+    assert cache.get("c") is None
+
+
+def test_cache_with_zero_size_stores_nothing():
+    """Tests a cache with size 0 is disabled"""
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_cache_should_fail_with_negative_size():
+    """Tests a ValueError is raised if the cache size is negative"""
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=-1)
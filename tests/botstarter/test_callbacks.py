@@ -0,0 +1,137 @@
+import fakeredis
+import mock
+import mongomock
+import pytest
+import telebot
+from bson import ObjectId
+from telebot import types
+
+from botstarter import bot, util
+from botstarter.callbacks import CallbackCodec, MemoryOverflowStore, MongoOverflowStore, RedisOverflowStore, \
+    MAX_CALLBACK_DATA_SIZE
+
+
+@pytest.mark.parametrize("params", [
+    [],
+    [0, 1, -1, 127, 128, -129, 2 ** 70, -2 ** 70],
+    ["", "hello", "::", "caffè ☕"],
+    [b"", b"\x00\xff"],
+    [None, True, False],
+    [ObjectId(), 42, "x"]
+])
+def test_codec_round_trip(params):
+    """Tests packed parameters are unpacked with the same values and types"""
+    codec = CallbackCodec(actions={"ACT": 1})
+    data = codec.pack("ACT", params)
+    assert codec.is_compact(data)
+    assert codec.unpack(data) == ("ACT", params)
+
+
+def test_codec_is_shorter_than_legacy_packing():
+    """Tests compact callback data fits ids that legacy callback data can't"""
+    codec = CallbackCodec(actions={"ORDER_DETAILS": 1})
+    params = [ObjectId(), ObjectId(), 1234567]
+    legacy = util.pack_callback_data("ORDER_DETAILS", [str(p) for p in params], "::")
+    data = codec.pack("ORDER_DETAILS", params)
+    assert len(legacy) > MAX_CALLBACK_DATA_SIZE
+    assert len(data) <= MAX_CALLBACK_DATA_SIZE
+
+
+def test_codec_unpacks_legacy_callback_data():
+    """Tests callback data packed by util.pack_callback_data is still unpacked"""
+    codec = CallbackCodec()
+    legacy = util.pack_callback_data("ACT", ["1", "a::b"], "::")
+    assert not codec.is_compact(legacy)
+    assert codec.unpack(legacy) == util.unpack_callback_data(legacy, "::")
+
+
+def test_codec_derives_stable_action_ids():
+    """Tests actions without an explicit id are unpacked by another codec instance"""
+    data = CallbackCodec().pack("SOME_ACTION", [1])
+    codec = CallbackCodec()
+    codec.register("SOME_ACTION")
+    assert codec.unpack(data) == ("SOME_ACTION", [1])
+
+
+def test_codec_rejects_duplicate_action_ids():
+    """Tests two actions can't share an id"""
+    with pytest.raises(ValueError):
+        CallbackCodec(actions={"A": 1, "B": 1})
+
+
+def test_codec_rejects_unknown_and_invalid_data():
+    """Tests unknown action ids and truncated data raise ValueError"""
+    data = CallbackCodec(actions={"A": 1}).pack("A", ["hello"])
+    with pytest.raises(ValueError):
+        CallbackCodec(actions={"B": 2}).unpack(data)
+    with pytest.raises(ValueError):
+        CallbackCodec(actions={"A": 1}).unpack(data[:-3])
+
+
+def test_codec_fails_on_long_data_without_overflow_store():
+    """Tests packing data over the Telegram limit raises ValueError"""
+    with pytest.raises(ValueError):
+        CallbackCodec().pack("A", ["x" * 100])
+
+
+@pytest.fixture(params=["memory", "mongo", "redis"])
+def overflow_store(request):
+    if request.param == "memory":
+        yield MemoryOverflowStore()
+    elif request.param == "mongo":
+        with mock.patch("botstarter.db.base.get_db", return_value=mongomock.MongoClient().db):
+            yield MongoOverflowStore()
+    else:
+        yield RedisOverflowStore(client=fakeredis.FakeRedis())
+
+
+def test_codec_stores_long_data_server_side(overflow_store):
+    """Tests data over the Telegram limit is stored under a short key"""
+    codec = CallbackCodec(actions={"A": 1}, overflow_store=overflow_store)
+    params = ["x" * 100, 7]
+    data = codec.pack("A", params)
+    assert len(data) <= MAX_CALLBACK_DATA_SIZE
+    assert codec.pack("A", params) == data
+    assert codec.unpack(data) == ("A", params)
+
+
+def test_codec_rejects_expired_overflow_data():
+    """Tests overflow keys that are no longer stored raise ValueError"""
+    codec = CallbackCodec(actions={"A": 1}, overflow_store=MemoryOverflowStore(ttl=-1))
+    data = codec.pack("A", ["x" * 100])
+    with pytest.raises(ValueError):
+        codec.unpack(data)
+
+
+def _callback_update(data):
+    return types.Update.de_json({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1",
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": 1, "is_bot": False, "first_name": "test"},
+            "message": {"message_id": 1, "date": 1, "chat": {"id": 1, "type": "private"}, "text": "hello"}
+        }
+    })
+
+
+def test_callback_router_unpacks_compact_and_legacy_data():
+    """Tests callback_response handlers receive both compact and legacy callback data"""
+    test_bot = telebot.TeleBot("123:TEST", threaded=False)
+    codec = CallbackCodec(actions={"ACT": 1})
+    handler = mock.MagicMock()
+    with mock.patch("botstarter.bot.__bot", test_bot), \
+            mock.patch("botstarter.bot.__callback_codec", codec), \
+            mock.patch.dict(bot.ALL_CALLBACK_ACTIONS, clear=True), \
+            mock.patch("botstarter.bot.answer_callback_query") as answer_mock, \
+            mock.patch("botstarter.bot.users"):
+        bot.callback_response("ACT")(handler)
+        button = bot.gen_inline_keyboard_btn("ACT", "label", 42, "a")
+
+        test_bot.process_new_updates([_callback_update(button.callback_data)])
+        test_bot.process_new_updates([_callback_update("ACT::42::a")])
+        test_bot.process_new_updates([_callback_update(",expired")])
+
+    assert [c.args[2] for c in handler.call_args_list] == [[42, "a"], ["42", "a"]]
+    assert answer_mock.call_count == 3
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from botstarter import cluster
+from botstarter.cluster import Cluster, MultiprocessingUpdateQueue, partition_of
+
+_ctx = multiprocessing.get_context("fork")
+_results = None
+
+
+def _message_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "test"},
+            "text": str(update_id)
+        }
+    }
+
+
+def _setup():
+    from botstarter import bot
+    bot.init_bot(token="123:TEST", db_opts={"create_indexes": False}, workers=2)
+
+    @bot.get_bot().message_handler(func=lambda m: True)
+    def record(message):
+        # a little work, so that updates of different chats overlap
+        time.sleep(0.001)
+        _results.put((message.chat.id, int(message.text), os.getpid()))
+
+
+def test_partition_of_is_stable_by_chat():
+    """Tests updates of the same chat always have the same partition"""
+    assert partition_of(_message_update(1, 42), 4) == partition_of(_message_update(2, 42), 4) == 42 % 4
+    assert partition_of({"update_id": 7}, 4) == 7 % 4
+
+
+def test_cluster_should_fail_with_more_workers_than_partitions():
+    """Tests the local workers must not exceed the queue partitions"""
+    with pytest.raises(ValueError):
+        Cluster(_setup, workers=3, queue=MultiprocessingUpdateQueue(2, mp_context=_ctx), mp_context="fork")
+    with pytest.raises(ValueError):
+        Cluster(_setup, workers=0, mp_context="fork")
+
+
+def test_cluster_preserves_order_within_chat():
+    """Tests updates are processed by several processes, in order within each chat and always by the same process"""
+    global _results
+    _results = _ctx.Queue()
+
+    c = Cluster(_setup, workers=3, mp_context="fork")
+    c.start()
+    chats = [100 + i for i in range(9)]
+    total = 0
+    for update_id in range(1, 181):
+        c.submit(_message_update(update_id, chats[update_id % len(chats)]))
+        total += 1
+    c.shutdown(timeout=30)
+
+    records = [_results.get(timeout=10) for _ in range(total)]
+    by_chat = {}
+    for chat_id, update_id, pid in records:
+        by_chat.setdefault(chat_id, []).append((update_id, pid))
+
+    assert set(by_chat) == set(chats)
+    for chat_id, processed in by_chat.items():
+        update_ids = [u for u, _ in processed]
+        assert update_ids == sorted(update_ids)
+        assert len({pid for _, pid in processed}) == 1
+    assert len({pid for _, _, pid in records}) == 3
+    assert os.getpid() not in {pid for _, _, pid in records}
+
+
+def test_cluster_module_exports_start_cluster():
+    """Tests start_cluster requires a bot token"""
+    os.environ.pop("BOT_TOKEN", None)
+    with pytest.raises(ValueError):
+        cluster.start_cluster(_setup, workers=1)
@@ -0,0 +1,127 @@
+import queue
+import threading
+
+import pytest
+from telebot import types
+
+from botstarter.dispatch import UpdateDispatcher, chat_id_of, raw_chat_id_of
+
+
+def _message_update(update_id, chat_id, text="hello"):
+    return types.Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "test"},
+            "text": text
+        }
+    })
+
+
+def test_chat_id_of_message_update():
+    """Tests the chat id is extracted from message updates"""
+    assert chat_id_of(_message_update(1, 42)) == 42
+
+
+def test_chat_id_of_callback_query_update():
+    """Tests the chat id is extracted from the message attached to callback queries"""
+    update = types.Update.de_json({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1",
+            "chat_instance": "1",
+            "data": "ACTION",
+            "from": {"id": 7, "is_bot": False, "first_name": "test"},
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": 42, "type": "private"},
+                "text": "hello"
+            }
+        }
+    })
+    assert chat_id_of(update) == 42
+
+
+def test_raw_chat_id_of_json_updates():
+    """Tests the chat id is extracted from JSON updates like from parsed updates"""
+    message = _message_update(1, 42)
+    assert raw_chat_id_of({"update_id": 1, "message": {"chat": {"id": 42}}}) == chat_id_of(message)
+    assert raw_chat_id_of({"update_id": 1, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 42}}}}) == 42
+    assert raw_chat_id_of({"update_id": 1, "callback_query": {"from": {"id": 7}}}) == 7
+    assert raw_chat_id_of({"update_id": 1, "chat_member": {"chat": {"id": -100}}}) == -100
+    assert raw_chat_id_of({"update_id": 1, "poll_answer": {"user": {"id": 9}}}) == 9
+    assert raw_chat_id_of({"update_id": 1}) is None
+
+
+def test_dispatcher_should_fail_with_no_workers():
+    """Tests a ValueError is raised if the dispatcher is created with no workers"""
+    with pytest.raises(ValueError):
+        UpdateDispatcher(lambda updates: None, workers=0)
+
+
+def test_dispatcher_preserves_order_within_chat():
+    """Tests updates for the same chat are processed in the order they were submitted"""
+    processed = {}
+    lock = threading.Lock()
+
+    def process(updates):
+        for u in updates:
+            with lock:
+                processed.setdefault(u.message.chat.id, []).append(u.update_id)
+
+    dispatcher = UpdateDispatcher(process, workers=4, max_queue_size=10)
+    dispatcher.start()
+    for i in range(100):
+        dispatcher.submit(_message_update(i, chat_id=i % 5))
+    dispatcher.shutdown()
+
+    for chat_id in range(5):
+        assert processed[chat_id] == list(range(chat_id, 100, 5))
+
+
+def test_dispatcher_processes_chats_in_parallel():
+    """Tests a slow update for a chat does not stall updates for other chats"""
+    release = threading.Event()
+    done = threading.Event()
+
+    def process(updates):
+        u = updates[0]
+        if u.message.chat.id == 0:
+            release.wait(5)
+        else:
+            done.set()
+
+    dispatcher = UpdateDispatcher(process, workers=2)
+    dispatcher.start()
+    dispatcher.submit(_message_update(1, chat_id=0))
+    dispatcher.submit(_message_update(2, chat_id=1))
+
+    assert done.wait(5), "Update for chat 1 was blocked by the slow update for chat 0"
+    release.set()
+    dispatcher.shutdown()
+
+
+def test_dispatcher_applies_backpressure_when_queue_is_full():
+    """Tests submit blocks, and eventually fails with a timeout, when a worker queue is full"""
+    release = threading.Event()
+    dispatcher = UpdateDispatcher(lambda updates: release.wait(5), workers=1, max_queue_size=2,
+                                  submit_timeout=0.05)
+    dispatcher.start()
+
+    dispatcher.submit(_message_update(1, chat_id=1))
+    # wait for the worker to pick up the first update
+    while dispatcher.queue_depth > 0:
+        pass
+    dispatcher.submit(_message_update(2, chat_id=1))
+    dispatcher.submit(_message_update(3, chat_id=1))
+    assert dispatcher.queue_depth == 2
+
+    with pytest.raises(queue.Full):
+        dispatcher.submit(_message_update(4, chat_id=1))
+
+    release.set()
+    dispatcher.shutdown()
+    assert dispatcher.queue_depth == 0
@@ -0,0 +1,222 @@
+import os
+import signal
+import threading
+
+import mock
+import mongomock
+import pytest
+import telebot
+from telebot import types
+
+from botstarter import bot
+from botstarter.db import users
+from botstarter.dispatch import UpdateDispatcher
+from botstarter.lifecycle import Lifecycle, OffsetCheckpoint, OffsetTracker
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    with mock.patch.object(users.User, "__collection__", db.users), \
+            mock.patch("botstarter.db.base.get_db", return_value=db):
+        users.configure_cache(maxsize=10, ttl=None)
+        yield db
+
+
+def _message_update(update_id, chat_id):
+    return types.Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "test"},
+            "text": "hello"
+        }
+    })
+
+
+def test_offset_tracker_checkpoint_with_updates_processed_out_of_order():
+    """Tests the checkpoint offset stops at the first update not processed"""
+    tracker = OffsetTracker(offset=10)
+    for update_id in range(11, 16):
+        assert tracker.received(update_id)
+
+    tracker.processed(11)
+    tracker.processed(13)
+    tracker.processed(15)
+    assert tracker.checkpoint() == (11, [13, 15])
+    assert tracker.in_flight == 2
+
+    tracker.processed(12)
+    tracker.processed(14)
+    assert tracker.checkpoint() == (15, [])
+
+
+def test_offset_tracker_skips_processed_updates():
+    """Tests updates processed before a checkpoint are not received again"""
+    tracker = OffsetTracker()
+    tracker.reset(offset=10, processed=[8, 12])
+
+    assert not tracker.received(9)
+    assert tracker.received(11)
+    assert not tracker.received(12)
+    assert tracker.received(13)
+
+
+def test_offset_tracker_does_not_skip_updates_not_received():
+    """Tests the offset does not move past a checkpoint update not received yet"""
+    tracker = OffsetTracker(offset=100, processed=[103])
+
+    assert tracker.received(101)
+    tracker.processed(101)
+    assert tracker.checkpoint() == (101, [103])
+
+    assert tracker.received(102)
+    assert not tracker.received(103)
+    tracker.processed(102)
+    assert tracker.checkpoint() == (103, [])
+    assert tracker.received(104)
+
+
+def test_offset_checkpoint_saves_and_loads_offset(db):
+    """Tests checkpoints are saved by bot id"""
+    checkpoint = OffsetCheckpoint()
+    assert checkpoint.load("123") is None
+
+    checkpoint.save("123", 42, [44, 45])
+    checkpoint.save("456", 7)
+
+    assert checkpoint.load("123") == (42, [44, 45])
+    assert checkpoint.load("456") == (7, [])
+
+
+def test_lifecycle_stops_on_signal_and_restores_handlers():
+    """Tests a signal calls the stop functions once, and a second signal is handled by the previous handler"""
+    def previous(signum, frame):
+        pass
+
+    signal.signal(signal.SIGUSR1, previous)
+    stop = mock.MagicMock()
+    lifecycle = Lifecycle(signals=[signal.SIGUSR1])
+
+    lifecycle.install(stop)
+    os.kill(os.getpid(), signal.SIGUSR1)
+
+    assert lifecycle.stopping
+    stop.assert_called_once()
+    assert signal.getsignal(signal.SIGUSR1) is previous
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+
+def test_lifecycle_shutdown_drains_updates_and_closes_resources(db):
+    """Tests shutdown processes the queued updates before flushing buffers and closing connections"""
+    processed = []
+    release = threading.Event()
+
+    def process(updates):
+        release.wait(5)
+        processed.extend(u.update_id for u in updates)
+
+    dispatcher = UpdateDispatcher(process, workers=2)
+    dispatcher.start()
+    for update_id in range(1, 6):
+        dispatcher.submit(_message_update(update_id, update_id))
+
+    transport = mock.MagicMock()
+    lifecycle = Lifecycle(drain_timeout=5)
+    with mock.patch("botstarter.lifecycle.writebehind") as writebehind, \
+            mock.patch("botstarter.lifecycle.base.close_db") as close_db:
+        release.set()
+        assert lifecycle.shutdown(dispatcher, transport)
+
+    assert sorted(processed) == [1, 2, 3, 4, 5]
+    writebehind.close_all.assert_called_once()
+    transport.close.assert_called_once()
+    close_db.assert_called_once()
+
+
+def test_lifecycle_shutdown_stops_waiting_after_drain_timeout(db):
+    """Tests shutdown returns False when updates are still being processed after the drain timeout"""
+    release = threading.Event()
+    dispatcher = UpdateDispatcher(lambda updates: release.wait(5), workers=1)
+    dispatcher.start()
+    dispatcher.submit(_message_update(1, 1))
+
+    lifecycle = Lifecycle(drain_timeout=0.1)
+    with mock.patch("botstarter.lifecycle.writebehind"), mock.patch("botstarter.lifecycle.base.close_db"):
+        assert not lifecycle.shutdown(dispatcher)
+    release.set()
+
+
+def test_start_polls_from_checkpoint_and_saves_it_on_shutdown(db):
+    """Tests a restarted bot skips the updates processed before the restart and saves the new checkpoint"""
+    db.bot_checkpoints.insert_one({"_id": "123", "offset": 10, "processed": [12]})
+    test_bot = telebot.TeleBot("123:TEST", threaded=False)
+    handled = []
+
+    @test_bot.message_handler(func=lambda msg: True)
+    def handle(msg):
+        handled.append(msg.message_id)
+
+    def infinity_polling():
+        # the first getUpdates request confirms the updates of the checkpoint offset
+        assert test_bot.last_update_id == 10
+        test_bot.process_new_updates([_message_update(i, 1) for i in (11, 12, 13)])
+        bot.get_lifecycle().stop()
+
+    lifecycle = Lifecycle(signals=[])
+    with mock.patch("botstarter.bot.__bot", test_bot), \
+            mock.patch("botstarter.bot.__lifecycle", lifecycle), \
+            mock.patch("botstarter.bot.__dispatcher", None), \
+            mock.patch("botstarter.lifecycle.writebehind"), \
+            mock.patch("botstarter.lifecycle.base.close_db"), \
+            mock.patch.object(test_bot, "infinity_polling", side_effect=infinity_polling):
+        bot.start()
+
+    assert sorted(handled) == [11, 13]
+    assert db.bot_checkpoints.find_one({"_id": "123"}) == {"_id": "123", "offset": 13, "processed": []}
+
+
+def test_lifecycle_drain_timeout_counts_from_stop():
+    """Tests the time waiting for the polling to stop is deducted from the drain timeout"""
+    dispatcher = mock.MagicMock()
+    lifecycle = Lifecycle(drain_timeout=20, signals=[])
+    with mock.patch("botstarter.lifecycle.monotonic", side_effect=[100, 115]), \
+            mock.patch("botstarter.lifecycle.writebehind"), \
+            mock.patch("botstarter.lifecycle.base.close_db"):
+        lifecycle.stop()
+        lifecycle.shutdown(dispatcher)
+
+    dispatcher.drain.assert_called_once_with(5)
+
+
+def test_start_restores_update_processing_on_shutdown(db):
+    """Tests telebot processes the updates itself once the bot is stopped, and the bot can be started again"""
+    test_bot = telebot.TeleBot("123:TEST", threaded=False)
+    original = test_bot.process_new_updates
+    handled = []
+    update_ids = iter(range(1, 10))
+
+    @test_bot.message_handler(func=lambda msg: True)
+    def handle(msg):
+        handled.append(msg.message_id)
+
+    def infinity_polling():
+        test_bot.process_new_updates([_message_update(next(update_ids), 1)])
+        bot.get_lifecycle().stop()
+
+    with mock.patch("botstarter.bot.__bot", test_bot), \
+            mock.patch("botstarter.bot.__dispatcher", None), \
+            mock.patch("botstarter.lifecycle.writebehind"), \
+            mock.patch("botstarter.lifecycle.base.close_db"), \
+            mock.patch.object(test_bot, "infinity_polling", side_effect=infinity_polling):
+        for _ in range(2):
+            with mock.patch("botstarter.bot.__lifecycle", Lifecycle(signals=[])):
+                bot.start()
+            assert test_bot.process_new_updates == original
+            assert getattr(bot, "__dispatcher") is None
+
+    assert handled == [1, 2]
+    test_bot.process_new_updates([_message_update(3, 1)])
+    assert handled == [1, 2, 3]
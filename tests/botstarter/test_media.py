@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+import mock
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from botstarter.db import medias
+from botstarter.db.medias import Media
+from botstarter.media import MediaCache, expand_paths, guess_media_type, warm_media
+
+
+@pytest.fixture
+def medias_collection():
+    collection = mongomock.MongoClient().db.medias
+    with mock.patch.object(Media, "__collection__", collection):
+        yield collection
+
+
+class FakeApi:
+    """Records sent media and returns messages with a file id for each uploaded file"""
+
+    def __init__(self, media_type="photo", delay=0):
+        self.media_type = media_type
+        self.delay = delay
+        self.uploads = []
+        self.sent_ids = []
+        self.lock = threading.Lock()
+
+    def send(self, media):
+        time.sleep(self.delay)
+        with self.lock:
+            if isinstance(media, str):
+                self.sent_ids.append(media)
+                file_id = media
+            else:
+                self.uploads.append(media)
+                file_id = f"file-{len(self.uploads)}"
+        message = mock.MagicMock()
+        if self.media_type == "photo":
+            message.photo = [mock.MagicMock(file_id="thumbnail"), mock.MagicMock(file_id=file_id)]
+        else:
+            getattr(message, self.media_type).file_id = file_id
+        return message
+
+
+def _write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_media_is_uploaded_once(medias_collection, tmp_path):
+    """Tests a file is uploaded the first time and sent by file id afterwards"""
+    path = _write(tmp_path / "a.png", b"image")
+    api, cache = FakeApi(), MediaCache()
+
+    cache.send(path, "photo", api.send)
+    cache.send(path, "photo", api.send)
+
+    assert len(api.uploads) == 1
+    assert api.uploads[0].closed
+    assert api.sent_ids == ["file-1"]
+    assert medias_collection.find_one({"media_type": "photo"})["upload_id"] == "file-1"
+
+
+def test_same_content_at_different_paths_is_uploaded_once(medias_collection, tmp_path):
+    """Tests files are identified by content rather than path"""
+    api, cache = FakeApi(media_type="document"), MediaCache()
+
+    cache.send(_write(tmp_path / "a.pdf", b"doc"), "document", api.send)
+    cache.send(_write(tmp_path / "b.pdf", b"doc"), "document", api.send)
+
+    assert len(api.uploads) == 1
+    assert api.sent_ids == ["file-1"]
+
+
+def test_edited_file_is_uploaded_again(medias_collection, tmp_path):
+    """Tests a file changed in place is uploaded again"""
+    path = _write(tmp_path / "a.png", b"image")
+    api, cache = FakeApi(), MediaCache()
+    cache.send(path, "photo", api.send)
+
+    _write(path, b"edited image")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    cache.send(path, "photo", api.send)
+
+    assert len(api.uploads) == 2
+
+
+def test_file_ids_are_read_from_database(medias_collection, tmp_path):
+    """Tests file ids saved by another process are used"""
+    path = _write(tmp_path / "a.png", b"image")
+    MediaCache().send(path, "photo", FakeApi().send)
+
+    api = FakeApi()
+    MediaCache().send(path, "photo", api.send)
+
+    assert api.uploads == []
+    assert api.sent_ids == ["file-1"]
+
+
+def test_concurrent_first_sends_upload_once(medias_collection, tmp_path):
+    """Tests concurrent sends of a file that was never uploaded wait for a single upload"""
+    path = _write(tmp_path / "a.mp4", b"video")
+    api, cache = FakeApi(media_type="video", delay=0.05), MediaCache()
+
+    threads = [threading.Thread(target=cache.send, args=(path, "video", api.send)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert len(api.uploads) == 1
+    assert api.sent_ids == ["file-1"] * 4
+
+
+def test_unsupported_media_type(medias_collection, tmp_path):
+    """Tests a ValueError is raised for unsupported media types"""
+    with pytest.raises(ValueError):
+        MediaCache().send(_write(tmp_path / "a.txt", b"text"), "sticker", FakeApi().send)
+
+
+def test_expand_paths(tmp_path):
+    """Tests files, directories and glob patterns are expanded to the matching files once"""
+    a = _write(tmp_path / "a.png", b"a")
+    os.mkdir(tmp_path / "sub")
+    b = _write(tmp_path / "sub" / "b.mp4", b"b")
+
+    assert expand_paths(str(tmp_path / "*.png")) == [a]
+    assert expand_paths([str(tmp_path / "sub"), b, str(tmp_path / "**" / "*.mp4")]) == [b]
+    assert expand_paths(str(tmp_path / "missing.png")) == []
+
+
+def test_guess_media_type():
+    """Tests media types are guessed from the file extension"""
+    assert guess_media_type("a.JPG") == "photo"
+    assert guess_media_type("a.gif") == "animation"
+    assert guess_media_type("a.mp4") == "video"
+    assert guess_media_type("a.mp3") == "audio"
+    assert guess_media_type("a.pdf") == "document"
+
+
+def test_warm_media(medias_collection, tmp_path):
+    """Tests warm up uploads new files to the staging chats and skips files that were already uploaded"""
+    _write(tmp_path / "a.png", b"a")
+    _write(tmp_path / "b.png", b"b")
+    _write(tmp_path / "c.png", b"c")
+    api, cache = FakeApi(), MediaCache()
+    bot = mock.MagicMock()
+    bot.send_photo.side_effect = lambda photo, **kwargs: api.send(photo)
+    cache.send(str(tmp_path / "a.png"), "photo", api.send)
+
+    with mock.patch("botstarter.bot.__bot", bot), mock.patch("botstarter.bot.__media_cache", cache):
+        report = warm_media(str(tmp_path / "*.png"), chat_id=[-1, -2], concurrency=2)
+
+    assert (report.uploaded, report.skipped, report.failed) == (2, 1, 0)
+    assert report.uploaded_bytes == 2
+    assert len(api.uploads) == 3
+    assert sorted(c.kwargs["chat_id"] for c in bot.send_photo.call_args_list) == [-2, -1]
+    assert bot.delete_message.call_count == 2
+    assert medias_collection.count_documents({}) == 3
+
+
+def test_save_media_updates_media_inserted_concurrently(medias_collection):
+    """Tests a media inserted by another process between the upsert lookup and insert is updated"""
+    medias_collection.insert_one({"hash": "h", "media_type": "photo", "path": "a.png", "upload_id": "file-1"})
+    update_one = medias_collection.update_one
+
+    def concurrent_insert(*args, **kwargs):
+        if kwargs.get("upsert"):
+            raise DuplicateKeyError("E11000 duplicate key error")
+        return update_one(*args, **kwargs)
+
+    with mock.patch.object(medias_collection, "update_one", side_effect=concurrent_insert):
+        medias.save_media("b.png", "file-2", "h", "photo")
+
+    assert [(m["path"], m["upload_id"]) for m in medias_collection.find({"hash": "h"})] == [("b.png", "file-2")]
+
+
+def test_media_hash_index_is_unique():
+    """Tests medias are unique by content hash and media type, ignoring the medias saved by path only"""
+    index = next(i.document for i in Media.__indexes__ if i.document["name"] == "hash_1_media_type_1")
+    assert index["unique"]
+    assert index["partialFilterExpression"] == {"hash": {"$exists": True}}
@@ -0,0 +1,112 @@
+import urllib.request
+
+import mock
+import mongomock
+import pytest
+
+from botstarter import bot, metrics
+from botstarter.db.users import User
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.set_enabled(True)
+    metrics.reset()
+
+
+def test_histogram_buckets():
+    """Tests observations are counted in cumulative buckets"""
+    histogram = metrics.Histogram("test_duration_seconds", "test", ("op",), buckets=(0.1, 1))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.1, "a")
+    histogram.observe(5, "a")
+
+    assert histogram.get("a") == {"count": 3, "sum": pytest.approx(5.15), "buckets": {0.1: 2, 1: 2, float("inf"): 3}}
+    assert histogram.get("b") is None
+
+
+def test_render_prometheus():
+    """Tests metrics are rendered in the Prometheus text format"""
+    histogram = metrics.Histogram("test_duration_seconds", "Test duration", ("op",), buckets=(0.5,))
+    histogram.observe(0.25, 'say "hi"')
+    counter = metrics.Counter("test_total", "Test count")
+    counter.inc(amount=2)
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_duration_seconds Test duration",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{op="say \\"hi\\"",le="0.5"} 1',
+        'test_duration_seconds_bucket{op="say \\"hi\\"",le="+Inf"} 1',
+        'test_duration_seconds_sum{op="say \\"hi\\""} 0.25',
+        'test_duration_seconds_count{op="say \\"hi\\""} 1',
+    ]
+    assert counter.render().splitlines()[-1] == "test_total 2"
+
+
+def test_sinks_and_disabling():
+    """Tests sinks receive observations and nothing is recorded when metrics are disabled"""
+    sink = mock.MagicMock()
+    metrics.add_sink(sink)
+    try:
+        metrics.API_CALL_RETRIES.inc("send_message", "timeout")
+        metrics.set_enabled(False)
+        metrics.API_CALL_RETRIES.inc("send_message", "timeout")
+    finally:
+        metrics.remove_sink(sink)
+
+    sink.assert_called_once_with("botstarter_api_call_retries_total",
+                                 {"method": "send_message", "reason": "timeout"}, 1)
+    assert metrics.API_CALL_RETRIES.get("send_message", "timeout") == 1
+
+
+def test_instrument_handler():
+    """Tests handler durations and errors are recorded"""
+
+    @metrics.instrument_handler("message", "failing")
+    def failing(msg):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        failing(None)
+
+    assert failing.__name__ == "failing"
+    assert metrics.HANDLER_DURATION.get("message", "failing")["count"] == 1
+    assert metrics.HANDLER_ERRORS.get("message", "failing") == 1
+
+
+def test_api_calls_are_recorded():
+    """Tests API calls are timed by method"""
+    telebot = mock.MagicMock()
+    telebot.send_message.__name__ = "send_message"
+
+    with mock.patch("botstarter.bot.__bot", telebot):
+        bot.send_message(1, "hello")
+
+    assert metrics.API_CALL_DURATION.get("send_message")["count"] == 1
+
+
+def test_db_operations_are_recorded():
+    """Tests model operations are timed by model and operation"""
+    with mock.patch.object(User, "__collection__", mongomock.MongoClient().db.users):
+        User({"id": 1}).save()
+        User.find_one({"id": 1})
+
+    assert metrics.DB_OPERATION_DURATION.get("User", "save")["count"] == 1
+    assert metrics.DB_OPERATION_DURATION.get("User", "find_one")["count"] == 1
+
+
+def test_http_server():
+    """Tests metrics are served at the /metrics path"""
+    metrics.API_CALL_TIMEOUTS.inc("send_photo")
+    server = metrics.start_http_server(port=0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'botstarter_api_call_timeouts_total{method="send_photo"} 1' in body
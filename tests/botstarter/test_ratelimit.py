@@ -0,0 +1,135 @@
+import threading
+import time
+
+import mock
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from botstarter import metrics
+from botstarter.ratelimit import TokenBucket, SendScheduler, send_priority, PRIORITY_BULK
+
+
+def _too_many_requests(retry_after):
+    return ApiTelegramException("sendMessage", None, {
+        "ok": False,
+        "error_code": 429,
+        "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after}
+    })
+
+
+def test_token_bucket_allows_bursts_up_to_capacity():
+    """Tests a bucket hands out tokens without waiting until its capacity is used"""
+    bucket = TokenBucket(rate=1, capacity=3)
+    now = bucket.updated_at
+
+    assert [bucket.reserve(now) for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve(now) == pytest.approx(1)
+    assert bucket.reserve(now) == pytest.approx(2)
+
+
+def test_token_bucket_refills_over_time():
+    """Tests tokens become available again at the bucket rate"""
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated_at
+
+    assert bucket.reserve(now) == 0
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_token_bucket_pause():
+    """Tests no tokens are handed out while the bucket is paused"""
+    bucket = TokenBucket(rate=1, capacity=3)
+    now = bucket.updated_at
+    bucket.pause(now, 5)
+
+    assert bucket.delay(now) == pytest.approx(5)
+
+
+@mock.patch("botstarter.ratelimit.sleep")
+def test_scheduler_retries_after_429(sleep_mock):
+    """Tests calls failing with a 429 error are retried after the retry_after delay"""
+    scheduler = SendScheduler()
+    func = mock.MagicMock(side_effect=[_too_many_requests(7), "sent"])
+
+    assert scheduler.call(func, rate_limit_chat_id=1, chat_id=1, text="hello") == "sent"
+    assert func.call_count == 2
+    func.assert_called_with(chat_id=1, text="hello")
+    assert sleep_mock.call_args.args[0] == pytest.approx(7, abs=0.1)
+    assert scheduler.stats()["rate_limited"] == 1
+
+
+@mock.patch("botstarter.ratelimit.sleep")
+def test_scheduler_gives_up_after_max_retries(sleep_mock):
+    """Tests 429 errors are raised once the retries are exhausted"""
+    scheduler = SendScheduler(max_retries=1)
+    func = mock.MagicMock(side_effect=_too_many_requests(1))
+
+    with pytest.raises(ApiTelegramException):
+        scheduler.call(func, rate_limit_chat_id=1, chat_id=1)
+    assert func.call_count == 2
+
+
+@mock.patch("botstarter.ratelimit.sleep")
+def test_scheduler_paces_calls_to_the_same_chat(sleep_mock):
+    """Tests calls to the same chat wait once the chat burst is used"""
+    scheduler = SendScheduler(chat_rate=1, chat_burst=2)
+
+    for _ in range(2):
+        scheduler.acquire(chat_id=1)
+    sleep_mock.assert_not_called()
+
+    scheduler.acquire(chat_id=1)
+    assert sleep_mock.call_args.args[0] == pytest.approx(1, abs=0.1)
+
+    # other chats are not affected
+    sleep_mock.reset_mock()
+    scheduler.acquire(chat_id=2)
+    sleep_mock.assert_not_called()
+
+
+def test_scheduler_serves_interactive_calls_first():
+    """Tests calls waiting for the global limit are served by priority"""
+    scheduler = SendScheduler(global_rate=20)
+    for _ in range(20):
+        scheduler.acquire()
+
+    served = []
+
+    def bulk():
+        with send_priority(PRIORITY_BULK):
+            scheduler.acquire()
+        served.append("bulk")
+
+    def interactive():
+        scheduler.acquire()
+        served.append("interactive")
+
+    threads = [threading.Thread(target=bulk), threading.Thread(target=interactive)]
+    threads[0].start()
+    time.sleep(0.01)
+    threads[1].start()
+    for t in threads:
+        t.join(5)
+
+    assert served == ["interactive", "bulk"]
+    wait_time = scheduler.stats()["wait_time"]
+    assert wait_time[PRIORITY_BULK]["count"] == 1
+
+
+def test_scheduler_records_wait_time_apart_from_call_duration():
+    """Tests the time calls wait for the rate limits is not recorded as API call duration"""
+    metrics.reset()
+    scheduler = SendScheduler(chat_rate=10, chat_burst=1)
+    func = mock.MagicMock(return_value="sent")
+    func.__name__ = "send_message"
+
+    for _ in range(2):
+        scheduler.call(func, rate_limit_chat_id=1, chat_id=1)
+
+    assert metrics.API_CALL_WAIT.get("send_message")["count"] == 2
+    assert metrics.API_CALL_WAIT.get("send_message")["sum"] >= 0.05
+    assert metrics.API_CALL_DURATION.get("send_message")["count"] == 2
+    assert metrics.API_CALL_DURATION.get("send_message")["sum"] < 0.05
+    metrics.reset()
@@ -0,0 +1,112 @@
+import fakeredis
+import mock
+import mongomock
+import pytest
+import telebot
+from telebot import types
+
+from botstarter import bot
+from botstarter.db import users
+from botstarter.state import ConversationState, MemoryStateStore, MongoStateStore, RedisStateStore, \
+    UserFieldStateStore
+
+STATE = ConversationState("ASK_ADDRESS", ["42"], {"items": [1, 2]})
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    with mock.patch.object(users.User, "__collection__", db.users), \
+            mock.patch("botstarter.db.base.get_db", return_value=db):
+        users.configure_cache(maxsize=10, ttl=None)
+        yield db
+
+
+@pytest.fixture(params=["memory", "mongo", "redis", "user_field"])
+def store(request, db):
+    if request.param == "memory":
+        return MemoryStateStore()
+    elif request.param == "mongo":
+        return MongoStateStore()
+    elif request.param == "redis":
+        return RedisStateStore(client=fakeredis.FakeRedis())
+    else:
+        db.users.insert_one({"id": 1})
+        return UserFieldStateStore()
+
+
+def test_state_store_pops_state_once(store):
+    """Tests a state is returned by the first pop only"""
+    store.set(1, STATE)
+    assert store.pop(1) == STATE
+    assert store.pop(1) is None
+
+
+def test_state_store_replaces_state(store):
+    """Tests setting a state replaces the previous one"""
+    store.set(1, STATE)
+    store.set(1, ConversationState("OTHER"))
+    assert store.pop(1) == ConversationState("OTHER", [], None)
+
+
+def test_state_store_expires_states(store):
+    """Tests expired states are not returned"""
+    store.set(1, STATE, ttl=-1)
+    assert store.pop(1) is None
+
+
+def test_mongo_state_store_creates_ttl_index(db):
+    """Tests the states collection has a TTL index on the expiration date"""
+    MongoStateStore().set(1, STATE)
+    index = [i for i in db.conversation_states.list_indexes() if i["key"] == {"expires_at": 1}][0]
+    assert index["expireAfterSeconds"] == 0
+
+
+def test_user_field_store_keeps_packed_strings(db):
+    """Tests states without data or expiration are stored as packed strings, like in previous versions"""
+    db.users.insert_one({"id": 1})
+    store = UserFieldStateStore()
+    store.set(1, ConversationState("ACTION", ["p1"]))
+    assert db.users.find_one({"id": 1})["waiting_on"] == "ACTION::p1"
+    assert store.pop(1, user=users.User({"id": 1, "waiting_on": "ACTION::p1"})) == ConversationState("ACTION", ["p1"])
+    assert db.users.find_one({"id": 1})["waiting_on"] is None
+
+
+def test_user_field_store_skips_users_without_state(db):
+    """Tests no write is sent when the user read by the handler has no state"""
+    with mock.patch.object(users.User, "update_one") as update_mock:
+        assert UserFieldStateStore().pop(1, user=users.User({"id": 1, "waiting_on": None})) is None
+    update_mock.assert_not_called()
+
+
+def _message_update(user_id, text):
+    return types.Update.de_json({
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "test"},
+            "text": text
+        }
+    })
+
+
+def test_user_reply_is_routed_with_state_data(db):
+    """Tests a reply is routed to the user_msg_callback handler of the state with its params and data"""
+    test_bot = telebot.TeleBot("123:TEST", threaded=False)
+    handler = mock.MagicMock()
+    with mock.patch("botstarter.bot.__bot", test_bot), \
+            mock.patch("botstarter.bot.__state_store", MemoryStateStore()), \
+            mock.patch.dict(bot.ALL_WAITING_ON_CALLBACKS, clear=True):
+        bot._init_decorators()
+        bot.user_msg_callback("ASK_ADDRESS")(handler)
+
+        bot.wait_on_user_reply(users.User({"id": 1}), "ASK_ADDRESS", 42, data={"items": [1, 2]})
+        test_bot.process_new_updates([_message_update(1, "Main street")])
+        test_bot.process_new_updates([_message_update(1, "hello")])
+
+    handler.assert_called_once()
+    assert handler.call_args.args[2] == ["42"]
+    assert handler.call_args.kwargs == {"action_data": {"items": [1, 2]}}
+    assert db.users.find_one({"id": 1}).get("waiting_on") is None
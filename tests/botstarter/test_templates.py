@@ -0,0 +1,66 @@
+import json
+from types import SimpleNamespace
+
+import mock
+import pytest
+
+from botstarter import bot, templates, util
+from botstarter.templates import Template, TemplateCatalog
+
+
+def test_template_escapes_static_text_and_values():
+    """Tests the static text and the interpolated values are escaped for MarkdownV2"""
+    template = Template("Order #{order.id} (total: {total:.2f})!")
+
+    result = template.render(order=SimpleNamespace(id="A-1"), total=3.5)
+
+    assert result == "Order \\#A\\-1 \\(total: 3\\.50\\)\\!"
+    assert isinstance(result, util.EscapedText)
+
+
+def test_template_keep_entities():
+    """Tests the formatting of the static text is kept, including entities spanning over fields"""
+    template = Template("*Hi {name}!* See [{label}]({url})", keep_entities=True)
+
+    result = template.render(name="*Bob*", label="a.b", url="https://x.io")
+
+    assert result == "*Hi \\*Bob\\*\\!* See [a\\.b](https://x\\.io)"
+
+
+def test_template_html():
+    """Tests values are escaped for the HTML parse mode"""
+    template = Template("<b>Hi {name}</b>", parse_mode="HTML", keep_entities=True)
+    assert template.render(name="<i>Bob</i> & co") == "<b>Hi &lt;i&gt;Bob&lt;/i&gt; &amp; co</b>"
+
+
+def test_template_requires_named_fields():
+    """Tests positional fields are rejected"""
+    with pytest.raises(ValueError):
+        Template("Hello {}")
+
+
+def test_escaped_text_is_not_escaped_again():
+    """Tests rendered templates are sent without being escaped twice"""
+    telebot = mock.MagicMock(parse_mode="MarkdownV2")
+    with mock.patch("botstarter.bot.__bot", telebot):
+        bot.send_message(1, Template("Total: {total}.").render(total=1.5))
+
+    assert telebot.send_message.call_args.kwargs["text"] == "Total: 1\\.5\\."
+
+
+def test_compiled_templates_are_cached():
+    """Tests templates are compiled once"""
+    assert templates.compile_template("Cached {value}") is templates.compile_template("Cached {value}")
+
+
+def test_catalog_language_fallback(tmp_path):
+    """Tests templates are rendered in the user's language, falling back to the default language"""
+    (tmp_path / "en.json").write_text(json.dumps({"welcome": "Hello {name}!", "bye": "Bye."}))
+    (tmp_path / "pt.json").write_text(json.dumps({"welcome": "Olá {name}!"}))
+    catalog = TemplateCatalog.from_directory(str(tmp_path))
+
+    assert catalog.render("welcome", "pt-BR", name="Ana") == "Olá Ana\\!"
+    assert catalog.render("welcome", "de", name="Ana") == "Hello Ana\\!"
+    assert catalog.render("bye", "pt") == "Bye\\."
+    with pytest.raises(KeyError):
+        catalog.render("missing")
@@ -0,0 +1,135 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mock
+import pytest
+import requests
+from telebot import apihelper
+
+from botstarter import metrics
+from botstarter.transport import HttpTransport
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        payload = json.dumps({"ok": status == 200, "result": True}).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ApiHandler)
+    server.statuses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server, method="sendMessage"):
+    return f"http://127.0.0.1:{server.server_address[1]}/bot123:TEST/{method}"
+
+
+def test_connections_are_reused(api_server):
+    """Tests sequential requests are sent over the same keep-alive connection"""
+    transport = HttpTransport()
+    for _ in range(5):
+        assert transport.request("post", _url(api_server), params={"chat_id": 1}).status_code == 200
+    transport.close()
+
+    assert transport.stats() == {"requests": 5, "connections": 1, "reused": 4, "retries": 0}
+
+
+@mock.patch("botstarter.transport.sleep")
+def test_server_errors_are_retried_with_backoff(sleep_mock, api_server):
+    """Tests server errors are retried with exponentially growing random delays"""
+    metrics.reset()
+    api_server.statuses = [502, 503]
+    transport = HttpTransport(backoff_base=1, backoff_max=3)
+
+    with mock.patch("botstarter.transport.random.uniform", side_effect=lambda a, b: b) as uniform_mock:
+        response = transport.request("post", _url(api_server, "getUpdates"))
+    transport.close()
+
+    assert response.status_code == 200
+    assert [c.args for c in uniform_mock.call_args_list] == [(0, 1), (0, 2)]
+    assert transport.stats()["retries"] == 2
+    assert metrics.API_CALL_RETRIES.get("get_updates", "server_error") == 2
+
+
+@mock.patch("botstarter.transport.sleep")
+def test_requests_that_may_have_been_processed_are_not_retried(sleep_mock, api_server):
+    """Tests server errors and read timeouts of methods that send data are not retried"""
+    api_server.statuses = [502]
+    transport = HttpTransport()
+
+    assert transport.request("post", _url(api_server)).status_code == 502
+    with mock.patch.object(transport.session, "request", side_effect=requests.exceptions.ReadTimeout):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            transport.request("post", _url(api_server))
+    transport.close()
+
+    assert transport.stats()["retries"] == 0
+    sleep_mock.assert_not_called()
+
+
+@mock.patch("botstarter.transport.sleep")
+def test_requests_that_were_not_sent_are_retried(sleep_mock):
+    """Tests requests of methods that send data are retried when the connection could not be established"""
+    metrics.reset()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ApiHandler)
+    server.server_close()
+    transport = HttpTransport(max_retries=1)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.request("post", _url(server))
+
+    assert metrics.API_CALL_RETRIES.get("send_message", "connection") == 1
+
+
+@mock.patch("botstarter.transport.sleep")
+def test_connection_errors_are_raised_after_retries(sleep_mock):
+    """Tests connection errors are raised once the retries are exhausted"""
+    metrics.reset()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ApiHandler)
+    server.server_close()
+    transport = HttpTransport(max_retries=2)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.request("post", _url(server, "getMe"))
+
+    assert sleep_mock.call_count == 2
+    assert metrics.API_CALL_RETRIES.get("get_me", "connection") == 2
+
+
+def test_timeouts(api_server):
+    """Tests the connect timeout is the configured one, while the read timeout set by telebot is used"""
+    transport = HttpTransport(connect_timeout=1, read_timeout=7)
+    with mock.patch.object(transport.session, "request") as request_mock:
+        request_mock.return_value.status_code = 200
+        transport.request("post", _url(api_server), timeout=(30, 30))
+        transport.request("post", _url(api_server))
+
+    assert [c.kwargs["timeout"] for c in request_mock.call_args_list] == [(1, 30), (1, 7)]
+
+
+def test_install():
+    """Tests the transport is installed as telebot's request sender"""
+    transport = HttpTransport()
+    transport.install()
+    try:
+        assert apihelper.CUSTOM_REQUEST_SENDER == transport.request
+    finally:
+        transport.close()
+    assert apihelper.CUSTOM_REQUEST_SENDER is None
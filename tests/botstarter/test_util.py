@@ -10,6 +10,25 @@ def test_str2mdown():
     assert "\\-\\!\\.\\>\\_" == result, "Str was not converted to mdown correctly."
 
 
+def test_str2mdown_escapes_all_reserved_characters():
+    """Tests all the MarkdownV2 reserved characters, and backslashes, are escaped"""
+    result = util.str2mdown("_*[]()~`>#+-=|{}.!\\ ok")
+    assert result == "\\_\\*\\[\\]\\(\\)\\~\\`\\>\\#\\+\\-\\=\\|\\{\\}\\.\\!\\\\ ok"
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("*bold* _italic_ __underline__ ~strike~ ||spoiler||", "*bold* _italic_ __underline__ ~strike~ ||spoiler||"),
+    ("Total: 3.50 (+1)!", "Total: 3\\.50 \\(\\+1\\)\\!"),
+    ("`a.b\\c` and ```py\nx = `1`.```", "`a.b\\\\c` and ```py\nx = \\`1\\`.```"),
+    ("[see *docs*.](https://x.io/a_(b\\))", "[see *docs*\\.](https://x.io/a_(b\\))"),
+    ("2 \\* 3 = 6", "2 \\* 3 \\= 6"),
+    ("[not a link] (x)", "\\[not a link\\] \\(x\\)"),
+])
+def test_str2mdown_keep_entities(text, expected):
+    """Tests formatting entities are kept while the other reserved characters are escaped"""
+    assert util.str2mdown(text, keep_entities=True) == expected
+
+
 def test_empty_input_str2mdown():
     result = util.str2mdown(None)
     assert result is None, "Empty input not handled correctly."
@@ -0,0 +1,96 @@
+import http.client
+import json
+import queue
+
+import pytest
+
+from botstarter.webhook import WebhookServer, SECRET_TOKEN_HEADER
+
+SECRET = "s3cr3t"
+
+UPDATE = {
+    "update_id": 10,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "test"},
+        "text": "hello"
+    }
+}
+
+
+@pytest.fixture
+def server():
+    received = []
+    server = WebhookServer(received.append, host="127.0.0.1", port=0, path="/hook", secret_token=SECRET)
+    server.received = received
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, body, path="/hook", token=SECRET):
+    conn = http.client.HTTPConnection(*server.server_address)
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers[SECRET_TOKEN_HEADER] = token
+    conn.request("POST", path, body=body, headers=headers)
+    status = conn.getresponse().status
+    conn.close()
+    return status
+
+
+def test_webhook_accepts_update(server):
+    """Tests a valid update is acknowledged and handed over to the callback"""
+    assert _post(server, json.dumps(UPDATE)) == 200
+    assert len(server.received) == 1
+    assert server.received[0].update_id == 10
+    assert server.received[0].message.text == "hello"
+
+
+def test_webhook_rejects_invalid_secret_token(server):
+    """Tests requests with a wrong or missing secret token are rejected"""
+    assert _post(server, json.dumps(UPDATE), token="wrong") == 403
+    assert _post(server, json.dumps(UPDATE), token=None) == 403
+    assert server.received == []
+
+
+def test_webhook_rejects_unknown_path(server):
+    """Tests requests to paths other than the webhook path are rejected"""
+    assert _post(server, json.dumps(UPDATE), path="/other") == 404
+
+
+def test_webhook_rejects_malformed_update(server):
+    """Tests requests that don't contain a valid update are rejected"""
+    assert _post(server, "not json") == 400
+
+
+def test_webhook_rejects_update_when_queue_is_full():
+    """Tests updates are rejected with a 503 status when they can't be queued"""
+
+    def on_update(update):
+        raise queue.Full()
+
+    server = WebhookServer(on_update, host="127.0.0.1", port=0, path="/hook")
+    server.start()
+    try:
+        assert _post(server, json.dumps(UPDATE), token=None) == 503
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_webhook_raw_updates():
+    """Tests raw update mode hands over the JSON update without parsing it"""
+    received = []
+    server = WebhookServer(received.append, host="127.0.0.1", port=0, path="/hook", raw_updates=True)
+    server.start()
+    try:
+        assert _post(server, json.dumps(UPDATE), token=None) == 200
+        assert _post(server, json.dumps({"message": {}}), token=None) == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert received == [UPDATE]